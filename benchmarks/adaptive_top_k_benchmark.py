@@ -0,0 +1,109 @@
+"""
+Compares adaptive top-k against fixed top-k on an ingested collection: chunks and
+context tokens per query, and the hit rate when the questions name the file or
+the text the answer is expected in.
+
+The questions file is JSONL with a "question" and optionally "file_name" and/or
+"answer_text" per line. The collection is read as the app left it, so run this
+with the app's VECTOR_DB_BACKEND, from the project root:
+    python -m benchmarks.adaptive_top_k_benchmark --collection Default \
+        --questions questions.jsonl --fixed-k 1 2 3 5
+"""
+import argparse
+import json
+
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+import utils.vectordb as vectordb
+from utils.adaptive_top_k import AdaptiveTopKPostprocessor
+from utils.common import (
+    adaptive_candidates,
+    adaptive_min_similarity,
+    adaptive_relative_gap,
+    adaptive_token_budget,
+    parent_expansion_chars,
+)
+from utils.hierarchical import ParentWindowPostprocessor
+
+
+def is_hit(item, nodes):
+    if not item.get("file_name") and not item.get("answer_text"):
+        return None
+    for n in nodes:
+        if item.get("file_name") and n.node.metadata.get("file_name") != item["file_name"]:
+            continue
+        if item.get("answer_text") and item["answer_text"].lower() not in n.node.get_content().lower():
+            continue
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--collection", default="Default")
+    parser.add_argument("--questions", required=True)
+    parser.add_argument("--fixed-k", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--candidates", type=int, default=adaptive_candidates)
+    parser.add_argument("--relative-gap", type=float, default=adaptive_relative_gap)
+    parser.add_argument("--min-similarity", type=float, default=adaptive_min_similarity)
+    parser.add_argument("--token-budget", type=int, default=adaptive_token_budget)
+    parser.add_argument("--embed-model", default="thenlper/gte-large")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+
+    vectordb.start_vector_db()
+    vector_store = vectordb.get_vector_store(args.collection)
+    embed_model = HuggingFaceEmbedding(model_name=args.embed_model, cache_folder="./embed_models")
+    parent_window = ParentWindowPostprocessor(expansion_chars=parent_expansion_chars)
+    adaptive = AdaptiveTopKPostprocessor(
+        relative_gap=args.relative_gap,
+        min_similarity=args.min_similarity,
+        token_budget=args.token_budget,
+        record=False,
+    )
+    tokenizer = get_tokenizer()
+
+    policies = {f"fixed k={k}": k for k in args.fixed_k}
+    policies["adaptive"] = args.candidates
+    fetch_k = max(policies.values())
+    totals = {name: {"chunks": 0, "tokens": 0, "hits": 0, "labelled": 0} for name in policies}
+
+    for item in items:
+        query_embedding = embed_model.get_query_embedding(item["question"])
+        result = vector_store.query(
+            VectorStoreQuery(query_embedding=query_embedding, similarity_top_k=fetch_k)
+        )
+        candidates = [
+            NodeWithScore(node=node, score=score)
+            for node, score in zip(result.nodes, result.similarities)
+        ]
+        for name, k in policies.items():
+            nodes = parent_window.postprocess_nodes(candidates[:k], query_str=item["question"])
+            if name == "adaptive":
+                nodes = adaptive.postprocess_nodes(nodes, query_str=item["question"])
+            totals[name]["chunks"] += len(nodes)
+            totals[name]["tokens"] += sum(
+                len(tokenizer(n.node.get_content(metadata_mode=MetadataMode.LLM))) for n in nodes
+            )
+            hit = is_hit(item, nodes)
+            if hit is not None:
+                totals[name]["labelled"] += 1
+                totals[name]["hits"] += int(hit)
+
+    for name, total in totals.items():
+        hit_rate = (
+            f"{total['hits'] / total['labelled']:.3f}" if total["labelled"] else "n/a"
+        )
+        print(
+            f"{name}: queries = {len(items)}, chunks/query = {total['chunks'] / len(items):.2f}, "
+            f"context tokens/query = {total['tokens'] / len(items):.0f}, hit rate = {hit_rate}"
+        )
+
+
+if __name__ == "__main__":
+    main()
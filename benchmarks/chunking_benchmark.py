@@ -0,0 +1,107 @@
+"""
+Compares the ingest chunking of SimpleNodeParser with the token chunker: chunks/s
+and how many embedded chunks pass the embedder's max length, which the embedder
+truncates.
+
+Run from the project root, CHUNK_WORKERS sets the token chunker's processes:
+    python -m benchmarks.chunking_benchmark --dir llamindex-docs
+"""
+import argparse
+import os
+import time
+
+from llama_index.core.node_parser import SentenceSplitter, SimpleNodeParser
+from llama_index.core.schema import MetadataMode
+
+import utils.hierarchical as hierarchical
+import utils.models as models
+import utils.pdf_pages as pdf_pages
+import utils.token_chunker as token_chunker
+from utils.common import child_chunk_size, hierarchical_retrieval
+from utils.fast_readers import FastHTMLReader, FastTextReader
+
+SUFFIXES = (".html", ".htm", ".txt", ".pdf")
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 128
+
+
+def load_documents(directory, limit):
+    files = sorted(
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if f.lower().endswith(SUFFIXES)
+    )
+    files = files[:limit] if limit else files
+    readers = {".txt": FastTextReader(), ".html": FastHTMLReader()}
+    documents = []
+    for file in files:
+        extra_info = {"file_name": os.path.basename(file)}
+        if file.lower().endswith(".pdf"):
+            for batch in pdf_pages.iter_page_batches(file, extra_info=extra_info):
+                documents.extend(batch)
+        else:
+            reader = readers[".txt" if file.lower().endswith(".txt") else ".html"]
+            documents.extend(reader.load_data(file, extra_info=extra_info))
+    return documents
+
+
+def node_parser_chunks(documents):
+    nodes = SimpleNodeParser(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    ).get_nodes_from_documents(documents)
+    if hierarchical_retrieval:
+        child_parser = SentenceSplitter(
+            chunk_size=child_chunk_size, chunk_overlap=child_chunk_size // 8
+        )
+        nodes = hierarchical.split_into_children(nodes, child_parser)
+    return nodes
+
+
+def report(name, nodes, seconds, tokenizer, max_tokens):
+    lengths = [
+        len(tokenizer(n.get_content(metadata_mode=MetadataMode.EMBED))["input_ids"])
+        for n in nodes
+    ]
+    truncated = sum(1 for length in lengths if length > max_tokens)
+    print(
+        f"{name}: embedded chunks = {len(nodes)}, seconds = {seconds:.2f}, "
+        f"chunks/s = {len(nodes) / seconds:.0f}, max tokens = {max(lengths, default=0)}, "
+        f"truncated = {truncated} ({truncated / max(len(nodes), 1):.1%})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", required=True)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--embed-model", default="thenlper/gte-large")
+    args = parser.parse_args()
+
+    documents = load_documents(args.dir, args.limit)
+    if not documents:
+        print(f"no .html, .txt or .pdf files in {args.dir}")
+        return
+    print(f"{len(documents)} documents, {sum(len(d.text) for d in documents)} chars")
+
+    chunker = token_chunker.TokenChunker(
+        models.get_embed_model_path(args.embed_model),
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        child_chunk_size=child_chunk_size if hierarchical_retrieval else None,
+        child_chunk_overlap=child_chunk_size // 8,
+    )
+
+    start = time.time()
+    nodes = node_parser_chunks(documents)
+    report("node parser", nodes, time.time() - start, chunker.tokenizer, chunker.max_tokens)
+
+    # the first call starts the worker processes, time the second one
+    chunker.get_nodes(documents)
+    start = time.time()
+    _, nodes = chunker.get_nodes(documents)
+    report("token chunker", nodes, time.time() - start, chunker.tokenizer, chunker.max_tokens)
+    token_chunker.shutdown_chunk_pool()
+
+
+if __name__ == "__main__":
+    main()
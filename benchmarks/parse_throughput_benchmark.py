@@ -0,0 +1,59 @@
+"""
+Compares parse throughput of the fast .html/.txt readers against UnstructuredReader.
+
+Run from the project root, for example on the pages fetched by download_docs.py:
+    python -m benchmarks.parse_throughput_benchmark --dir llamindex-docs
+"""
+import argparse
+import os
+import time
+
+from llama_index.readers.file import UnstructuredReader
+
+from utils.fast_readers import FastHTMLReader, FastTextReader
+
+SUFFIXES = (".html", ".htm", ".txt")
+
+
+def list_files(directory, limit):
+    files = sorted(
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if f.lower().endswith(SUFFIXES)
+    )
+    return files[:limit] if limit else files
+
+
+def run(name, readers, files):
+    chars = 0
+    start = time.time()
+    for file in files:
+        reader = readers[".txt" if file.lower().endswith(".txt") else ".html"]
+        chars += sum(len(d.text) for d in reader.load_data(file, extra_info={}))
+    seconds = time.time() - start
+    megabytes = sum(os.path.getsize(f) for f in files) / (1024 * 1024)
+    print(
+        f"{name}: files = {len(files)}, seconds = {seconds:.2f}, "
+        f"files/s = {len(files) / seconds:.1f}, MB/s = {megabytes / seconds:.2f}, "
+        f"extracted chars = {chars}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", required=True)
+    parser.add_argument("--limit", type=int, default=0)
+    args = parser.parse_args()
+
+    files = list_files(args.dir, args.limit)
+    if not files:
+        print(f"no .html or .txt files in {args.dir}")
+        return
+
+    run("fast", {".html": FastHTMLReader(), ".txt": FastTextReader()}, files)
+    unstructured = UnstructuredReader()
+    run("unstructured", {".html": unstructured, ".txt": unstructured}, files)
+
+
+if __name__ == "__main__":
+    main()
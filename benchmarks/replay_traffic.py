@@ -0,0 +1,199 @@
+"""
+Replays captured traffic (TRAFFIC_CAPTURE_PATH, see utils/traffic.py) against a
+running instance of the HTTP API and reports latency distributions and errors.
+
+Requests are sent at their recorded offsets divided by --speed, or back to back
+with --speed max, with at most --concurrency in flight. Traces captured with
+hashed query texts are replayed with a question from --questions (JSONL with a
+"question" per line), the same hash always getting the same question so answer
+cache hits repeat. Ingest traces are replayed only with --kinds ingest and when
+their files were captured with paths that exist here.
+
+    python -m utils.http_api --port 8100
+    python -m benchmarks.replay_traffic --traces traffic.jsonl --speed 5 \
+        --concurrency 4 --questions questions.jsonl
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def read_traces(path, kinds):
+    with open(path, "r", encoding="utf-8") as f:
+        traces = [json.loads(line) for line in f if line.strip()]
+    return sorted((t for t in traces if t["kind"] in kinds), key=lambda t: t["ts"])
+
+
+def read_questions(path):
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+
+def query_text(trace, questions):
+    if trace.get("query"):
+        return trace["query"]
+    if questions:
+        return questions[int(trace["query_hash"], 16) % len(questions)]
+    return None
+
+
+def replay_query(target, collection, message):
+    start = time.perf_counter()
+    first_token_s = None
+    tokens = 0
+    with requests.post(
+        f"{target}/chat",
+        json={"collection": collection, "message": message, "stream": True},
+        stream=True,
+        timeout=600,
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        # unbuffered, so the first token is timed when it arrives
+        for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+            if line.startswith("event: done"):
+                break
+            if line.startswith("data:") and "token" in json.loads(line[len("data:"):]):
+                if first_token_s is None:
+                    first_token_s = time.perf_counter() - start
+                tokens += 1
+    return {"first_token_s": first_token_s, "total_s": time.perf_counter() - start, "tokens": tokens}
+
+
+def replay_ingest(target, collection, paths, questions):
+    start = time.perf_counter()
+    files = [("files", (os.path.basename(p), open(p, "rb"))) for p in paths]
+    try:
+        response = requests.post(
+            f"{target}/collections/{collection}/ingest",
+            files=files,
+            data={"questions": questions},
+            timeout=3600,
+        )
+    finally:
+        for _, (_, f) in files:
+            f.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return {"total_s": time.perf_counter() - start}
+
+
+def percentiles(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return "n/a"
+    pick = lambda q: values[min(int(q * len(values)), len(values) - 1)]
+    return (
+        f"p50 {pick(0.5):.3f}s  p90 {pick(0.9):.3f}s  p99 {pick(0.99):.3f}s  "
+        f"max {values[-1]:.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--traces", required=True)
+    parser.add_argument("--target", default="http://127.0.0.1:8100")
+    parser.add_argument("--speed", default="1", help="1, 5, ... times the recorded rate, or max")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--questions", help="questions for traces captured with hashed text")
+    parser.add_argument("--kinds", nargs="+", default=["query"], choices=["query", "ingest"])
+    parser.add_argument("--collection", help="send every request to this collection")
+    parser.add_argument("--output", help="JSONL file for the per request results")
+    args = parser.parse_args()
+
+    traces = read_traces(args.traces, args.kinds)
+    questions = read_questions(args.questions)
+    speed = None if args.speed == "max" else float(args.speed)
+    if not traces:
+        print("no traces to replay")
+        return
+
+    results = []
+    results_lock = threading.Lock()
+    skipped = 0
+
+    def run(trace, due, send):
+        started = time.perf_counter()
+        result = {
+            "trace_id": trace["trace_id"],
+            "kind": trace["kind"],
+            "lag_s": max(started - due, 0.0),
+            "recorded": trace.get("phases", {}),
+            "error": None,
+        }
+        try:
+            result.update(send())
+        except Exception as e:
+            result["error"] = str(e)
+        with results_lock:
+            results.append(result)
+
+    replay_start = time.perf_counter()
+    first_ts = traces[0]["ts"]
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for trace in traces:
+            collection = args.collection or trace["collection"]
+            if trace["kind"] == "query":
+                message = query_text(trace, questions)
+                if message is None:
+                    skipped += 1
+                    continue
+                send = lambda c=collection, m=message: replay_query(args.target, c, m)
+            else:
+                paths = [f.get("path") for f in trace.get("files", [])]
+                if not paths or not all(p and os.path.exists(p) for p in paths):
+                    skipped += 1
+                    continue
+                send = lambda c=collection, p=paths, q=trace.get("questions", 1): replay_ingest(
+                    args.target, c, p, q
+                )
+
+            due = replay_start
+            if speed is not None:
+                due += (trace["ts"] - first_ts) / speed
+                time.sleep(max(due - time.perf_counter(), 0.0))
+            pool.submit(run, trace, due, send)
+    elapsed = time.perf_counter() - replay_start
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+
+    print(
+        f"replayed {len(results)} requests in {elapsed:.1f}s "
+        f"({len(results) / elapsed:.2f} req/s) at speed {args.speed}, "
+        f"concurrency {args.concurrency}, {skipped} skipped"
+    )
+    for kind in args.kinds:
+        kind_results = [r for r in results if r["kind"] == kind]
+        if not kind_results:
+            continue
+        ok = [r for r in kind_results if r["error"] is None]
+        print(f"{kind}: {len(kind_results)} sent, {len(kind_results) - len(ok)} errors")
+        print(f"  total        {percentiles(r['total_s'] for r in ok)}")
+        print(f"  recorded     {percentiles(r['recorded'].get('total_s') for r in kind_results)}")
+        if kind == "query":
+            print(f"  first token  {percentiles(r['first_token_s'] for r in ok)}")
+            print(
+                f"  recorded     "
+                f"{percentiles(r['recorded'].get('first_token_s') for r in kind_results)}"
+            )
+        print(f"  start lag    {percentiles(r['lag_s'] for r in kind_results)}")
+        errors = {}
+        for r in kind_results:
+            if r["error"] is not None:
+                errors[r["error"]] = errors.get(r["error"], 0) + 1
+        for error, n in sorted(errors.items(), key=lambda e: -e[1]):
+            print(f"  {n} x {error}")
+
+
+if __name__ == "__main__":
+    main()
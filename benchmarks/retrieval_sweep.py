@@ -0,0 +1,391 @@
+"""
+Sweeps chunking and retrieval settings over a labeled eval set and reports the
+Pareto optimal configurations: highest hit rate and MRR for the fewest prompt
+tokens and the lowest latency.
+
+The eval set is built once per corpus with the app's question generation
+(DatasetGenerator and the question_generation llm): the documents are cut into
+`--label-chunk-size` token passages, `--questions-per-file` of them are picked
+evenly per file and each gets one generated question, labeled with the
+passage's character span. A retrieved chunk is a hit when it covers at least half
+of the labeled passage, or the passage covers at least half of the chunk, so the
+labels hold for any chunking. It is written to --eval-set and reused on the next
+run.
+
+Chunks are cut like ingest does, with the TokenChunker on the embed model's
+tokenizer or with the SentenceSplitter it falls back to, see --chunkers. Every
+(chunker, chunk size, overlap, child size) is parsed and embedded once and shared
+by all top-k and percentile cutoff values; chunk and query embeddings are cached by
+text in --embed-cache across runs. Searches are exact cosine over numpy, latency
+is query embedding + search + postprocessing, plus generation with --generate.
+
+Run from the project root, on the files of a folder or any files:
+    python -m benchmarks.retrieval_sweep --collection Default --chunkers token sentence \
+        --chunk-sizes 256 512 1024 --chunk-overlaps 32 128 --child-sizes 0 256 \
+        --top-k 1 2 3 5 --percentile-cutoffs 1.0 0.8
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import statistics
+import time
+
+import numpy as np
+from llama_index.core import Document, SimpleDirectoryReader
+from llama_index.core.evaluation import DatasetGenerator
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.postprocessor import SentenceEmbeddingOptimizer
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tokenizer
+
+import utils.catalog as catalog
+import utils.hierarchical as hierarchical
+import utils.llm_router as llm_router
+import utils.models as models
+import utils.pdf_pages as pdf_pages
+import utils.token_chunker as token_chunker
+from utils.common import token_chunking
+from utils.fast_readers import FastHTMLReader, FastTextReader
+
+SYSTEM_PROMPT = "Answer the query using only the context.\n"
+# questions whose query embedding is timed, uncached, for the latency column
+QUERY_TIMING_SAMPLES = 20
+
+
+def load_documents(paths):
+    """the documents of each file as ingest reads them, with stable ids for the labels."""
+    file_extractor = {".html": FastHTMLReader(), ".txt": FastTextReader()}
+    documents = []
+    for path in paths:
+        extra_info = {"file_name": os.path.basename(path)}
+        if path.lower().endswith(".pdf"):
+            file_documents = [
+                d for batch in pdf_pages.iter_page_batches(path, extra_info) for d in batch
+            ]
+        else:
+            file_documents = SimpleDirectoryReader(
+                input_files=[path],
+                file_extractor=file_extractor,
+                file_metadata=lambda _: extra_info,
+            ).load_data(num_workers=1)
+        for i, document in enumerate(file_documents):
+            documents.append(
+                Document(
+                    text=document.text,
+                    metadata=document.metadata,
+                    id_=f"{extra_info['file_name']}#{i}",
+                )
+            )
+    return documents
+
+
+def build_eval_set(documents, llm, label_chunk_size, questions_per_file):
+    passages = SentenceSplitter(
+        chunk_size=label_chunk_size, chunk_overlap=0
+    ).get_nodes_from_documents(documents)
+    by_file = {}
+    for passage in passages:
+        located = passage.start_char_idx is not None and passage.end_char_idx is not None
+        if located and len(passage.text) > 200:
+            by_file.setdefault(passage.metadata["file_name"], []).append(passage)
+
+    items = []
+    for file_name, file_passages in by_file.items():
+        step = max(len(file_passages) // questions_per_file, 1)
+        for passage in file_passages[::step][:questions_per_file]:
+            # one generator per passage keeps every question tied to its source
+            generator = DatasetGenerator(nodes=[passage], llm=llm, num_questions_per_chunk=1)
+            questions = generator.generate_questions_from_nodes(num=1)
+            if not questions:
+                continue
+            items.append(
+                {
+                    "question": questions[0],
+                    "doc_id": passage.ref_doc_id,
+                    "start": passage.start_char_idx,
+                    "end": passage.end_char_idx,
+                }
+            )
+            print(f"eval set: {len(items)} questions, {file_name}: {questions[0]}")
+    return items
+
+
+class EmbeddingCache:
+    """embeddings by model and text, kept on disk between runs."""
+
+    def __init__(self, path, embed_model):
+        self.path = path
+        self.embed_model = embed_model
+        self.vectors = {}
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.vectors = pickle.load(f)
+
+    def key(self, kind, text):
+        key = f"{self.embed_model.model_name}\0{kind}\0{text}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def embed(self, texts, kind="text"):
+        missing = list({t for t in texts if self.key(kind, t) not in self.vectors})
+        if missing:
+            if kind == "query":
+                embeddings = [self.embed_model.get_query_embedding(t) for t in missing]
+            else:
+                embeddings = self.embed_model.get_text_embedding_batch(missing, show_progress=True)
+            for text, embedding in zip(missing, embeddings):
+                self.vectors[self.key(kind, text)] = np.asarray(embedding, dtype=np.float32)
+        return np.stack([self.vectors[self.key(kind, t)] for t in texts])
+
+    def save(self):
+        if self.path:
+            with open(self.path, "wb") as f:
+                pickle.dump(self.vectors, f)
+
+
+def node_span(node):
+    """(doc id, start, end) of a chunk in its document."""
+    metadata = node.metadata
+    parent_start = metadata.get(hierarchical.PARENT_START_KEY)
+    if hierarchical.CHILD_SPAN_KEY in metadata and parent_start is not None:
+        start, end = metadata[hierarchical.CHILD_SPAN_KEY]
+        return node.ref_doc_id, parent_start + start, parent_start + end
+    return node.ref_doc_id, node.start_char_idx, node.end_char_idx
+
+
+def is_hit(node, item):
+    doc_id, start, end = node_span(node)
+    if doc_id != item["doc_id"] or start is None or end is None:
+        return False
+    overlap = min(end, item["end"]) - max(start, item["start"])
+    return overlap >= 0.5 * min(end - start, item["end"] - item["start"])
+
+
+def l2_normalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def chunk_documents(documents, chunker, chunk_size, chunk_overlap, child_size, tokenizer_path):
+    """(parent chunks, chunks to embed) cut the way ingest does with this chunker."""
+    if chunker == "token":
+        return token_chunker.TokenChunker(
+            tokenizer_path,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            child_chunk_size=child_size or None,
+            child_chunk_overlap=child_size // 8,
+        ).get_nodes(documents)
+    nodes = SentenceSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    ).get_nodes_from_documents(documents)
+    if not child_size:
+        return nodes, nodes
+    return nodes, hierarchical.split_into_children(
+        nodes, SentenceSplitter(chunk_size=child_size, chunk_overlap=child_size // 8)
+    )
+
+
+def build_index(documents, chunker, chunk_size, chunk_overlap, child_size, tokenizer_path, cache):
+    """(embedded nodes, their normalized embeddings, parent id -> text, seconds)."""
+    start = time.time()
+    parents, nodes = chunk_documents(
+        documents, chunker, chunk_size, chunk_overlap, child_size, tokenizer_path
+    )
+    parent_texts = {n.node_id: n.text for n in parents} if child_size else {}
+    matrix = l2_normalize(
+        cache.embed([n.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes])
+    )
+    return nodes, matrix, parent_texts, time.time() - start
+
+
+def pareto_front(rows):
+    """rows no other row matches or beats on hit rate, MRR, prompt tokens and latency."""
+    def dominates(a, b):
+        at_least = (
+            a["hit_rate"] >= b["hit_rate"]
+            and a["mrr"] >= b["mrr"]
+            and a["prompt_tokens"] <= b["prompt_tokens"]
+            and a["latency_ms"] <= b["latency_ms"]
+        )
+        better = (
+            a["hit_rate"] > b["hit_rate"]
+            or a["mrr"] > b["mrr"]
+            or a["prompt_tokens"] < b["prompt_tokens"]
+            or a["latency_ms"] < b["latency_ms"]
+        )
+        return at_least and better
+
+    return [r for r in rows if not any(dominates(o, r) for o in rows if o is not r)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--collection", help="sweep over the files of this folder")
+    parser.add_argument("--files", nargs="*", default=[])
+    parser.add_argument("--eval-set", help="JSONL eval set, generated when it doesn't exist")
+    parser.add_argument("--questions-per-file", type=int, default=10)
+    parser.add_argument("--label-chunk-size", type=int, default=256)
+    parser.add_argument(
+        "--chunkers", nargs="+", choices=["token", "sentence"],
+        default=["token"] if token_chunking else ["sentence"],
+        help="token is ingest's TokenChunker, sentence the SentenceSplitter of TOKEN_CHUNKING=0",
+    )
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[512, 1024])
+    parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=[64, 128])
+    parser.add_argument(
+        "--child-sizes", type=int, nargs="+", default=[0, 256],
+        help="0 indexes the chunks directly",
+    )
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument(
+        "--percentile-cutoffs", type=float, nargs="+", default=[1.0, 0.8],
+        help="1.0 keeps every sentence",
+    )
+    parser.add_argument("--expansion-chars", type=int, default=1024)
+    parser.add_argument("--model", default="TheBloke/Mistral-7B-Instruct-v0.2-GGUF")
+    parser.add_argument("--embed-model", default="thenlper/gte-large")
+    parser.add_argument("--embed-cache", default="sweep-embeddings.pkl")
+    parser.add_argument("--generate", action="store_true", help="time answer generation too")
+    parser.add_argument("--output", help="JSON file for every configuration's metrics")
+    args = parser.parse_args()
+
+    paths = list(args.files)
+    if args.collection:
+        paths += catalog.file_paths(args.collection)
+    if not paths:
+        parser.error("no files, give --collection or --files")
+    eval_set_path = args.eval_set or f"eval-set-{args.collection or 'files'}.jsonl"
+
+    documents = load_documents(paths)
+    print(f"{len(documents)} documents from {len(paths)} files")
+
+    answer_llm = None
+    if not os.path.exists(eval_set_path) or args.generate:
+        answer_llm, embed_model = models.load_models(
+            args.model, args.embed_model, temperature=0.0, max_new_tokens=256,
+            context_window=3900, n_gpu_layers=0,
+        )
+    else:
+        embed_model = models.load_embed_model(args.embed_model)
+
+    if os.path.exists(eval_set_path):
+        with open(eval_set_path, "r", encoding="utf-8") as f:
+            items = [json.loads(line) for line in f if line.strip()]
+    else:
+        items = build_eval_set(
+            documents,
+            llm_router.get_llm(llm_router.TASK_QUESTION_GENERATION),
+            args.label_chunk_size,
+            args.questions_per_file,
+        )
+        with open(eval_set_path, "w", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+    print(f"eval set {eval_set_path}: {len(items)} questions")
+    if not items:
+        raise SystemExit(
+            f"the eval set {eval_set_path} has no questions, the files gave no labeled "
+            "passages or no question was generated; delete it to generate it again"
+        )
+
+    cache = EmbeddingCache(args.embed_cache, embed_model)
+    query_matrix = l2_normalize(cache.embed([i["question"] for i in items], kind="query"))
+    # the cache answers reruns without the model, time real query embeddings instead
+    timed = items[:QUERY_TIMING_SAMPLES]
+    start = time.time()
+    for item in timed:
+        embed_model.get_query_embedding(item["question"])
+    embed_query_s = (time.time() - start) / len(timed)
+    tokenizer = get_tokenizer()
+    tokenizer_path = (
+        models.get_embed_model_path(args.embed_model) if "token" in args.chunkers else None
+    )
+    optimizers = {
+        cutoff: SentenceEmbeddingOptimizer(embed_model=embed_model, percentile_cutoff=cutoff)
+        for cutoff in args.percentile_cutoffs
+        if cutoff < 1.0
+    }
+
+    rows = []
+    for chunker, chunk_size, chunk_overlap, child_size in itertools.product(
+        args.chunkers, args.chunk_sizes, args.chunk_overlaps, args.child_sizes
+    ):
+        if chunk_overlap >= chunk_size or child_size >= chunk_size:
+            continue
+        nodes, matrix, parent_texts, build_s = build_index(
+            documents, chunker, chunk_size, chunk_overlap, child_size, tokenizer_path, cache
+        )
+        cache.save()
+        # the parents are kept in memory here instead of the app's parent store
+        parent_window = hierarchical.ParentWindowPostprocessor(
+            get_parent_texts=lambda ids: {i: parent_texts[i] for i in ids if i in parent_texts},
+            expansion_chars=args.expansion_chars,
+        )
+        for top_k, cutoff in itertools.product(args.top_k, args.percentile_cutoffs):
+            hits, reciprocal_ranks, prompt_tokens, latencies = 0, 0.0, [], []
+            for item, query_vector in zip(items, query_matrix):
+                start = time.time()
+                scores = matrix @ query_vector
+                top = np.argsort(-scores)[:top_k]
+                retrieved = [NodeWithScore(node=nodes[i], score=float(scores[i])) for i in top]
+                rank = next(
+                    (r for r, n in enumerate(retrieved, 1) if is_hit(n.node, item)), None
+                )
+                hits += rank is not None
+                reciprocal_ranks += 1.0 / rank if rank else 0.0
+
+                context_nodes = retrieved
+                if child_size:
+                    context_nodes = parent_window.postprocess_nodes(
+                        context_nodes, query_str=item["question"]
+                    )
+                if cutoff in optimizers:
+                    context_nodes = optimizers[cutoff].postprocess_nodes(
+                        context_nodes, query_str=item["question"]
+                    )
+                context_str = "\n\n".join(
+                    n.node.get_content(metadata_mode=MetadataMode.LLM).strip()
+                    for n in context_nodes
+                )
+                prompt = SYSTEM_PROMPT + context_str + "\n" + item["question"]
+                prompt_tokens.append(len(tokenizer(prompt)))
+                if args.generate:
+                    answer_llm.chat([ChatMessage(role=MessageRole.USER, content=prompt)])
+                latencies.append(embed_query_s + time.time() - start)
+
+            rows.append(
+                {
+                    "chunker": chunker,
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "child_size": child_size,
+                    "top_k": top_k,
+                    "percentile_cutoff": cutoff,
+                    "hit_rate": round(hits / len(items), 3),
+                    "mrr": round(reciprocal_ranks / len(items), 3),
+                    "prompt_tokens": round(statistics.mean(prompt_tokens)),
+                    "latency_ms": round(statistics.median(latencies) * 1000, 1),
+                    "index_build_s": round(build_s, 1),
+                }
+            )
+
+    if not rows:
+        raise SystemExit("nothing to sweep, every overlap or child size is >= the chunk size")
+    front = pareto_front(rows)
+    columns = list(rows[0])
+    print("  ".join(["pareto"] + columns))
+    for row in sorted(rows, key=lambda r: (-r["hit_rate"], -r["mrr"], r["prompt_tokens"])):
+        mark = "*" if row in front else " "
+        print("  ".join([f"{mark:6}"] + [f"{row[c]!s:>{len(c)}}" for c in columns]))
+    print(f"{len(front)} Pareto optimal configurations of {len(rows)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"configurations": rows, "pareto": front}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Measures generation tokens/s of the answer model with and without speculative
+decoding on RAG style prompts, and checks that greedy (temperature 0) output is
+identical to plain decoding.
+
+Run from the project root:
+    python -m benchmarks.speculative_decoding_benchmark --context-file doc.txt \
+        --questions "What does the product do?" "Which formats are supported?"
+"""
+import argparse
+import time
+
+from huggingface_hub import hf_hub_download
+from llama_cpp import Llama
+from llama_index.llms.llama_cpp.llama_utils import completion_to_prompt
+
+import utils.llama_cpp_tuning as llama_cpp_tuning
+from utils.common import supported_llm_models
+from utils.speculative import build_draft_model
+
+DEFAULT_MODEL = "TheBloke/Mistral-7B-Instruct-v0.2-GGUF"
+DEFAULT_CONTEXT = (
+    "The application lets users upload PDF, HTML and text documents into folders. "
+    "Each folder is indexed separately: documents are split into chunks, every chunk "
+    "is embedded with the gte-large model and stored in the vector store. When a "
+    "question is asked, the most similar chunks of the selected folder are retrieved "
+    "and passed to the Mistral 7B instruct model, which answers the question using "
+    "only the retrieved context and cites the source document."
+)
+DEFAULT_QUESTIONS = [
+    "How are documents indexed?",
+    "Which model answers the questions and what context does it use?",
+]
+
+
+def build_prompt(context, question):
+    return completion_to_prompt(
+        "Answer the query using only the context below and quote it where possible.\n"
+        f"Context:\n{context}\n\nQuery: {question}"
+    )
+
+
+def run_mode(mode, model_path, prompts, args):
+    model_kwargs = llama_cpp_tuning.get_model_kwargs(
+        model_path, args.gpu_layers, args.context_window
+    )
+    draft_model = build_draft_model(
+        mode,
+        args.draft_model_path,
+        n_ctx=args.context_window,
+        n_gpu_layers=args.gpu_layers,
+        n_threads=model_kwargs["n_threads"],
+    )
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=args.context_window,
+        draft_model=draft_model,
+        verbose=False,
+        **model_kwargs,
+    )
+
+    outputs = []
+    tokens = 0
+    seconds = 0.0
+    for prompt in prompts:
+        start = time.time()
+        response = llm.create_completion(
+            prompt, max_tokens=args.max_tokens, temperature=0.0, top_k=1
+        )
+        seconds += time.time() - start
+        tokens += response["usage"]["completion_tokens"]
+        outputs.append(response["choices"][0]["text"])
+    del llm
+    return outputs, tokens / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--context-file")
+    parser.add_argument("--questions", nargs="+", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--context-window", type=int, default=3900)
+    parser.add_argument("--gpu-layers", type=int, default=0)
+    parser.add_argument(
+        "--modes", nargs="+", default=["off", "prompt_lookup"],
+        help="off, prompt_lookup and/or draft_model",
+    )
+    parser.add_argument("--draft-model-path", default="")
+    args = parser.parse_args()
+
+    context = DEFAULT_CONTEXT
+    if args.context_file:
+        with open(args.context_file, "r", encoding="utf-8") as f:
+            context = f.read()
+    prompts = [build_prompt(context, q) for q in args.questions]
+
+    model_path = hf_hub_download(
+        repo_id=args.model,
+        filename=supported_llm_models[args.model],
+        cache_dir="./models",
+        local_files_only=True,
+    )
+
+    baseline = None
+    for mode in ["off"] + [m for m in args.modes if m != "off"]:
+        outputs, tokens_per_s = run_mode(mode, model_path, prompts, args)
+        if baseline is None:
+            baseline = outputs
+        identical = outputs == baseline
+        print(f"mode = {mode}, tokens/s = {tokens_per_s:.2f}, identical to off = {identical}")
+
+
+if __name__ == "__main__":
+    main()
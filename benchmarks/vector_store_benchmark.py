@@ -0,0 +1,95 @@
+"""
+Compares insert and top-k search latency of the local vector store against milvus.
+
+Run from the project root:
+    python -m benchmarks.vector_store_benchmark --sizes 1000 10000 50000 --milvus
+"""
+import argparse
+import shutil
+import statistics
+import time
+import uuid
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from utils.local_vector_store import LocalVectorStore
+
+BENCH_DIR = "bench-vector-data"
+
+
+def make_nodes(size, dim, rng):
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    nodes = [
+        TextNode(
+            text=f"node {i}",
+            id_=str(uuid.uuid4()),
+            embedding=vectors[i].tolist(),
+            metadata={"file_name": f"file_{i % 20}.pdf"},
+        )
+        for i in range(size)
+    ]
+    return nodes
+
+
+def run(store, nodes, queries, top_k):
+    start = time.time()
+    store.add(nodes)
+    insert_s = time.time() - start
+
+    latencies = []
+    for q in queries:
+        start = time.time()
+        store.query(VectorStoreQuery(query_embedding=q.tolist(), similarity_top_k=top_k))
+        latencies.append((time.time() - start) * 1000)
+    latencies.sort()
+    return {
+        "insert_s": round(insert_s, 3),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--milvus", action="store_true", help="also benchmark milvus")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.milvus:
+        import utils.vector_db_utils as vector_db
+        from utils.milvus_store import PartitionedMilvusVectorStore
+
+        vector_db.start_milvus()
+
+    for size in args.sizes:
+        nodes = make_nodes(size, args.dim, rng)
+        queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+        collection_name = f"bench_{size}"
+
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+        local = LocalVectorStore(
+            collection_name=collection_name, dim=args.dim, persist_dir=BENCH_DIR
+        )
+        print(f"size = {size}, local = {run(local, nodes, queries, args.top_k)}")
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+        if args.milvus:
+            milvus = PartitionedMilvusVectorStore(
+                dim=args.dim, collection_name=collection_name, overwrite=True
+            )
+            print(f"size = {size}, milvus = {run(milvus, nodes, queries, args.top_k)}")
+            vector_db.drop_milvus_collection(collection_name)
+
+    if args.milvus:
+        vector_db.stop_milvus()
+
+
+if __name__ == "__main__":
+    main()
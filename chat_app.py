@@ -10,6 +10,7 @@
 
 # You should have received a copy of the GNU General Public License along with Chat with your doc AMP. If not, see <https://www.gnu.org/licenses/>.
 import os
+import uuid
 import streamlit as st
 from concurrent.futures import ThreadPoolExecutor
 from utils.cmlllm import (
@@ -17,9 +18,19 @@ from utils.cmlllm import (
     get_active_collections,
     get_supported_embed_models,
     get_supported_models,
-    infer2,
 )
 from utils.check_dependency import check_gpu_enabled
+from utils.snapshot import list_snapshots, SNAPSHOTS_DIR
+import utils.catalog as catalog
+import utils.chat_sessions as chat_sessions
+from utils.llm_router import get_latency_stats
+from utils.fanout import get_search_stats
+from utils.adaptive_top_k import get_usage_stats
+from utils.memory_budget import memory_report
+from utils.milvus_residency import get_events, get_resident
+from utils.vectordb import is_milvus_backend
+from utils.common import async_query_pipeline
+from utils.http_api import start_in_background
 import threading
 import itertools
 import shutil
@@ -43,6 +54,7 @@ def save_uploadedfile(uploadedfile, collection_name):
     try:
         with open(save_path, "wb") as f:
             f.write(uploadedfile.getbuffer())
+        catalog.add_file(collection_name, save_path)
         return save_path
     except Exception as e:
         st.error(f"Error saving file {uploadedfile.name}: {e}")
@@ -60,27 +72,7 @@ def list_files_in_collection(collection_name):
     """
     lists existing files already in the collection
     """
-    collection_dir = os.path.join("uploaded_files", collection_name)
-    filelist = []
-    if os.path.exists(collection_dir):
-        files = os.listdir(collection_dir)
-        for f in files:
-            filelist.append(os.path.join(collection_dir, f))
-        return filelist
-    return []
-
-
-def get_collection_folders(directory="uploaded_files"):
-    try:
-        # Get all folders in the specified directory
-        collection_folders = [
-            folder
-            for folder in os.listdir(directory)
-            if os.path.isdir(os.path.join(directory, folder))
-        ]
-        return collection_folders
-    except FileNotFoundError:
-        return []
+    return catalog.file_paths(collection_name)
 
 
 def get_latest_default_collection():
@@ -109,13 +101,16 @@ def upload_document_and_ingest_new(files, questions, collection_name):
 if "llm" not in st.session_state:
     with st.spinner("Initializing LLM..."):
         st.session_state.llm = CMLLLM()
-if "collection_list_items" not in st.session_state:
-    exiting_collection = get_collection_folders()
-    all_collection = list(set(["Default"] + exiting_collection))
-    st.session_state.collection_list_items = all_collection
+    if os.getenv("HTTP_API_PORT"):
+        start_in_background(int(os.getenv("HTTP_API_PORT")), st.session_state.llm)
+if "current_collection" not in st.session_state:
+    st.session_state.current_collection = get_latest_default_collection()
     st.session_state.llm.set_collection_name(
-        collection_name=st.session_state.collection_list_items[0]
+        collection_name=st.session_state.current_collection
     )
+if "chat_session_id" not in st.session_state:
+    # the key of this session's chat memory, a new one starts a new chat
+    st.session_state.chat_session_id = uuid.uuid4().hex
 if "num_questions" not in st.session_state:
     st.session_state.num_questions = 1
 if "used_collections" not in st.session_state:
@@ -126,7 +121,7 @@ if "messages" not in st.session_state:
     st.session_state.messages = [
         {
             "role": "assistant",
-            "content": f"Hello! You are using {st.session_state.collection_list_items[0]} folder.",
+            "content": f"Hello! You are using {st.session_state.current_collection} folder.",
         }
     ]
 if "documents_processed" not in st.session_state:
@@ -135,8 +130,6 @@ if "questions" not in st.session_state:
     st.session_state["questions"] = []
 if "success_message" not in st.session_state:
     st.session_state["success_message"] = ""
-if "current_collection" not in st.session_state:
-    st.session_state.current_collection = st.session_state.collection_list_items[0]
 
 header = get_latest_default_collection()
 
@@ -144,6 +137,7 @@ header = get_latest_default_collection()
 def refresh_session_state_on_collection_change(collection_name):
     st.session_state.llm.set_collection_name(collection_name=collection_name)
     st.session_state.current_collection = collection_name
+    st.session_state.chat_session_id = uuid.uuid4().hex
     st.session_state.messages = [
         {
             "role": "assistant",
@@ -158,6 +152,8 @@ def refresh_session_state_on_collection_change(collection_name):
 
 def demo():
     st.title("AI Chat with Your Documents")
+    # read once per rerun, everything below uses this instead of the filesystem
+    collections = catalog.read_catalog()
 
     with st.sidebar:
         st.title("Menu:")
@@ -166,9 +162,7 @@ def demo():
             type=file_types,
             accept_multiple_files=True,
         )
-        collection_name = st.selectbox(
-            "Select Folder", st.session_state.collection_list_items
-        )
+        collection_name = st.selectbox("Select Folder", list(collections))
         if collection_name != st.session_state.get("current_collection"):
             refresh_session_state_on_collection_change(collection_name)
             # # Update the initial message with the new collection
@@ -178,16 +172,17 @@ def demo():
         items = None
         existing_files = ""
         if st.session_state.get("current_collection"):
-            dir_path = os.path.join("uploaded_files", collection_name)
-            if os.path.exists(dir_path):
-                items = os.listdir(dir_path)
-                if items:
-                    for item in items:
-                        existing_files = existing_files + item + "<br/>"
-                else:
-                    existing_files = f"{collection_name} is empty"
+            items = [f["file_name"] for f in collections.get(collection_name, {}).get("files", [])]
+            if items:
+                for item in items:
+                    existing_files = existing_files + item + "<br/>"
             else:
                 existing_files = f"{collection_name} is empty"
+        collection_info = collections.get(collection_name, {})
+        collection_summary = (
+            f"{collection_info.get('status', catalog.STATUS_EMPTY)}, "
+            f"{collection_info.get('vector_count', 0)} vectors"
+        )
         st.markdown(
             f"""
                 <div style=";
@@ -196,7 +191,7 @@ def demo():
                 <div style="height:2rem;
                 padding: 0.5rem;
                 display: flex;">
-                Existing files in : {collection_name} 
+                Existing files in : {collection_name} ({collection_summary})
                 </div>
                 <div  style="overflow-y:auto;
                 height:3rem;
@@ -209,6 +204,21 @@ def demo():
                 """,
             unsafe_allow_html=True
         )
+        if items:
+            # read back with each question, the vector store is shared by every session
+            st.multiselect(
+                "Search only in files",
+                items,
+                key=f"search_files_{collection_name}",
+            )
+        other_collections = [c for c in collections if c != collection_name]
+        if other_collections:
+            fanout_collections = st.multiselect(
+                "Also search in folders",
+                other_collections,
+                key=f"fanout_collections_{collection_name}",
+            )
+            st.session_state.llm.preload_collections(fanout_collections)
         st.write("")  # Add empty line for space
         st.write("")  # Add another empty line for more space
         if st.button("Analyze", disabled=st.session_state.processing):
@@ -252,12 +262,37 @@ def demo():
             )
             if num_questions != st.session_state.num_questions:
                 st.session_state.num_questions = num_questions
+            with st.expander("Model Latency"):
+                latency_stats = get_latency_stats()
+                if latency_stats:
+                    st.table(latency_stats)
+                else:
+                    st.write("No model calls yet")
+                search_stats = get_search_stats()
+                if search_stats:
+                    st.table(search_stats)
+                chunk_usage = get_usage_stats()
+                if chunk_usage:
+                    st.write("Chunks per query")
+                    st.json(chunk_usage)
+            with st.expander("Memory Usage"):
+                st.table(memory_report())
+                if is_milvus_backend():
+                    st.write("Loaded milvus collections")
+                    st.table(get_resident())
+                    residency_events = get_events()
+                    if residency_events:
+                        st.table(residency_events[:20])
             with st.expander("Folder Configuration"):
                 custom_input = st.text_input("Enter your custom folder name:")
                 if st.button("Create new folder") and custom_input:
-                    custom_input = custom_input.rstrip().replace(" ", "_")
-                    if custom_input not in st.session_state.collection_list_items:
-                        st.session_state.collection_list_items.append(custom_input)
+                    custom_input = catalog.clean_collection_name(custom_input)
+                    if not catalog.is_valid_collection_name(custom_input):
+                        st.warning(
+                            f"Folder name {custom_input} can only have letters, digits and _"
+                        )
+                    elif custom_input not in collections:
+                        catalog.add_collection(custom_input)
                         st.session_state["success_message"] = (
                             f"Folder {custom_input} added"
                         )
@@ -270,7 +305,6 @@ def demo():
                         st.button("Delete the Selected Folder")
                         and collection_name != "Default"
                 ):
-                    st.session_state.collection_list_items.remove(collection_name)
                     st.session_state.llm.delete_collection_name(collection_name)
                     st.session_state["success_message"] = (
                         f"Folder {collection_name} deleted"
@@ -280,6 +314,20 @@ def demo():
                 elif collection_name == "Default":
                     st.error("You can't delete the Default")
 
+                if st.button("Export the Selected Folder"):
+                    st.session_state["success_message"] = (
+                        st.session_state.llm.export_collection(collection_name)
+                    )
+                snapshots = list_snapshots()
+                if snapshots:
+                    snapshot_name = st.selectbox("Folder snapshots", snapshots)
+                    if st.button("Import the Selected Snapshot"):
+                        st.session_state["success_message"] = (
+                            st.session_state.llm.import_collection(
+                                os.path.join(SNAPSHOTS_DIR, snapshot_name)
+                            )
+                        )
+
                 # Display success message if there is one
                 if st.session_state["success_message"]:
                     st.success(st.session_state["success_message"])
@@ -300,7 +348,35 @@ def demo():
                 st.write(user_prompt)
 
             with st.spinner("Thinking..."):
-                response = infer2(user_prompt, "", st.session_state.current_collection)
+                fanout_collections = st.session_state.get(
+                    f"fanout_collections_{st.session_state.current_collection}"
+                )
+                search_files = st.session_state.get(
+                    f"search_files_{st.session_state.current_collection}"
+                )
+                memory = chat_sessions.get_memory(
+                    st.session_state.current_collection,
+                    st.session_state.chat_session_id,
+                    st.session_state.llm.memory_token_limit,
+                )
+                if fanout_collections:
+                    response = st.session_state.llm.infer_collections(
+                        user_prompt,
+                        [st.session_state.current_collection] + fanout_collections,
+                        {st.session_state.current_collection: search_files},
+                    )
+                elif async_query_pipeline:
+                    response = st.session_state.llm.stream_answer(
+                        user_prompt, st.session_state.current_collection, search_files, memory
+                    )
+                else:
+                    response = st.session_state.llm.infer2(
+                        user_prompt,
+                        "",
+                        st.session_state.current_collection,
+                        search_files,
+                        memory,
+                    )
                 response1, response2 = itertools.tee(response)
                 with st.chat_message("assistant"):
                     st.write_stream(response1)
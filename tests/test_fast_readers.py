@@ -0,0 +1,60 @@
+"""
+Tests of the boilerplate stripping of the fast html reader.
+
+Run from the project root:
+    python -m pytest -q tests
+"""
+from utils.fast_readers import extract_html_text
+
+BODY = "Install the package with pip and configure the server before the first start. " * 4
+
+READTHEDOCS_PAGE = f"""
+<html><body class="wy-body-for-nav">
+  <div class="wy-grid-for-nav">
+    <nav data-toggle="wy-nav-shift" class="wy-nav-side">
+      <div class="wy-side-scroll"><a href="index.html">Project docs</a></div>
+    </nav>
+    <section data-toggle="wy-nav-shift" class="wy-nav-content-wrap">
+      <nav class="wy-nav-top"><a href="index.html">Project</a></nav>
+      <div class="wy-nav-content">
+        <div class="rst-content">
+          <div role="navigation" aria-label="Page navigation">
+            <ul class="wy-breadcrumbs"><li><a href="index.html">Docs</a></li></ul>
+          </div>
+          <div class="document" itemscope="itemscope">
+            <div itemprop="articleBody">
+              <h1>Installation</h1>
+              <p>{BODY}</p>
+              <div class="toc"><a href="#a">Contents of this page</a></div>
+            </div>
+          </div>
+          <footer><p>Built with Sphinx using a theme.</p></footer>
+        </div>
+      </div>
+    </section>
+  </div>
+</body></html>
+"""
+
+
+def test_readthedocs_content_is_kept():
+    text = extract_html_text(READTHEDOCS_PAGE)
+    assert "Installation" in text
+    assert BODY.strip() in text
+    assert "Contents of this page" not in text
+    assert "Built with Sphinx" not in text
+    assert "Project docs" not in text
+
+
+def test_boilerplate_matches_whole_class_names():
+    page = f"""
+    <html><body>
+      <div class="sidebar"><p>{"Links to every other page of the site. " * 3}</p></div>
+      <div class="navigation-free content"><p>{BODY}</p></div>
+      <div id="menu"><p>{"Home, About, Contact and more menu entries. " * 3}</p></div>
+    </body></html>
+    """
+    text = extract_html_text(page)
+    assert BODY.strip() in text
+    assert "Links to every other page" not in text
+    assert "menu entries" not in text
@@ -0,0 +1,254 @@
+"""
+Tests of the HTTP API against a stand-in CMLLLM, no models or vector db are loaded.
+
+Run from the project root:
+    python -m pytest -q tests
+"""
+import importlib
+import json
+import sys
+import types
+
+import pytest
+from fastapi.testclient import TestClient
+from llama_index.core.llms import ChatMessage, MessageRole
+
+import utils
+import utils.catalog as catalog
+import utils.chat_sessions as chat_sessions
+
+
+class FakeLLM:
+    memory_token_limit = 3900
+
+    def __init__(self, chat_engine_map):
+        self.chat_engine_map = chat_engine_map
+        self.ingested = []
+        self.deleted_files = []
+
+    def set_collection_name(self, collection_name):
+        catalog.add_collection(collection_name)
+        self.chat_engine_map.setdefault(collection_name, object())
+
+    def delete_collection_name(self, collection_name):
+        self.chat_engine_map.pop(collection_name, None)
+        chat_sessions.drop_collection(collection_name)
+        catalog.remove_collection(collection_name)
+
+    def delete_file(self, collection_name, file_name):
+        self.deleted_files.append((collection_name, file_name))
+        catalog.remove_file(collection_name, file_name)
+        return True
+
+    def ingest(self, files, questions, collection_name):
+        self.ingested.append((collection_name, sorted(files), questions))
+        catalog.set_status(collection_name, catalog.STATUS_READY)
+        return "What is it?\nHow does it work?\n"
+
+    async def astream_answer(self, msg, collection_name, memory=None):
+        # the answer tells how many messages the memory held before this question
+        history = len(memory.get_all())
+        for token in ["answer ", f"{collection_name} ", f"history={history}"]:
+            yield token
+        memory.put(ChatMessage(role=MessageRole.USER, content=msg))
+        memory.put(ChatMessage(role=MessageRole.ASSISTANT, content="answer"))
+
+    def infer_collections(self, msg, collection_names):
+        for name in collection_names:
+            yield f"{name};"
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "CATALOG_PATH", str(tmp_path / "catalog.sqlite"))
+    monkeypatch.setattr(catalog, "connection", None)
+    monkeypatch.setattr(chat_sessions, "memories", type(chat_sessions.memories)())
+
+    chat_engine_map = {}
+    fake_cmlllm = types.ModuleType("utils.cmlllm")
+    fake_cmlllm.chat_engine_map = chat_engine_map
+    fake_cmlllm.CMLLLM = lambda: FakeLLM(chat_engine_map)
+    monkeypatch.setitem(sys.modules, "utils.cmlllm", fake_cmlllm)
+    monkeypatch.setattr(utils, "cmlllm", fake_cmlllm, raising=False)
+    monkeypatch.delitem(sys.modules, "utils.http_api", raising=False)
+    http_api = importlib.import_module("utils.http_api")
+
+    llm = FakeLLM(chat_engine_map)
+    http_api.set_llm(llm)
+    llm.set_collection_name("Default")
+    with TestClient(http_api.create_app()) as client:
+        yield client, llm
+    catalog.connection.close()
+
+
+def ingest(client, collection, name="notes.txt", text=b"some text"):
+    return client.post(
+        f"/collections/{collection}/ingest",
+        files=[("files", (name, text, "text/plain"))],
+        data={"questions": "2"},
+    )
+
+
+def sse_tokens(response):
+    tokens, events = [], []
+    for block in response.text.strip().split("\n\n"):
+        lines = block.split("\n")
+        if lines[0].startswith("event: "):
+            events.append(lines[0][len("event: "):])
+            continue
+        tokens.append(json.loads(lines[0][len("data: "):])["token"])
+    return tokens, events
+
+
+def test_health_and_metrics(api):
+    client, _ = api
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert {"latency", "memory", "search", "chunking"} <= set(response.json())
+
+
+def test_collection_crud(api):
+    client, llm = api
+    assert client.post("/collections/docs").json() == {"collection": "docs"}
+    assert set(client.get("/collections").json()) == {"Default", "docs"}
+
+    assert ingest(client, "docs").status_code == 200
+    response = client.delete("/collections/docs/files/notes.txt")
+    assert response.json() == {"deleted": True}
+    assert llm.deleted_files == [("docs", "notes.txt")]
+
+    assert client.delete("/collections/Default").status_code == 400
+    assert client.delete("/collections/docs").json() == {"deleted": "docs"}
+    assert set(client.get("/collections").json()) == {"Default"}
+
+
+def test_ingest(api):
+    client, llm = api
+    response = ingest(client, "docs")
+    assert response.status_code == 200
+    assert response.json() == {
+        "collection": "docs",
+        "files": ["notes.txt"],
+        "questions": ["What is it?", "How does it work?"],
+    }
+    collection, files, questions = llm.ingested[0]
+    assert collection == "docs" and questions == 2
+    assert [f.endswith("notes.txt") for f in files] == [True]
+    assert catalog.is_ready("docs")
+
+
+def test_ingest_without_files(api):
+    client, _ = api
+    assert client.post("/collections/empty/ingest").status_code == 400
+
+
+def test_chat_needs_ingested_collection(api):
+    client, _ = api
+    client.post("/collections/docs")
+    response = client.post("/chat", json={"message": "hi", "collection": "docs"})
+    assert response.status_code == 409
+
+
+def test_chat_stream(api):
+    client, _ = api
+    ingest(client, "docs")
+    response = client.post("/chat", json={"message": "hi", "collection": "docs"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    tokens, events = sse_tokens(response)
+    assert "".join(tokens) == "answer docs history=0"
+    assert events == ["done"]
+
+
+def test_chat_without_stream(api):
+    client, _ = api
+    ingest(client, "docs")
+    response = client.post(
+        "/chat", json={"message": "hi", "collection": "docs", "stream": False}
+    )
+    assert response.json() == {"collection": "docs", "answer": "answer docs history=0"}
+
+
+def test_chat_sessions_keep_their_own_history(api):
+    client, _ = api
+    ingest(client, "docs")
+
+    def ask(**kwargs):
+        body = {"message": "hi", "collection": "docs", "stream": False, **kwargs}
+        return client.post("/chat", json=body).json()["answer"]
+
+    assert ask(session_id="a").endswith("history=0")
+    assert ask(session_id="a").endswith("history=2")
+    assert ask(session_id="b").endswith("history=0")
+    assert ask().endswith("history=0")
+    assert ask().endswith("history=0")
+
+    client.delete("/collections/docs")
+    ingest(client, "docs")
+    assert ask(session_id="a").endswith("history=0")
+
+
+def test_chat_also_search(api):
+    client, _ = api
+    ingest(client, "docs")
+    ingest(client, "more")
+    response = client.post(
+        "/chat",
+        json={"message": "hi", "collection": "docs", "also_search": ["more"], "stream": False},
+    )
+    assert response.json()["answer"] == "docs;more;"
+
+
+@pytest.mark.parametrize("name", ["%2E%2E", "..", "a.b", "docs-1", "%2E%2E%2Fescape"])
+def test_unsafe_collection_names_are_rejected(api, tmp_path, name):
+    client, llm = api
+    assert client.delete(f"/collections/{name}").status_code in (400, 404)
+    assert client.post(f"/collections/{name}").status_code in (400, 404)
+    assert ingest(client, name).status_code in (400, 404)
+    assert tmp_path.exists()
+    assert set(catalog.collection_names()) == {"Default"}
+    assert llm.ingested == []
+
+
+def test_dot_dot_is_a_bad_request(api, tmp_path):
+    client, _ = api
+    (tmp_path / "keep.txt").write_text("keep")
+    assert client.delete("/collections/%2E%2E").status_code == 400
+    assert ingest(client, "%2E%2E").status_code == 400
+    assert (tmp_path / "keep.txt").exists()
+    assert not (tmp_path / "notes.txt").exists()
+
+
+def test_slash_in_a_name_never_reaches_the_disk(api, tmp_path):
+    client, _ = api
+    response = client.delete("/collections/uploaded_files%2F..%2F..")
+    assert response.status_code in (400, 404, 405)
+    assert tmp_path.exists()
+    response = client.post(
+        "/chat", json={"message": "hi", "collection": "../uploaded_files"}
+    )
+    assert response.status_code == 400
+
+
+def test_unsafe_file_name_is_rejected(api):
+    client, llm = api
+    assert ingest(client, "docs", name="..").status_code == 400
+    assert llm.ingested == []
+
+
+def test_chat_with_unknown_collection(api):
+    client, _ = api
+    response = client.post("/chat", json={"message": "hi", "collection": "nothere"})
+    assert response.status_code == 404
+    assert "nothere" not in catalog.collection_names()
+
+    ingest(client, "docs")
+    response = client.post(
+        "/chat", json={"message": "hi", "collection": "docs", "also_search": ["nothere"]}
+    )
+    assert response.status_code == 404
@@ -0,0 +1,221 @@
+"""
+Tests of the shared milvus connection and of PartitionedMilvusVectorStore over a
+stand-in MilvusClient, no milvus server is needed.
+
+Run from the project root:
+    python -m pytest -q tests
+"""
+import grpc
+import pytest
+from llama_index.core.schema import TextNode
+from pymilvus.exceptions import MilvusException, MilvusUnavailableException
+
+import utils.milvus_connection as milvus_connection
+from utils.milvus_store import PartitionedMilvusVectorStore, partition_name_for_file
+
+URI = "fake://milvus"
+
+
+class FakeClient:
+    """keeps collection -> partition -> {id: row} in memory, like a MilvusClient would."""
+
+    def __init__(self):
+        self.collections = {}
+        self.fail_next = {}
+
+    def _maybe_fail(self, method):
+        error = self.fail_next.pop(method, None)
+        if error is not None:
+            raise error
+
+    def list_collections(self):
+        return list(self.collections)
+
+    def create_collection(self, collection_name, **kwargs):
+        self.collections[collection_name] = {"_default": {}}
+
+    def drop_collection(self, collection_name):
+        self.collections.pop(collection_name)
+
+    def has_partition(self, collection_name, partition_name):
+        return partition_name in self.collections[collection_name]
+
+    def create_partition(self, collection_name, partition_name):
+        self.collections[collection_name][partition_name] = {}
+
+    def insert(self, collection_name, data, partition_name="_default"):
+        rows = self.collections[collection_name][partition_name]
+        for row in data:
+            assert row["id"] not in rows, "duplicate primary key"
+            rows[row["id"]] = row
+        # the rows are written, but the reply may still get lost
+        self._maybe_fail("insert")
+        return {"insert_count": len(data)}
+
+    def upsert(self, collection_name, data, partition_name="_default"):
+        self._maybe_fail("upsert")
+        self.delete(collection_name, ids=[row["id"] for row in data])
+        self.collections[collection_name][partition_name].update({r["id"]: r for r in data})
+        return {"upsert_count": len(data)}
+
+    def delete(self, collection_name, ids=None, filter=""):
+        self._maybe_fail("delete")
+        for rows in self.collections[collection_name].values():
+            for node_id in ids:
+                rows.pop(node_id, None)
+
+    def rows(self, collection_name):
+        return {
+            node_id: partition_name
+            for partition_name, rows in self.collections[collection_name].items()
+            for node_id in rows
+        }
+
+
+class Unavailable(grpc.RpcError):
+    def __init__(self, code):
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(milvus_connection, "milvus_retry_attempts", 3)
+    monkeypatch.setattr(milvus_connection, "milvus_retry_backoff_s", 0.1)
+    monkeypatch.setattr(milvus_connection.random, "uniform", lambda a, b: 1.0)
+    monkeypatch.setattr(milvus_connection.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def client(monkeypatch, sleeps):
+    fake = FakeClient()
+    monkeypatch.setattr(milvus_connection, "clients", {})
+    milvus_connection.set_client(fake, URI)
+    return fake
+
+
+def failing(errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(True)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return fn, calls
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (MilvusUnavailableException(message="server unavailable"), True),
+        (ConnectionError(), True),
+        (TimeoutError(), True),
+        (Unavailable(grpc.StatusCode.UNAVAILABLE), True),
+        (Unavailable(grpc.StatusCode.DEADLINE_EXCEEDED), True),
+        (Unavailable(grpc.StatusCode.INVALID_ARGUMENT), False),
+        (MilvusException(message="fail connecting to server"), True),
+        (MilvusException(message="collection not found"), False),
+        (ValueError("bad vector"), False),
+    ],
+)
+def test_is_transient(error, transient):
+    assert milvus_connection.is_transient(error) == transient
+
+
+def test_retry_backs_off_exponentially(sleeps):
+    fn, calls = failing([ConnectionError(), ConnectionError()])
+    assert milvus_connection.call_with_retry(fn) == "ok"
+    assert len(calls) == 3
+    assert sleeps == pytest.approx([0.1, 0.2])
+
+
+def test_retry_gives_up_after_the_last_attempt(sleeps):
+    fn, calls = failing([ConnectionError()] * 10)
+    with pytest.raises(ConnectionError):
+        milvus_connection.call_with_retry(fn)
+    assert len(calls) == 4
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4])
+
+
+def test_retry_raises_other_errors_at_once(sleeps):
+    fn, calls = failing([ValueError("bad vector")])
+    with pytest.raises(ValueError):
+        milvus_connection.call_with_retry(fn)
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_health_is_cached_for_the_ttl(monkeypatch):
+    now = [1000.0]
+    probes = []
+    monkeypatch.setattr(milvus_connection, "milvus_health_ttl_s", 5)
+    monkeypatch.setattr(milvus_connection, "health_state", {"up": False, "version": None, "checked_at": 0.0})
+    monkeypatch.setattr(milvus_connection.time, "time", lambda: now[0])
+    monkeypatch.setattr(milvus_connection, "_probe", lambda uri: probes.append(uri) or (True, "v2.4"))
+
+    assert milvus_connection.health(uri=URI)["version"] == "v2.4"
+    now[0] += 4
+    assert milvus_connection.health(uri=URI)["up"]
+    assert len(probes) == 1
+
+    now[0] += 2
+    milvus_connection.health(uri=URI)
+    assert len(probes) == 2
+
+    milvus_connection.health(refresh=True, uri=URI)
+    assert len(probes) == 3
+
+    milvus_connection.invalidate_health()
+    milvus_connection.health(uri=URI)
+    assert len(probes) == 4
+
+
+def make_store(collection_name="docs"):
+    return PartitionedMilvusVectorStore(uri=URI, collection_name=collection_name, dim=2)
+
+
+def nodes(*node_ids, file_name="a.txt"):
+    return [
+        TextNode(id_=node_id, text=node_id, embedding=[1.0, 0.0], metadata={"file_name": file_name})
+        for node_id in node_ids
+    ]
+
+
+def test_store_uses_the_injected_client(client):
+    store = make_store()
+    assert store.client is client
+    assert "docs" in client.collections
+
+
+def test_upsert_and_delete_by_node_id(client):
+    store = make_store()
+    partition = partition_name_for_file("a.txt")
+    store.add(nodes("n1", "n2"))
+    store.upsert_nodes(nodes("n2", "n3"))
+    assert client.rows("docs") == {"n1": partition, "n2": partition, "n3": partition}
+
+    store.delete_nodes(["n1", "n3"])
+    assert client.rows("docs") == {"n2": partition}
+
+
+def test_failed_insert_is_retried_as_upsert(client, sleeps):
+    store = make_store()
+    client.fail_next["insert"] = ConnectionError("reply lost")
+    store.add(nodes("n1", "n2"))
+    assert sorted(client.rows("docs")) == ["n1", "n2"]
+    assert len(sleeps) == 1
+
+
+def test_delete_is_retried(client, sleeps):
+    store = make_store()
+    store.add(nodes("n1"))
+    client.fail_next["delete"] = MilvusUnavailableException(message="server unavailable")
+    store.delete_nodes(["n1"])
+    assert client.rows("docs") == {}
+    assert len(sleeps) == 1
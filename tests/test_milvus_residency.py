@@ -0,0 +1,96 @@
+"""
+Tests of which collections and partitions milvus_residency loads and releases,
+over a stand-in for the pymilvus orm.
+
+Run from the project root:
+    python -m pytest -q tests
+"""
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+from pymilvus.client.types import LoadState
+
+import utils.milvus_residency as milvus_residency
+
+
+class FakeMilvus:
+    def __init__(self, partitions):
+        # collection name -> {partition name: entity count}
+        self.partitions = partitions
+        self.loads = []
+        self.releases = []
+
+    def collection(self, name):
+        milvus = self
+        fields = [SimpleNamespace(params={"dim": 4})]
+
+        class Collection:
+            schema = SimpleNamespace(fields=fields)
+            num_entities = sum(milvus.partitions[name].values())
+
+            def load(self, partition_names=None):
+                milvus.loads.append((name, partition_names))
+
+            def release(self):
+                milvus.releases.append(name)
+
+            def partition(self, partition_name):
+                return SimpleNamespace(num_entities=milvus.partitions[name][partition_name])
+
+        return Collection()
+
+
+@pytest.fixture
+def milvus(monkeypatch):
+    fake = FakeMilvus({"docs": {"p1": 10, "p2": 20, "p3": 30}, "other": {"_default": 5}})
+    monkeypatch.setattr(milvus_residency, "Collection", fake.collection)
+    monkeypatch.setattr(
+        milvus_residency,
+        "utility",
+        SimpleNamespace(
+            has_collection=lambda name: name in fake.partitions,
+            load_state=lambda name: LoadState.NotLoad,
+        ),
+    )
+    monkeypatch.setattr(milvus_residency, "resident", OrderedDict())
+    monkeypatch.setattr(milvus_residency, "loaded_partitions", {})
+    monkeypatch.setattr(milvus_residency, "in_use", {})
+    monkeypatch.setattr(milvus_residency, "milvus_max_resident_collections", 1)
+    return fake
+
+
+def search(collection_name, partition_names=None):
+    with milvus_residency.searching(collection_name, partition_names):
+        pass
+
+
+def test_file_search_loads_only_its_partitions(milvus):
+    search("docs", ["p1"])
+    search("docs", ["p1"])
+    search("docs", ["p1", "p2"])
+    assert milvus.loads == [("docs", ["p1"]), ("docs", ["p2"])]
+    assert milvus_residency.get_resident()[0]["partitions"] == 2
+
+
+def test_full_search_loads_the_rest(milvus):
+    search("docs", ["p1"])
+    search("docs")
+    search("docs", ["p3"])
+    assert milvus.loads == [("docs", ["p1"]), ("docs", None)]
+    assert milvus_residency.get_resident()[0]["partitions"] == "all"
+
+
+def test_partial_residency_is_sized_by_its_partitions(milvus):
+    search("docs", ["p1"])
+    per_entity = 4 * 4 + milvus_residency.ENTITY_OVERHEAD_BYTES
+    assert milvus_residency.resident["docs"] == 10 * per_entity
+
+
+def test_released_collection_forgets_its_partitions(milvus):
+    search("docs", ["p1"])
+    search("other")
+    assert milvus.releases == ["docs"]
+    search("docs", ["p2"])
+    assert milvus.loads[-1] == ("docs", ["p2"])
+    assert milvus_residency.loaded_partitions["docs"] == {"p2"}
@@ -0,0 +1,87 @@
+"""
+Adaptive top-k: the retriever fetches a few candidates and only the ones that
+clearly belong to the answer are kept.
+
+Walking the candidates from the best score down, the first one is always kept
+and the walk stops at the first candidate that
+- scores below `min_similarity`,
+- is more than `relative_gap` of the best score below the previous one, or
+- would take the kept chunks past `token_budget` tokens.
+"""
+import threading
+from typing import List, Optional
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+
+# kept chunks -> number of queries
+chunks_histogram = {}
+usage_totals = {"queries": 0, "candidates": 0, "chunks": 0, "tokens": 0}
+usage_lock = threading.Lock()
+
+
+def record_usage(candidates, chunks, tokens):
+    with usage_lock:
+        usage_totals["queries"] += 1
+        usage_totals["candidates"] += candidates
+        usage_totals["chunks"] += chunks
+        usage_totals["tokens"] += tokens
+        chunks_histogram[chunks] = chunks_histogram.get(chunks, 0) + 1
+
+
+def get_usage_stats():
+    with usage_lock:
+        queries = usage_totals["queries"]
+        if not queries:
+            return {}
+        return {
+            "queries": queries,
+            "avg_candidates": round(usage_totals["candidates"] / queries, 2),
+            "avg_chunks": round(usage_totals["chunks"] / queries, 2),
+            "avg_tokens": round(usage_totals["tokens"] / queries, 1),
+            "chunks_histogram": dict(sorted(chunks_histogram.items())),
+        }
+
+
+class AdaptiveTopKPostprocessor(BaseNodePostprocessor):
+    """keeps the candidates before the first large score drop, within a token budget."""
+
+    relative_gap: float = Field(default=0.04)
+    min_similarity: float = Field(default=0.75)
+    token_budget: int = Field(default=1500)
+    record: bool = Field(default=True, description="count the kept chunks in the usage stats")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AdaptiveTopKPostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        candidates = sorted(nodes, key=lambda n: n.score or 0.0, reverse=True)
+        tokenizer = get_tokenizer()
+        kept = []
+        tokens = 0
+        for node in candidates:
+            score = node.score or 0.0
+            node_tokens = len(tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+            if kept:
+                best = kept[0].score or 0.0
+                previous = kept[-1].score or 0.0
+                if score < self.min_similarity:
+                    break
+                if previous - score > self.relative_gap * abs(best):
+                    break
+                if tokens + node_tokens > self.token_budget:
+                    break
+            kept.append(node)
+            tokens += node_tokens
+
+        if self.record:
+            record_usage(len(candidates), len(kept), tokens)
+        print(f"adaptive top-k kept {len(kept)} of {len(candidates)} chunks, {tokens} tokens")
+        return kept
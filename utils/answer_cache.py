@@ -0,0 +1,185 @@
+import asyncio
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import utils.catalog as catalog
+
+# collection name -> {"version": int, "answers": {answer key: answer}}
+# where version is the catalog version of the collection the answers were made for
+answer_store = {}
+store_lock = threading.Lock()
+
+# live requests always win the llm; background generation only runs while this is 0
+live_requests = 0
+live_condition = threading.Condition()
+generation_lock = threading.Lock()
+
+pending_answers = queue.Queue()
+worker_thread = None
+
+RETRY_DELAY = 1.0
+
+
+def normalize_question(question):
+    question = str(question).strip().lower()
+    question = re.sub(r"\s+", " ", question)
+    return question.rstrip("?.! ")
+
+
+def answer_key(question, file_names=None):
+    """the normalized question, and the files the search was restricted to if any."""
+    key = normalize_question(question)
+    if file_names:
+        key += "\n" + "\n".join(sorted({os.path.basename(f) for f in file_names}))
+    return key
+
+
+def get_collection_version(collection_name):
+    return catalog.get_version(collection_name)
+
+
+def invalidate(collection_name):
+    """
+    drops every cached answer of the collection, called whenever its content
+    changes. Bumps the collection's catalog version, so answers still being
+    generated for the old content are not stored.
+    """
+    version = catalog.bump_version(collection_name)
+    with store_lock:
+        answer_store[collection_name] = {"version": version, "answers": {}}
+    print(f"answer cache for {collection_name} invalidated, version = {version}")
+
+
+def get_answer(collection_name, question, file_names=None):
+    version = get_collection_version(collection_name)
+    with store_lock:
+        entry = answer_store.get(collection_name)
+        if entry is None or entry["version"] != version:
+            return None
+        return entry["answers"].get(answer_key(question, file_names))
+
+
+def put_answer(collection_name, version, question, answer, file_names=None):
+    with store_lock:
+        entry = answer_store.setdefault(collection_name, {"version": version, "answers": {}})
+        if entry["version"] != version:
+            # the collection changed while this answer was being generated
+            return False
+        entry["answers"][answer_key(question, file_names)] = answer
+        return True
+
+
+def cache_bytes():
+    with store_lock:
+        return sum(
+            len(q) + len(a)
+            for entry in answer_store.values()
+            for q, a in entry["answers"].items()
+        )
+
+
+def clear_answers():
+    """drops the cached answers but keeps the versions, so pending work stays valid."""
+    with store_lock:
+        for entry in answer_store.values():
+            entry["answers"] = {}
+
+
+@contextmanager
+def live_request():
+    """marks a user request as running and gives it exclusive use of the llm."""
+    global live_requests
+    with live_condition:
+        live_requests += 1
+    try:
+        with generation_lock:
+            yield
+    finally:
+        with live_condition:
+            live_requests -= 1
+            live_condition.notify_all()
+
+
+@asynccontextmanager
+async def live_request_async():
+    """live_request for coroutines, waits for the llm without blocking the event loop."""
+    global live_requests
+    with live_condition:
+        live_requests += 1
+    try:
+        acquire = asyncio.ensure_future(asyncio.to_thread(generation_lock.acquire))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # the thread still gets the lock, hand it back once it does
+            acquire.add_done_callback(lambda _: generation_lock.release())
+            raise
+        try:
+            yield
+        finally:
+            generation_lock.release()
+    finally:
+        with live_condition:
+            live_requests -= 1
+            live_condition.notify_all()
+
+
+def _wait_until_idle():
+    with live_condition:
+        while live_requests > 0:
+            live_condition.wait()
+
+
+def _generate(collection_name, version, question, answer_fn):
+    """returns True when the question is done, False when it has to be retried."""
+    if get_collection_version(collection_name) != version:
+        return True
+
+    _wait_until_idle()
+    with generation_lock:
+        tokens = []
+        for token in answer_fn(question):
+            if live_requests > 0:
+                print(f"precompute of '{question}' yields to a live request")
+                return False
+            tokens.append(token)
+
+    answer = "".join(tokens)
+    if answer and put_answer(collection_name, version, question, answer):
+        print(f"precomputed answer for '{question}' in {collection_name}")
+    return True
+
+
+def _worker():
+    while True:
+        collection_name, version, question, answer_fn = pending_answers.get()
+        try:
+            if not _generate(collection_name, version, question, answer_fn):
+                time.sleep(RETRY_DELAY)
+                pending_answers.put((collection_name, version, question, answer_fn))
+        except Exception as e:
+            print(f"Exception while precomputing answer for '{question}': {e}")
+        finally:
+            pending_answers.task_done()
+
+
+def schedule_answers(collection_name, questions, answer_fn):
+    """
+    queues the questions for background answering with `answer_fn`,
+    a callable that takes a question and yields answer tokens.
+    """
+    global worker_thread
+    version = get_collection_version(collection_name)
+    for question in questions:
+        if question and get_answer(collection_name, question) is None:
+            pending_answers.put((collection_name, version, str(question), answer_fn))
+
+    if worker_thread is None or not worker_thread.is_alive():
+        worker_thread = threading.Thread(
+            target=_worker, name="answer-precompute", daemon=True
+        )
+        worker_thread.start()
@@ -0,0 +1,38 @@
+"""
+Bridges between asyncio and the blocking llm, embedder and vector store calls.
+"""
+import asyncio
+
+_DONE = object()
+
+
+async def iterate_in_thread(iterator):
+    """async iteration over a blocking iterator, every next() runs on the default executor."""
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # closing a token generator stops the llm
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await loop.run_in_executor(None, close)
+
+
+def iterate_sync(async_gen):
+    """iterates an async generator from synchronous code, on an event loop of its own."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_gen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(async_gen.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
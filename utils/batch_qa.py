@@ -0,0 +1,147 @@
+"""
+Offline batch question answering over a collection, without chat memory.
+
+The input is JSONL with one {"id": ..., "question": ...} per line. All questions
+are embedded up front, in one batched call with the model worker, and searched
+in bulk, then answered in an order that puts questions with the same retrieved
+context next to each other, so llama.cpp reuses the evaluated system prompt and
+context prefix. Every answer is appended to the output JSONL as soon as it is
+done, and a rerun skips the ids already in the output, so an interrupted run
+resumes where it stopped.
+
+    python -m utils.batch_qa --collection Default --input questions.jsonl \
+        --output answers.jsonl [--snapshot snapshots/Default]
+"""
+import argparse
+import json
+import os
+import time
+
+from llama_index.core.schema import NodeWithScore
+
+import utils.answer_cache as answer_cache
+import utils.llm_router as llm_router
+
+
+def read_questions(input_path):
+    items = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            items.append(
+                {
+                    "id": str(item.get("id", line_number)),
+                    "question": item.get("question") or item.get("query"),
+                }
+            )
+    return items
+
+
+def read_done_ids(output_path):
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # a line cut short by the interruption, its item is redone
+                continue
+    return done
+
+
+def embed_queries(embed_model, queries):
+    """one batched call when the model offers get_query_embedding_batch, else one per query."""
+    if hasattr(embed_model, "get_query_embedding_batch"):
+        return embed_model.get_query_embedding_batch(queries)
+    return [embed_model.get_query_embedding(q) for q in queries]
+
+
+def run_batch(llm, collection_name, input_path, output_path, similarity_top_k=None):
+    from llama_index.core import Settings
+
+    similarity_top_k = similarity_top_k or llm.retrieval_top_k
+    done = read_done_ids(output_path)
+    items = [i for i in read_questions(input_path) if i["id"] not in done and i["question"]]
+    print(f"batch qa: {len(items)} questions to answer, {len(done)} already done")
+    if not items:
+        return 0
+
+    start = time.time()
+    embeddings = embed_queries(Settings.embed_model, [i["question"] for i in items])
+    embed_s = (time.time() - start) / len(items)
+
+    start = time.time()
+    results = llm.get_vector_store(collection_name).query_batch(embeddings, similarity_top_k)
+    search_s = (time.time() - start) / len(items)
+
+    order = sorted(range(len(items)), key=lambda i: tuple(results[i].ids))
+    answer_llm = llm_router.get_llm(llm_router.TASK_ANSWER)
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        for n, i in enumerate(order):
+            item, result = items[i], results[i]
+            nodes = [
+                NodeWithScore(node=node, score=score)
+                for node, score in zip(result.nodes, result.similarities)
+            ]
+            nodes = llm.postprocess_nodes(item["question"], nodes)
+            messages = llm.build_answer_messages(item["question"], nodes)
+
+            with answer_cache.live_request():
+                start = time.time()
+                with llm_router.track("batch_answer"):
+                    response = answer_llm.chat(messages)
+                generate_s = time.time() - start
+
+            usage = (response.raw or {}).get("usage", {})
+            out.write(
+                json.dumps(
+                    {
+                        "id": item["id"],
+                        "question": item["question"],
+                        "answer": str(response.message.content),
+                        # the chunks that went into the prompt, after postprocessing
+                        "source_node_ids": [s.node.node_id for s in nodes],
+                        "source_files": [s.node.metadata.get("file_name") for s in nodes],
+                        "scores": [s.score for s in nodes],
+                        "prompt_tokens": usage.get("prompt_tokens"),
+                        "completion_tokens": usage.get("completion_tokens"),
+                        "timings": {
+                            "embed_s": round(embed_s, 4),
+                            "search_s": round(search_s, 4),
+                            "generate_s": round(generate_s, 3),
+                        },
+                    }
+                )
+                + "\n"
+            )
+            out.flush()
+            print(f"batch qa: {n + 1}/{len(items)} answered in {generate_s:.2f}s")
+    return len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--collection", default="Default")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--top-k", type=int)
+    parser.add_argument("--snapshot", help="snapshot directory to load the collection from")
+    args = parser.parse_args()
+
+    # keep the stored collections, the app resets them on start
+    os.environ.setdefault("RESET_VECTOR_DB_ON_START", "0")
+    import utils.cmlllm as cmlllm
+
+    llm = cmlllm.CMLLLM()
+    if args.snapshot:
+        print(llm.import_collection(args.snapshot, args.collection))
+    run_batch(llm, args.collection, args.input, args.output, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Persistent catalog of the collections, in SQLite.
+
+One place for what used to be spread over in-memory dicts and directory scans:
+each collection's files, chunk and vector counts, embed model, ingest status and
+a version that is bumped on every content change. Upload, ingest and delete
+update it incrementally; the UI reads it once per rerun with `read_catalog`.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CATALOG_PATH = "collection-catalog.sqlite"
+UPLOAD_DIR = "uploaded_files"
+DEFAULT_COLLECTION = "Default"
+# collection names are used as directory names and as milvus collection names
+COLLECTION_NAME_PATTERN = r"^[A-Za-z0-9_]+$"
+
+STATUS_EMPTY = "empty"
+STATUS_INGESTING = "ingesting"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    name TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    embed_model TEXT,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    vector_count INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    collection TEXT NOT NULL REFERENCES collections(name) ON DELETE CASCADE,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    ingested INTEGER NOT NULL DEFAULT 0,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    vector_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (collection, file_name)
+);
+"""
+
+connection = None
+catalog_lock = threading.RLock()
+
+
+def clean_collection_name(name):
+    """the collection name for a folder name typed by the user, spaces become underscores."""
+    return name.strip().replace(" ", "_")
+
+
+def is_valid_collection_name(name):
+    return re.fullmatch(COLLECTION_NAME_PATTERN, name) is not None
+
+
+def check_collection_name(name):
+    """raises ValueError for a name that is not safe to use as a directory name."""
+    if not is_valid_collection_name(name):
+        raise ValueError(f"invalid collection name {name!r}, use letters, digits and _")
+
+
+def _connect():
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(CATALOG_PATH, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.executescript(SCHEMA)
+    return connection
+
+
+def _execute(sql, params=()):
+    with catalog_lock:
+        db = _connect()
+        with db:
+            return db.execute(sql, params).fetchall()
+
+
+def add_collection(name):
+    now = time.time()
+    _execute(
+        "INSERT OR IGNORE INTO collections (name, status, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?)",
+        (name, STATUS_EMPTY, now, now),
+    )
+
+
+def remove_collection(name):
+    _execute("DELETE FROM collections WHERE name = ?", (name,))
+
+
+def get_collection(name):
+    rows = _execute("SELECT * FROM collections WHERE name = ?", (name,))
+    return dict(rows[0]) if rows else None
+
+
+def collection_names():
+    return [row["name"] for row in _execute("SELECT name FROM collections ORDER BY created_at")]
+
+
+def is_ready(name):
+    collection = get_collection(name)
+    return collection is not None and collection["status"] == STATUS_READY
+
+
+def set_status(name, status, embed_model=None):
+    add_collection(name)
+    _execute(
+        "UPDATE collections SET status = ?, embed_model = COALESCE(?, embed_model), "
+        "updated_at = ? WHERE name = ?",
+        (status, embed_model, time.time(), name),
+    )
+
+
+def get_version(name):
+    rows = _execute("SELECT version FROM collections WHERE name = ?", (name,))
+    return rows[0]["version"] if rows else 0
+
+
+def bump_version(name):
+    """marks a content change of the collection and returns its new version."""
+    add_collection(name)
+    with catalog_lock:
+        _execute(
+            "UPDATE collections SET version = version + 1, updated_at = ? WHERE name = ?",
+            (time.time(), name),
+        )
+        return get_version(name)
+
+
+def _update_counts(collection):
+    _execute(
+        "UPDATE collections SET "
+        "chunk_count = (SELECT COALESCE(SUM(chunk_count), 0) FROM files WHERE collection = ?), "
+        "vector_count = (SELECT COALESCE(SUM(vector_count), 0) FROM files WHERE collection = ?), "
+        "updated_at = ? WHERE name = ?",
+        (collection, collection, time.time(), collection),
+    )
+
+
+def add_file(collection, path):
+    """records an uploaded file, a re-upload replaces the row and needs a new ingest."""
+    add_collection(collection)
+    stat = os.stat(path)
+    _execute(
+        "INSERT OR REPLACE INTO files (collection, file_name, path, size, mtime) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (collection, os.path.basename(path), path, stat.st_size, stat.st_mtime),
+    )
+    _update_counts(collection)
+
+
+def remove_file(collection, file_name):
+    _execute(
+        "DELETE FROM files WHERE collection = ? AND file_name = ?",
+        (collection, os.path.basename(file_name)),
+    )
+    _update_counts(collection)
+
+
+def record_file_ingest(collection, path, chunk_count, vector_count):
+    file_name = os.path.basename(path)
+    if not _execute(
+        "SELECT 1 FROM files WHERE collection = ? AND file_name = ?", (collection, file_name)
+    ):
+        add_file(collection, path)
+    _execute(
+        "UPDATE files SET ingested = 1, chunk_count = ?, vector_count = ? "
+        "WHERE collection = ? AND file_name = ?",
+        (chunk_count, vector_count, collection, file_name),
+    )
+    _update_counts(collection)
+
+
+def set_vector_count(collection, vector_count):
+    """for content that didn't come from uploaded files, like a snapshot import."""
+    _execute(
+        "UPDATE collections SET vector_count = ?, updated_at = ? WHERE name = ?",
+        (vector_count, time.time(), collection),
+    )
+
+
+def list_files(collection):
+    return [
+        dict(row)
+        for row in _execute(
+            "SELECT * FROM files WHERE collection = ? ORDER BY file_name", (collection,)
+        )
+    ]
+
+
+def file_paths(collection):
+    return [f["path"] for f in list_files(collection)]
+
+
+def read_catalog():
+    """every collection with its files, in two queries."""
+    collections = {
+        row["name"]: dict(row, files=[])
+        for row in _execute("SELECT * FROM collections ORDER BY created_at")
+    }
+    for row in _execute("SELECT * FROM files ORDER BY file_name"):
+        if row["collection"] in collections:
+            collections[row["collection"]]["files"].append(dict(row))
+    return collections
+
+
+def reset_ingest_state():
+    """the vector store was emptied: every file has to be ingested again."""
+    _execute("UPDATE files SET ingested = 0, chunk_count = 0, vector_count = 0")
+    _execute(
+        "UPDATE collections SET status = ?, chunk_count = 0, vector_count = 0, "
+        "version = version + 1, updated_at = ?",
+        (STATUS_EMPTY, time.time()),
+    )
+
+
+def sync_from_disk(upload_dir=UPLOAD_DIR):
+    """reconciles the catalog with the files under `upload_dir`, once at startup."""
+    add_collection(DEFAULT_COLLECTION)
+    if not os.path.isdir(upload_dir):
+        return
+    for collection in sorted(os.listdir(upload_dir)):
+        collection_dir = os.path.join(upload_dir, collection)
+        if not os.path.isdir(collection_dir) or not is_valid_collection_name(collection):
+            continue
+        add_collection(collection)
+        on_disk = set(os.listdir(collection_dir))
+        known = {f["file_name"] for f in list_files(collection)}
+        for file_name in on_disk - known:
+            add_file(collection, os.path.join(collection_dir, file_name))
+        for file_name in known - on_disk:
+            remove_file(collection, file_name)
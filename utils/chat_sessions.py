@@ -0,0 +1,48 @@
+"""
+Chat memories, one per collection and session id.
+
+Every Streamlit session and HTTP API session keeps its own chat history here,
+the shared chat engines of the collections hold none. A request with a session
+id continues that session's history, one without is answered with an empty
+memory.
+"""
+import threading
+from collections import OrderedDict
+
+from llama_index.core.memory import ChatMemoryBuffer
+
+MAX_SESSIONS = 256
+
+# (collection name, session id) -> ChatMemoryBuffer, least recently used first
+memories = OrderedDict()
+sessions_lock = threading.Lock()
+
+
+def get_memory(collection_name, session_id, token_limit):
+    if session_id is None:
+        return ChatMemoryBuffer.from_defaults(token_limit=token_limit)
+    key = (collection_name, session_id)
+    with sessions_lock:
+        memory = memories.get(key)
+        if memory is None:
+            memory = memories[key] = ChatMemoryBuffer.from_defaults(token_limit=token_limit)
+            while len(memories) > MAX_SESSIONS:
+                memories.popitem(last=False)
+        memories.move_to_end(key)
+        return memory
+
+
+def drop_collection(collection_name):
+    with sessions_lock:
+        for key in [k for k in memories if k[0] == collection_name]:
+            memories.pop(key)
+
+
+def memory_chars():
+    with sessions_lock:
+        session_memories = list(memories.values())
+    return sum(
+        len(message.content or "")
+        for memory in session_memories
+        for message in memory.get_all()
+    )
@@ -1,29 +1,24 @@
 import os
 import asyncio
-from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.node_parser import SimpleNodeParser, SentenceSplitter
 from llama_index.core import (
     VectorStoreIndex,
     StorageContext,
     SimpleDirectoryReader,
     Settings,
 )
-from llama_index.readers.file import UnstructuredReader, PDFReader
-from llama_index.readers.nougat_ocr import PDFNougatOCR
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.vector_stores.milvus import MilvusVectorStore
-from huggingface_hub import hf_hub_download, snapshot_download
 import time
 import torch
-from llama_index.llms.llama_cpp import LlamaCPP
-from llama_index.llms.llama_cpp.llama_utils import (
-    messages_to_prompt,
-    completion_to_prompt,
-)
 from llama_index.core.evaluation import DatasetGenerator
 from llama_index.core.callbacks import LlamaDebugHandler, CallbackManager
 from llama_index.core.chat_engine.types import ChatMode
+from llama_index.core.chat_engine.context import DEFAULT_CONTEXT_TEMPLATE
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.vector_stores.types import VectorStoreQuery
 from llama_index.core.postprocessor import SentenceEmbeddingOptimizer
 from utils.duplicate_preprocessing import DuplicateRemoverNodePostprocessor
+from utils.fast_readers import FastHTMLReader, FastTextReader
 import torch
 import logging
 import sys
@@ -31,16 +26,53 @@ import subprocess
 import streamlit as st
 import atexit
 import utils.vectordb as vectordb
+import utils.milvus_residency as milvus_residency
+import utils.catalog as catalog
+import utils.snapshot as snapshot
+import utils.answer_cache as answer_cache
+import utils.chat_sessions as chat_sessions
+import utils.llm_router as llm_router
+import utils.models as models
+import utils.model_worker as model_worker
+import utils.memory_budget as memory_budget
+import utils.pdf_pages as pdf_pages
+import utils.fanout as fanout
+import utils.traffic as traffic
+import utils.token_chunker as token_chunker
+from utils.async_stream import iterate_in_thread, iterate_sync
+import utils.hierarchical as hierarchical
+import utils.parent_store as parent_store
+from utils.adaptive_top_k import AdaptiveTopKPostprocessor
 from llama_index.core.memory import ChatMemoryBuffer
 from dotenv import load_dotenv
-from utils.common import supported_llm_models, supported_embed_models
+from utils.common import (
+    supported_llm_models,
+    supported_embed_models,
+    reset_vector_db_on_start,
+    hierarchical_retrieval,
+    child_chunk_size,
+    parent_expansion_chars,
+    token_chunking,
+    adaptive_top_k,
+    adaptive_candidates,
+    adaptive_relative_gap,
+    adaptive_min_similarity,
+    adaptive_token_budget,
+    model_worker_socket,
+)
 
 load_dotenv()
 
-hf_token = os.getenv("HF_TOKEN")
-
 QUESTIONS_FOLDER = "questions"
 
+SYSTEM_PROMPT = (
+    "You are an expert Q&A assistant that is trusted around the world.\n"
+    "Always answer the query using the Context provided and not prior knowledge or General knowledge."
+    "Avoid statements like 'Based on the context' or 'The context information'.\n"
+    "If the provided context dont have the information, answer 'I dont know'.\n"
+    "Please cite the source along with your answers."
+)
+
 def exit_handler():
     print("cmlllmapp is exiting!")
     vectordb.stop_vector_db()
@@ -57,51 +89,35 @@ def get_supported_embed_models():
     embedList = list(supported_embed_models)
     return embedList
 
+# collection name -> chat engine of the collections set up for chat. The engines
+# don't keep the chat history, each query brings the memory of its chat session
 chat_engine_map = {}
 
+vector_store_map = {}
+
 def get_supported_models():
     llmList = list(supported_llm_models)
     return llmList
 
-active_collection_available = {"Default": False}
-
 def get_active_collections():
-    return list(active_collection_available)
+    return catalog.collection_names()
 
 print("resetting the questions")
 print(subprocess.run([f"rm -rf {QUESTIONS_FOLDER}"], shell=True))
 
-milvus_start = vectordb.reset_vector_db()
-print(f"milvus_start = {milvus_start}")
-
+if reset_vector_db_on_start:
+    vector_db_start = vectordb.reset_vector_db()
+else:
+    vector_db_start = vectordb.start_vector_db()
+print(f"vector_db_start = {vector_db_start}")
+catalog.sync_from_disk()
+if reset_vector_db_on_start:
+    catalog.reset_ingest_state()
 
-def infer2(msg, history, collection_name):
-    query_text = msg
-    print(f"query = {query_text}, collection name = {collection_name}")
-
-    if len(query_text) == 0:
-        return "Please ask some questions"
-
-    if collection_name in active_collection_available and not active_collection_available[collection_name]:
-        return "No documents are processed yet. Please process some documents.."
-
-    if collection_name not in chat_engine_map:
-        return f"Chat engine not created for collection {collection_name}.."
-
-    chat_engine = chat_engine_map[collection_name]
-
-    try:
-        streaming_response = chat_engine.stream_chat(query_text)
-        for token in streaming_response.response_gen:
-            yield token
-    except Exception as e:
-        op = f"failed with exception {e}"
-        print(op)
-        return op
 
 class CMLLLM:
-    MODELS_PATH = "./models"
-    EMBED_PATH = "./embed_models"
+    MODELS_PATH = models.MODELS_PATH
+    EMBED_PATH = models.EMBED_PATH
     questions_folder = QUESTIONS_FOLDER
 
     def __init__(
@@ -130,7 +146,19 @@ class CMLLLM:
             print("It is a GPU node, setup GPU.")
             n_gpu_layers = gpu_layers
 
-        self.node_parser = SimpleNodeParser(chunk_size=1024, chunk_overlap=128)
+        self.chunk_size = 1024
+        self.chunk_overlap = 128
+        self.node_parser = SimpleNodeParser(
+            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+        )
+        self.child_parser = None
+        if hierarchical_retrieval:
+            self.child_parser = SentenceSplitter(
+                chunk_size=child_chunk_size, chunk_overlap=child_chunk_size // 8
+            )
+        self.parent_window = hierarchical.ParentWindowPostprocessor(
+            expansion_chars=parent_expansion_chars
+        )
 
         self.set_global_settings(
             model_name=model_name,
@@ -144,8 +172,52 @@ class CMLLLM:
         )
         self.dim = dim
         self.similarity_top_k = similarity_top_k
+        self.retrieval_top_k = similarity_top_k
+        self.node_postprocessors = [self.parent_window]
+        if adaptive_top_k:
+            # fetch a few candidates, the postprocessor decides how many reach the prompt
+            self.retrieval_top_k = max(adaptive_candidates, similarity_top_k)
+            self.node_postprocessors.append(
+                AdaptiveTopKPostprocessor(
+                    relative_gap=adaptive_relative_gap,
+                    min_similarity=adaptive_min_similarity,
+                    token_budget=adaptive_token_budget,
+                )
+            )
         self.sentense_embedding_percentile_cutoff = sentense_embedding_percentile_cutoff
         self.memory_token_limit = memory_token_limit
+        self.register_memory_accounting()
+
+    def register_memory_accounting(self):
+        if not model_worker_socket:
+            for model_name, llm in llm_router.llm_map.items():
+                memory_budget.register_component(
+                    f"llm: {model_name}",
+                    lambda llm=llm: memory_budget.estimate_llama_cpp_bytes(llm._model),
+                )
+            memory_budget.register_component(
+                "embedder",
+                lambda: memory_budget.estimate_torch_module_bytes(Settings.embed_model._model),
+            )
+        memory_budget.register_component(
+            "vector store",
+            lambda: sum(store.memory_bytes() for store in list(vector_store_map.values()))
+            + (memory_budget.child_process_rss("milvus") if vectordb.is_milvus_backend() else 0),
+        )
+        memory_budget.register_component("answer cache", answer_cache.cache_bytes)
+        memory_budget.register_component(
+            "chat memories",
+            chat_sessions.memory_chars,
+        )
+        memory_budget.register_shrinker("answer cache", answer_cache.clear_answers)
+        memory_budget.register_shrinker(
+            "vector store ann graphs",
+            lambda: [store.release_ann() for store in list(vector_store_map.values())],
+        )
+        memory_budget.register_shrinker("pdf ocr workers", pdf_pages.shutdown_ocr_pool)
+        memory_budget.register_shrinker("chunk workers", token_chunker.shutdown_chunk_pool)
+        if vectordb.is_milvus_backend():
+            memory_budget.register_shrinker("milvus resident collections", milvus_residency.shrink)
 
     def get_active_model_name(self):
         print(f"active model is {self.active_model_name}")
@@ -161,8 +233,98 @@ class CMLLLM:
         if collection_name is None or len(collection_name) == 0:
             return None
 
-        active_collection_available.pop(collection_name, None)
         chat_engine_map.pop(collection_name, None)
+        chat_sessions.drop_collection(collection_name)
+        vector_store_map.pop(collection_name, None)
+        answer_cache.invalidate(collection_name)
+        catalog.remove_collection(collection_name)
+        print(vectordb.delete_vector_db_collection(collection_name))
+
+    def delete_file(self, collection_name, file_name):
+        print(f"delete_file : collection = {collection_name}, file = {file_name}")
+
+        vector_store = self.get_vector_store(collection_name)
+        answer_cache.invalidate(collection_name)
+        catalog.remove_file(collection_name, file_name)
+        parent_store.delete_file(collection_name, os.path.basename(file_name))
+        return vector_store.delete_file(file_name)
+
+    def preload_collections(self, collection_names):
+        """loads collections that are about to be searched in the background."""
+        if vectordb.is_milvus_backend():
+            milvus_residency.preload(collection_names)
+
+    def get_vector_store(self, collection_name):
+        if collection_name not in vector_store_map:
+            vector_store_map[collection_name] = vectordb.get_vector_store(
+                collection_name=collection_name,
+                dim=self.dim,
+            )
+        return vector_store_map[collection_name]
+
+    def export_collection(self, collection_name, snapshot_dir=None):
+        print(f"export_collection : collection = {collection_name}")
+
+        if catalog.get_collection(collection_name) is None:
+            return f"Collection {collection_name} does not exist."
+
+        if snapshot_dir is None:
+            snapshot_dir = os.path.join(snapshot.SNAPSHOTS_DIR, collection_name)
+        try:
+            manifest = snapshot.export_collection(
+                self.get_vector_store(collection_name),
+                snapshot_dir,
+                {
+                    "collection_name": collection_name,
+                    "embed_model": self.active_embed_model_name,
+                    "dim": self.dim,
+                    "chunk_size": self.chunk_size,
+                    "chunk_overlap": self.chunk_overlap,
+                },
+                parent_store.read_parents(collection_name),
+            )
+            return f"Exported {manifest['num_nodes']} nodes of {collection_name} to {snapshot_dir}"
+        except Exception as e:
+            print(f"Exception in export_collection: {e}")
+            return f"Error: {e}"
+
+    def import_collection(self, snapshot_dir, collection_name=None):
+        print(f"import_collection : snapshot = {snapshot_dir}")
+
+        try:
+            manifest, entries, vectors = snapshot.open_snapshot(snapshot_dir)
+        except Exception as e:
+            print(f"Exception in import_collection: {e}")
+            return f"Error: {e}"
+        if collection_name is None:
+            collection_name = manifest["collection_name"]
+        if manifest["embed_model"] != self.active_embed_model_name or manifest["dim"] != self.dim:
+            return (
+                f"Snapshot was built with {manifest['embed_model']} (dim {manifest['dim']}), "
+                f"the active embed model is {self.active_embed_model_name} (dim {self.dim})."
+            )
+
+        # the snapshot is loaded next to the collection, which is only replaced once it worked
+        staging_name = f"{collection_name}_import"
+        vectordb.delete_vector_db_collection(staging_name)
+        try:
+            snapshot.load_entries(
+                vectordb.get_vector_store(staging_name, dim=self.dim), entries, vectors
+            )
+            parent_store.load_parents(staging_name, *snapshot.read_parents(snapshot_dir))
+        except Exception as e:
+            print(f"Exception in import_collection: {e}")
+            vectordb.delete_vector_db_collection(staging_name)
+            return f"Error: {e}"
+        del entries, vectors
+
+        self.delete_collection_name(collection_name)
+        print(vectordb.rename_vector_db_collection(staging_name, collection_name))
+
+        self.set_collection_name(collection_name)
+        catalog.set_status(collection_name, catalog.STATUS_READY, self.active_embed_model_name)
+        catalog.set_vector_count(collection_name, manifest["num_nodes"])
+        return f"Imported {manifest['num_nodes']} nodes into {collection_name}"
 
     def set_collection_name(
         self,
@@ -176,8 +338,9 @@ class CMLLLM:
 
         print(f"adding new collection name {collection_name}")
 
-        if not collection_name in active_collection_available:
-            active_collection_available[collection_name] = False
+        catalog.add_collection(collection_name)
+        if vectordb.is_milvus_backend():
+            milvus_residency.select(collection_name)
 
         if collection_name in chat_engine_map:
             print(
@@ -185,16 +348,20 @@ class CMLLLM:
             )
             return
 
-        vector_store = MilvusVectorStore(
-            dim=self.dim,
-            collection_name=collection_name,
+        chat_engine_map[collection_name] = self.build_chat_engine(
+            collection_name,
+            ChatMemoryBuffer.from_defaults(token_limit=self.memory_token_limit),
         )
 
-        index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
+    def build_chat_engine(self, collection_name, memory, file_names=None):
+        """the collection's context chat engine, searching only `file_names` if given."""
+        vector_store = self.get_vector_store(collection_name)
 
+        index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
 
-        chat_engine = index.as_chat_engine(
+        return index.as_chat_engine(
             chat_mode=ChatMode.CONTEXT,
+            llm=llm_router.get_llm(llm_router.TASK_ANSWER),
             verbose=True,
             postprocessor=[
                 SentenceEmbeddingOptimizer(
@@ -202,84 +369,380 @@ class CMLLLM:
                 ),
                 DuplicateRemoverNodePostprocessor(),
             ],
-            memory=ChatMemoryBuffer.from_defaults(token_limit=self.memory_token_limit),
-            system_prompt=(
-                "You are an expert Q&A assistant that is trusted around the world.\n"
-                "Always answer the query using the Context provided and not prior knowledge or General knowledge."
-                "Avoid statements like 'Based on the context' or 'The context information'.\n"
-                "If the provided context dont have the information, answer 'I dont know'.\n"
-                "Please cite the source along with your answers."
-            ),
-            similarity_top_k=self.similarity_top_k,
+            node_postprocessors=self.node_postprocessors,
+            memory=memory,
+            system_prompt=SYSTEM_PROMPT,
+            similarity_top_k=self.retrieval_top_k,
+            vector_store_kwargs={"file_names": file_names},
         )
-        chat_engine_map[collection_name] = chat_engine
+
+    def infer2(self, msg, history, collection_name, file_names=None, memory=None):
+        """
+        answers with a context chat engine over the collection that continues the
+        chat in `memory`, with `file_names` only from the chunks of these files.
+        """
+        query_text = msg
+        print(f"query = {query_text}, collection name = {collection_name}")
+
+        if len(query_text) == 0:
+            return "Please ask some questions"
+
+        collection = catalog.get_collection(collection_name)
+        if collection is not None and collection["status"] != catalog.STATUS_READY:
+            return "No documents are processed yet. Please process some documents.."
+
+        if collection_name not in chat_engine_map:
+            return f"Chat engine not created for collection {collection_name}.."
+
+        if memory is None:
+            memory = ChatMemoryBuffer.from_defaults(token_limit=self.memory_token_limit)
+        # the engine is cheap to build, the memory and the file filter belong to this query
+        chat_engine = self.build_chat_engine(collection_name, memory, file_names)
+
+        memory_budget.enforce_budget()
+
+        trace = traffic.start_trace("query", collection_name)
+        trace.set_query(query_text)
+
+        cached_answer = answer_cache.get_answer(collection_name, query_text, file_names)
+        if cached_answer is not None:
+            print(f"serving precomputed answer for '{query_text}'")
+            trace.set(cached=True)
+            trace.finish()
+            yield cached_answer
+            return
+
+        trace.set(cached=False)
+        error = None
+        try:
+            with answer_cache.live_request():
+                streaming_response = chat_engine.stream_chat(query_text)
+                trace.mark("retrieve_s")
+                trace.set_nodes(streaming_response.source_nodes)
+                for token in llm_router.track_stream(
+                    llm_router.TASK_ANSWER, streaming_response.response_gen
+                ):
+                    trace.token()
+                    yield token
+        except Exception as e:
+            op = f"failed with exception {e}"
+            print(op)
+            error = str(e)
+            return op
+        finally:
+            trace.finish(error)
 
     def ingest(self, files, questions, collection_name, progress_bar=None):
-        if not (collection_name in active_collection_available):
+        if catalog.get_collection(collection_name) is None:
             return f"Some issues with the llm and collection {collection_name} setup. please try setting up the llm and the vector db again."
 
         file_extractor = {
-            ".html": UnstructuredReader(),
-            ".pdf": PDFReader(),
-            ".txt": UnstructuredReader(),
+            ".html": FastHTMLReader(),
+            ".txt": FastTextReader(),
         }
 
-#        if torch.cuda.is_available():
-#            file_extractor[".pdf"] = PDFNougatOCR()
-
         print(f"collection = {collection_name}, questions = {questions}")
 
 
         filename_fn = lambda filename: {"file_name": os.path.basename(filename)}
 
-        active_collection_available[collection_name] = False
+        catalog.set_status(collection_name, catalog.STATUS_INGESTING, self.active_embed_model_name)
+        answer_cache.invalidate(collection_name)
+        trace = traffic.start_trace("ingest", collection_name)
+        trace.set(questions=questions)
 
         try:
             start_time = time.time()
             op = ""
+            generated_questions = []
             i = 1
             for file in files:
-
-                reader = SimpleDirectoryReader(
-                    input_files=[file], file_extractor=file_extractor, file_metadata=filename_fn
-                )
-                document = reader.load_data(num_workers=1)
-
-                print(f"document = {document}")
-
-                vector_store = MilvusVectorStore(
-                    dim=self.dim,
-                    collection_name=collection_name,
-                )
+                vector_store = self.get_vector_store(collection_name)
+                # re-ingesting a file replaces its partition instead of duplicating nodes
+                vector_store.delete_file(file)
+                parent_store.delete_file(collection_name, os.path.basename(file))
 
                 storage_context = StorageContext.from_defaults(
                     vector_store=vector_store
                 )
-                nodes = self.node_parser.get_nodes_from_documents(document)
-                index = VectorStoreIndex(
-                    nodes, storage_context=storage_context
+                # questions are generated from the first batch, the rest is only indexed
+                question_document = None
+                chunk_count = vector_count = 0
+                for document in self.load_document_batches(file, file_extractor, filename_fn):
+                    print(f"document = {document}")
+                    if question_document is None:
+                        question_document = document
+
+                    with trace.timed("chunk_s"):
+                        if self.token_chunker is not None:
+                            parents, nodes = self.token_chunker.get_nodes(document)
+                            chunk_count += len(parents)
+                            if self.token_chunker.child_chunk_size is not None:
+                                parent_store.add_parents(collection_name, parents)
+                            del parents
+                        else:
+                            nodes = self.node_parser.get_nodes_from_documents(document)
+                            chunk_count += len(nodes)
+                            if self.child_parser is not None:
+                                parent_store.add_parents(collection_name, nodes)
+                                nodes = hierarchical.split_into_children(nodes, self.child_parser)
+                    vector_count += len(nodes)
+                    # text plus the python float list of a gte-large embedding per node
+                    node_bytes = self.chunk_size * 4 + self.dim * 32
+                    in_flight_bytes = sum(len(d.text) for d in document) + len(nodes) * node_bytes
+                    with memory_budget.track_in_flight("ingest", in_flight_bytes), trace.timed(
+                        "embed_insert_s"
+                    ):
+                        VectorStoreIndex(
+                            nodes,
+                            storage_context=storage_context,
+                            insert_batch_size=memory_budget.fit_batch_size(2048, node_bytes),
+                        )
+                    del nodes
+                    memory_budget.enforce_budget()
+
+                catalog.record_file_ingest(collection_name, file, chunk_count, vector_count)
+                trace.add_file(file, chunk_count, vector_count)
+                if not question_document:
+                    print(f"no text found in {file}")
+                    continue
+                data_generator = DatasetGenerator.from_documents(
+                    documents=question_document,
+                    llm=llm_router.get_llm(llm_router.TASK_QUESTION_GENERATION),
                 )
-                data_generator = DatasetGenerator.from_documents(documents=document)
                 dataset_op = (
                     f"Completed data set generation for file {os.path.basename(file)}. took "
                     + str(time.time() - start_time)
                     + " seconds."
                 )
-                eval_questions = data_generator.generate_questions_from_nodes(
-                    num=questions
-                )
+                with llm_router.track(llm_router.TASK_QUESTION_GENERATION), trace.timed(
+                    "questions_s"
+                ):
+                    eval_questions = data_generator.generate_questions_from_nodes(
+                        num=questions
+                    )
 
                 for q in eval_questions:
                     op += str(q) + "\n"
+                    generated_questions.append(str(q))
                     i += 1
-                active_collection_available[collection_name] = True
+                catalog.set_status(collection_name, catalog.STATUS_READY)
                 i += 1
+                del document, question_document, data_generator
+                memory_budget.enforce_budget()
+            if not catalog.is_ready(collection_name):
+                catalog.set_status(collection_name, catalog.STATUS_EMPTY)
+            self.precompute_answers(collection_name, generated_questions)
+            trace.finish()
             return op
         except Exception as e:
             print(f"Exception in ingest: {e}")
-            active_collection_available[collection_name] = False
+            catalog.set_status(collection_name, catalog.STATUS_FAILED)
+            trace.finish(str(e))
             return f"Error: {e}"
 
+    def load_document_batches(self, file, file_extractor, filename_fn):
+        """pdfs are streamed a batch of pages at a time, other files are read whole."""
+        if file.lower().endswith(".pdf"):
+            yield from pdf_pages.iter_page_batches(file, extra_info=filename_fn(file))
+            return
+        reader = SimpleDirectoryReader(
+            input_files=[file], file_extractor=file_extractor, file_metadata=filename_fn
+        )
+        yield reader.load_data(num_workers=1)
+
+    def precompute_answers(self, collection_name, questions):
+        if not questions:
+            return
+        print(f"scheduling {len(questions)} precomputed answers for {collection_name}")
+        answer_cache.schedule_answers(
+            collection_name,
+            questions,
+            lambda question: llm_router.track_stream(
+                "answer_precompute",
+                self.stream_standalone_answer(collection_name, question),
+            ),
+        )
+
+    def stream_standalone_answer(self, collection_name, question):
+        """
+        answers a single question with the same prompt as the chat engine,
+        but without any chat memory. Closing the generator stops the llm.
+        """
+        index = VectorStoreIndex.from_vector_store(
+            vector_store=self.get_vector_store(collection_name)
+        )
+        retriever = index.as_retriever(similarity_top_k=self.retrieval_top_k)
+        nodes = self.postprocess_nodes(question, retriever.retrieve(question))
+        messages = self.build_answer_messages(question, nodes)
+        llm = llm_router.get_llm(llm_router.TASK_ANSWER)
+        for response in llm.stream_chat(messages):
+            yield response.delta or ""
+
+    async def aretrieve(self, question, collection_name, file_names=None):
+        """
+        embeds the question, searches the collection, or only the chunks of
+        `file_names`, and postprocesses the hits.
+        """
+        vector_store = self.get_vector_store(collection_name)
+        query_embedding = await asyncio.to_thread(
+            Settings.embed_model.get_query_embedding, question
+        )
+        result = await asyncio.to_thread(
+            vector_store.query,
+            VectorStoreQuery(
+                query_embedding=query_embedding, similarity_top_k=self.retrieval_top_k
+            ),
+            file_names=file_names,
+        )
+        nodes = [
+            NodeWithScore(node=node, score=score)
+            for node, score in zip(result.nodes, result.similarities)
+        ]
+        return await asyncio.to_thread(self.postprocess_nodes, question, nodes)
+
+    async def astream_answer(self, msg, collection_name, memory=None, file_names=None):
+        """
+        infer2 as an asyncio pipeline. The answer cache lookup, the chat memory and
+        the embedding and search of the question run concurrently, and every
+        blocking step runs on the default executor, so the event loop never waits.
+        `memory` holds the chat so far, without one the question is answered without history.
+        """
+        print(f"query = {msg}, collection name = {collection_name}")
+        if len(msg) == 0:
+            yield "Please ask some questions"
+            return
+        if collection_name not in chat_engine_map:
+            yield f"Chat engine not created for collection {collection_name}.."
+            return
+        if memory is None:
+            memory = ChatMemoryBuffer.from_defaults(token_limit=self.memory_token_limit)
+
+        await asyncio.to_thread(memory_budget.enforce_budget)
+        trace = traffic.start_trace("query", collection_name)
+        trace.set_query(msg)
+
+        # the search starts right away, a cache hit only drops its result
+        search = asyncio.ensure_future(self.aretrieve(msg, collection_name, file_names))
+        collection, cached_answer, history = await asyncio.gather(
+            asyncio.to_thread(catalog.get_collection, collection_name),
+            asyncio.to_thread(answer_cache.get_answer, collection_name, msg, file_names),
+            asyncio.to_thread(memory.get),
+        )
+        if collection is not None and collection["status"] != catalog.STATUS_READY:
+            search.cancel()
+            yield "No documents are processed yet. Please process some documents.."
+            return
+        if cached_answer is not None:
+            search.cancel()
+            print(f"serving precomputed answer for '{msg}'")
+            trace.set(cached=True)
+            trace.finish()
+            yield cached_answer
+            return
+
+        trace.set(cached=False)
+        error = None
+        try:
+            nodes = await search
+            trace.mark("retrieve_s")
+            trace.set_nodes(nodes)
+            system_message, user_message = self.build_answer_messages(msg, nodes)
+            messages = [system_message] + history + [user_message]
+            llm = llm_router.get_llm(llm_router.TASK_ANSWER)
+
+            def generate():
+                for response in llm.stream_chat(messages):
+                    yield response.delta or ""
+
+            answer = ""
+            async with answer_cache.live_request_async():
+                async for token in iterate_in_thread(
+                    llm_router.track_stream(llm_router.TASK_ANSWER, generate())
+                ):
+                    trace.token()
+                    answer += token
+                    yield token
+            memory.put(user_message)
+            memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        except Exception as e:
+            op = f"failed with exception {e}"
+            print(op)
+            error = str(e)
+            yield op
+        finally:
+            trace.finish(error)
+
+    def stream_answer(self, msg, collection_name, file_names=None, memory=None):
+        """astream_answer for synchronous callers like the Streamlit app."""
+        return iterate_sync(self.astream_answer(msg, collection_name, memory, file_names))
+
+    def postprocess_nodes(self, question, nodes):
+        """the chat engine's node postprocessing: parent windows, then adaptive top-k."""
+        for postprocessor in self.node_postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_str=question)
+        return nodes
+
+    def build_answer_messages(self, question, nodes):
+        """the context chat engine's prompt for one question, without chat history."""
+        context_str = "\n\n".join(
+            [n.node.get_content(metadata_mode=MetadataMode.LLM).strip() for n in nodes]
+        )
+        return [
+            ChatMessage(
+                role=MessageRole.SYSTEM,
+                content=SYSTEM_PROMPT.strip()
+                + "\n"
+                + DEFAULT_CONTEXT_TEMPLATE.format(context_str=context_str),
+            ),
+            ChatMessage(role=MessageRole.USER, content=question),
+        ]
+
+    def search_collections(self, question, collection_names, file_names=None):
+        """
+        the best chunks of several collections, searched concurrently with one
+        embedding. `file_names` maps a collection to the files it is restricted to.
+        """
+        query_embedding = Settings.embed_model.get_query_embedding(question)
+        vector_stores = {name: self.get_vector_store(name) for name in collection_names}
+        return fanout.search_collections(
+            vector_stores,
+            query_embedding,
+            self.similarity_top_k,
+            # one generation over all of them, so keep the prompt within the context window
+            merged_top_k=self.similarity_top_k * 2,
+            file_names=file_names,
+        )
+
+    def infer_collections(self, msg, collection_names, file_names=None):
+        """answers from several collections at once, without chat memory."""
+        print(f"query = {msg}, collection names = {collection_names}")
+        if len(msg) == 0:
+            yield "Please ask some questions"
+            return
+        ready = [name for name in collection_names if catalog.is_ready(name)]
+        if not ready:
+            yield "No documents are processed yet. Please process some documents.."
+            return
+
+        memory_budget.enforce_budget()
+        try:
+            nodes, _ = self.search_collections(msg, ready, file_names)
+            # the merged chunks are already cut to merged_top_k, only the parent windows apply
+            nodes = self.parent_window.postprocess_nodes(nodes, query_str=msg)
+            messages = self.build_answer_messages(msg, nodes)
+            llm = llm_router.get_llm(llm_router.TASK_ANSWER)
+            with answer_cache.live_request():
+                for token in llm_router.track_stream(
+                    llm_router.TASK_ANSWER,
+                    (response.delta or "" for response in llm.stream_chat(messages)),
+                ):
+                    yield token
+        except Exception as e:
+            op = f"failed with exception {e}"
+            print(op)
+            yield op
+
     def upload_document_and_ingest(self, files, questions, progress_bar=None):
         if len(files) == 0:
             return "Please add some files..."
@@ -306,6 +769,23 @@ class CMLLLM:
             progress_bar=progress_bar,
         )
         Settings.node_parser = node_parser
+        self.token_chunker = self.load_token_chunker()
+
+    def load_token_chunker(self):
+        """cuts ingest chunks with the embed model's tokenizer, None falls back to node_parser."""
+        if not token_chunking:
+            return None
+        try:
+            return token_chunker.TokenChunker(
+                models.get_embed_model_path(self.active_embed_model_name),
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                child_chunk_size=child_chunk_size if hierarchical_retrieval else None,
+                child_chunk_overlap=child_chunk_size // 8,
+            )
+        except Exception as e:
+            print(f"no fast tokenizer for {self.active_embed_model_name}, using node_parser: {e}")
+            return None
 
     def set_global_settings_common(
         self,
@@ -322,51 +802,31 @@ class CMLLLM:
         )
         self.active_model_name = model_name
         self.active_embed_model_name = embed_model_path
-        model_path = self.get_model_path(model_name)
-        print(f"model_path = {model_path}")
-
-        Settings.llm = LlamaCPP(
-            model_path=model_path,
-            temperature=temperature,
-            max_new_tokens=max_new_tokens,
-            context_window=context_window,
-            generate_kwargs={"temperature": temperature},
-            model_kwargs={"n_gpu_layers": n_gpu_layers},
-            messages_to_prompt=messages_to_prompt,
-            completion_to_prompt=completion_to_prompt,
-            verbose=True,
-        )
-
-
-        Settings.embed_model = HuggingFaceEmbedding(
-            model_name=embed_model_path,
-            cache_folder=self.EMBED_PATH,
+        llm_kwargs = {
+            "temperature": temperature,
+            "max_new_tokens": max_new_tokens,
+            "context_window": context_window,
+            "n_gpu_layers": n_gpu_layers,
+        }
+        if model_worker_socket:
+            # the weights live in the model worker, shared with the other app processes
+            Settings.llm, Settings.embed_model, self.active_embed_model_name = (
+                model_worker.connect(model_worker_socket, model_name)
+            )
+            self.active_model_name = Settings.llm.model_name
+            return
+        Settings.llm, Settings.embed_model = models.load_models(
+            model_name, embed_model_path, **llm_kwargs
         )
 
+    def load_llm(self, model_name, **llm_kwargs):
+        return models.load_llm(model_name, **llm_kwargs)
 
     def get_model_path(self, model_name):
-        filename = supported_llm_models[model_name]
-        model_path = hf_hub_download(
-            repo_id=model_name,
-            filename=filename,
-            resume_download=True,
-            cache_dir=self.MODELS_PATH,
-            local_files_only=True,
-            token=hf_token,
-        )
-        return model_path
+        return models.get_model_path(model_name)
 
     def get_embed_model_path(self, embed_model):
-        embed_model_path = snapshot_download(
-            repo_id=embed_model,
-            resume_download=True,
-            cache_dir=self.EMBED_PATH,
-            local_files_only=True,
-            token=hf_token,
-        )
-        return embed_model_path
+        return models.get_embed_model_path(embed_model)
 
     def clear_chat_engine(self, collection_name):
-        if collection_name in chat_engine_map:
-            chat_engine = chat_engine_map[collection_name]
-            chat_engine.reset()
+        chat_sessions.drop_collection(collection_name)
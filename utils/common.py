@@ -1,6 +1,100 @@
+import os
+import json
+
 supported_llm_models = {
     "TheBloke/Mistral-7B-Instruct-v0.2-GGUF": "mistral-7b-instruct-v0.2.Q5_K_M.gguf",
-    # "microsoft/Phi-3-mini-4k-instruct-gguf": "Phi-3-mini-4k-instruct-q4.gguf",
+    "microsoft/Phi-3-mini-4k-instruct-gguf": "Phi-3-mini-4k-instruct-q4.gguf",
 }
 
 supported_embed_models = ["thenlper/gte-large"]
+
+# "local" keeps vectors in process in memory mapped files, "milvus" boots the embedded milvus server
+supported_vector_db_backends = ["local", "milvus"]
+vector_db_backend = os.getenv("VECTOR_DB_BACKEND", "local")
+# the app starts from an empty vector store; offline tools keep the stored collections
+reset_vector_db_on_start = os.getenv("RESET_VECTOR_DB_ON_START", "1") == "1"
+
+# task -> llm used for it. "answer" and any task that is not listed, or whose model
+# failed to load, use the model CMLLLM was created with. Override with a JSON
+# object in the LLM_TASK_ROUTING environment variable.
+llm_task_routing = {
+    "question_generation": "microsoft/Phi-3-mini-4k-instruct-gguf",
+}
+llm_task_routing.update(json.loads(os.getenv("LLM_TASK_ROUTING", "{}")))
+
+# opt-in speculative decoding for the answer model: "off", "prompt_lookup" drafts
+# tokens by n-gram lookup over the prompt, "draft_model" drafts with the small gguf
+# at SPECULATIVE_DRAFT_MODEL_PATH, which must share the answer model's vocabulary
+speculative_decoding = os.getenv("SPECULATIVE_DECODING", "off")
+speculative_draft_model_path = os.getenv("SPECULATIVE_DRAFT_MODEL_PATH", "")
+
+# pdfs are read and indexed this many pages at a time; pages without a usable text
+# layer are sent to a pool of PDF_OCR_WORKERS nougat OCR processes, 0 disables OCR
+pdf_page_batch_size = int(os.getenv("PDF_PAGE_BATCH_SIZE", "16"))
+pdf_ocr_workers = int(os.getenv("PDF_OCR_WORKERS", "1"))
+
+# a collection searched together with others that hasn't answered within this many
+# seconds is left out of the answer
+fanout_search_timeout_s = float(os.getenv("FANOUT_SEARCH_TIMEOUT_S", "2.0"))
+
+# small-to-big retrieval: chunks of CHILD_CHUNK_SIZE tokens are embedded and searched,
+# and each hit is widened by PARENT_EXPANSION_CHARS on both sides within its 1024
+# token parent chunk (-1 for the whole parent). HIERARCHICAL_RETRIEVAL=0 indexes the
+# parent chunks directly
+hierarchical_retrieval = os.getenv("HIERARCHICAL_RETRIEVAL", "1") == "1"
+child_chunk_size = int(os.getenv("CHILD_CHUNK_SIZE", "256"))
+parent_expansion_chars = int(os.getenv("PARENT_EXPANSION_CHARS", "1024"))
+
+# ingest cuts chunks from one tokenization of each document with the embed model's fast
+# tokenizer, at sentence boundaries, and no embedded chunk passes the embedder's max
+# length. Long documents are chunked by CHUNK_WORKERS processes (0 chunks in process).
+# TOKEN_CHUNKING=0 goes back to SimpleNodeParser
+token_chunking = os.getenv("TOKEN_CHUNKING", "1") == "1"
+chunk_workers = int(os.getenv("CHUNK_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+# adaptive top-k: the retriever fetches ADAPTIVE_CANDIDATES chunks and the prompt keeps
+# the best ones until the score drops by more than ADAPTIVE_RELATIVE_GAP of the best
+# score, falls below ADAPTIVE_MIN_SIMILARITY or the chunks would pass
+# ADAPTIVE_TOKEN_BUDGET tokens. Off by default, the fixed similarity_top_k is used until
+# benchmarks.adaptive_top_k_benchmark shows these cutoffs keep the hit rate on real
+# folders; ADAPTIVE_TOP_K=1 turns it on
+adaptive_top_k = os.getenv("ADAPTIVE_TOP_K", "0") == "1"
+adaptive_candidates = int(os.getenv("ADAPTIVE_CANDIDATES", "6"))
+adaptive_relative_gap = float(os.getenv("ADAPTIVE_RELATIVE_GAP", "0.04"))
+adaptive_min_similarity = float(os.getenv("ADAPTIVE_MIN_SIMILARITY", "0.75"))
+adaptive_token_budget = int(os.getenv("ADAPTIVE_TOKEN_BUDGET", "1500"))
+
+# milvus has to load a collection into memory to search it. At most
+# MILVUS_MAX_RESIDENT_COLLECTIONS collections and MILVUS_RESIDENT_MB of estimated
+# data stay loaded, the least recently searched ones are released first
+milvus_resident_mb = int(os.getenv("MILVUS_RESIDENT_MB", "2048"))
+milvus_max_resident_collections = int(os.getenv("MILVUS_MAX_RESIDENT_COLLECTIONS", "4"))
+
+# every vector store of the process shares one connection to MILVUS_URI, which can
+# also be a Milvus Lite file such as ./milvus.db. Health checks are cached for
+# MILVUS_HEALTH_TTL_S, requests failing while milvus is unavailable are retried
+# MILVUS_RETRY_ATTEMPTS times, backing off from MILVUS_RETRY_BACKOFF_S
+milvus_uri = os.getenv("MILVUS_URI", "http://localhost:19530")
+milvus_health_ttl_s = float(os.getenv("MILVUS_HEALTH_TTL_S", "5"))
+milvus_retry_attempts = int(os.getenv("MILVUS_RETRY_ATTEMPTS", "4"))
+milvus_retry_backoff_s = float(os.getenv("MILVUS_RETRY_BACKOFF_S", "0.5"))
+
+# path of the unix socket of a model worker (python -m utils.model_worker) that holds
+# the llms and the embedder for every app process on the pod; empty loads them in process.
+# Embedding requests arriving within MODEL_WORKER_EMBED_WAIT_MS of each other are
+# encoded together, up to MODEL_WORKER_EMBED_MAX_BATCH texts
+model_worker_socket = os.getenv("MODEL_WORKER_SOCKET", "")
+model_worker_connect_timeout_s = float(os.getenv("MODEL_WORKER_CONNECT_TIMEOUT_S", "600"))
+model_worker_embed_wait_ms = float(os.getenv("MODEL_WORKER_EMBED_WAIT_MS", "5"))
+model_worker_embed_max_batch = int(os.getenv("MODEL_WORKER_EMBED_MAX_BATCH", "64"))
+
+# opt-in traffic capture: every query and ingest appends a trace to this JSONL file,
+# with query texts and file names hashed unless TRAFFIC_CAPTURE_TEXT=1. Replay the
+# traces with python -m benchmarks.replay_traffic
+traffic_capture_path = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+traffic_capture_text = os.getenv("TRAFFIC_CAPTURE_TEXT", "0") == "1"
+
+# answer chat queries with the asyncio pipeline (CMLLLM.astream_answer), which overlaps
+# the answer cache lookup, chat memory and search; ASYNC_QUERY_PIPELINE=0 has the UI use the chat
+# engine. The HTTP API always uses the pipeline, which takes a chat memory per API session
+async_query_pipeline = os.getenv("ASYNC_QUERY_PIPELINE", "1") == "1"
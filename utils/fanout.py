@@ -0,0 +1,121 @@
+"""
+Concurrent search of several collections with one query embedding.
+
+Each collection is searched for its best `similarity_top_k` chunks, so one
+collection contributes at most that many and can't fill the whole prompt. The
+candidates are merged into one ranked list on their cosine scores, which all
+come from the same embed model and are comparable across collections. A
+collection that hasn't answered within the timeout is left out of the answer
+instead of delaying it.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from utils.common import fanout_search_timeout_s
+
+search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fanout-search")
+
+# collection name -> {"calls", "total_s", "timeouts", "errors"}
+search_stats = {}
+stats_lock = threading.Lock()
+
+
+def record_search(collection_name, seconds=0.0, outcome="ok"):
+    with stats_lock:
+        stats = search_stats.setdefault(
+            collection_name, {"calls": 0, "total_s": 0.0, "timeouts": 0, "errors": 0}
+        )
+        stats["calls"] += 1
+        stats["total_s"] += seconds
+        if outcome == "timeout":
+            stats["timeouts"] += 1
+        elif outcome == "error":
+            stats["errors"] += 1
+
+
+def get_search_stats():
+    rows = []
+    with stats_lock:
+        for collection_name, stats in sorted(search_stats.items()):
+            answered = stats["calls"] - stats["timeouts"] - stats["errors"]
+            rows.append(
+                {
+                    "collection": collection_name,
+                    "searches": stats["calls"],
+                    "avg_search_s": round(stats["total_s"] / answered, 4) if answered else None,
+                    "timeouts": stats["timeouts"],
+                    "errors": stats["errors"],
+                }
+            )
+    return rows
+
+
+def _timed_query(vector_store, query, file_names=None):
+    start = time.time()
+    result = vector_store.query(query, file_names=file_names)
+    return result, time.time() - start
+
+
+def ranked_candidates(collection_name, result):
+    """(score, collection name, node) candidates of one collection, best first."""
+    candidates = [
+        (score, collection_name, NodeWithScore(node=node, score=score))
+        for node, score in zip(result.nodes, result.similarities or [])
+    ]
+    return sorted(candidates, key=lambda c: c[0], reverse=True)
+
+
+def search_collections(
+    vector_stores, query_embedding, similarity_top_k, merged_top_k, timeout=None, file_names=None
+):
+    """
+    searches every store of `vector_stores`, a dict of collection name -> vector
+    store, and returns the best `merged_top_k` chunks and a per collection report
+    with the number of chunks each collection contributed. `file_names`, a dict
+    of collection name -> file names, restricts the search of those collections.
+    """
+    file_names = file_names or {}
+    timeout = fanout_search_timeout_s if timeout is None else timeout
+    query = VectorStoreQuery(
+        query_embedding=query_embedding,
+        similarity_top_k=similarity_top_k,
+    )
+    futures = {
+        search_pool.submit(
+            _timed_query, vector_store, query, file_names.get(collection_name)
+        ): collection_name
+        for collection_name, vector_store in vector_stores.items()
+    }
+    _, not_done = wait(futures, timeout=timeout)
+
+    report = []
+    candidates = []
+    for future, collection_name in futures.items():
+        if future in not_done:
+            print(f"search of {collection_name} timed out after {timeout}s, answering without it")
+            record_search(collection_name, outcome="timeout")
+            report.append({"collection": collection_name, "status": "timeout"})
+            continue
+        try:
+            result, seconds = future.result()
+        except Exception as e:
+            print(f"Exception in search of {collection_name}: {e}")
+            record_search(collection_name, outcome="error")
+            report.append({"collection": collection_name, "status": f"Error: {e}"})
+            continue
+        record_search(collection_name, seconds)
+        report.append(
+            {"collection": collection_name, "status": "ok", "search_s": round(seconds, 4)}
+        )
+        candidates.extend(ranked_candidates(collection_name, result))
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    merged = candidates[:merged_top_k]
+    for row in report:
+        row["chunks"] = sum(1 for c in merged if c[1] == row["collection"])
+    print(f"fan-out search: {report}")
+    return [c[2] for c in merged], report
@@ -0,0 +1,159 @@
+"""
+Fast readers for .txt and .html files.
+
+TXT files are read as they are. HTML files are parsed with lxml, the navigation
+and other boilerplate is dropped and only the main content is kept. The much
+slower UnstructuredReader is used only when the fast path can't handle a file:
+a text file that isn't utf-8, or an html page without enough extractable text.
+"""
+import re
+from pathlib import Path
+
+import lxml.etree
+import lxml.html
+from llama_index.core.readers.base import BaseReader
+from llama_index.core.schema import Document
+
+# pages with less main text than this go to UnstructuredReader
+MIN_HTML_TEXT_CHARS = 200
+
+BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "nav", "aside", "form", "button",
+    "iframe", "svg", "canvas", "select",
+]
+# page level only, inside <main> or <article> they hold the title and byline
+PAGE_BOILERPLATE_TAGS = ["header", "footer"]
+BOILERPLATE_ROLES = ["navigation", "banner", "contentinfo", "complementary", "search"]
+# whole id and class names only, "wy-nav-content" is the main content of ReadTheDocs pages
+BOILERPLATE_NAMES = re.compile(
+    r"nav|navbar|menu|sidebar|footer|breadcrumbs?|cookie|banner|"
+    r"toc|social|share|skip|related|advert|ads",
+    re.IGNORECASE,
+)
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "pre", "blockquote", "li", "ul", "ol",
+    "dl", "dt", "dd", "table", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "figcaption",
+}
+CELL_TAGS = {"td", "th"}
+
+
+def _unstructured_reader():
+    from llama_index.readers.file import UnstructuredReader
+
+    return UnstructuredReader()
+
+
+def _is_boilerplate(element):
+    if element.get("role", "").lower() in BOILERPLATE_ROLES:
+        return True
+    if element.tag in ("main", "article", "body"):
+        return False
+    names = element.get("id", "").split() + element.get("class", "").split()
+    return any(BOILERPLATE_NAMES.fullmatch(name) for name in names)
+
+
+def _strip_boilerplate(root):
+    for element in list(root.iter(*BOILERPLATE_TAGS)):
+        if element.getparent() is not None:
+            element.drop_tree()
+    for element in list(root.iter(*PAGE_BOILERPLATE_TAGS)):
+        if not element.xpath("ancestor::main | ancestor::article"):
+            element.drop_tree()
+    for element in list(root.iter()):
+        if (
+            isinstance(element.tag, str)
+            and element.getparent() is not None
+            and _is_boilerplate(element)
+        ):
+            element.drop_tree()
+
+
+def _link_text_length(element):
+    return sum(len(a.text_content()) for a in element.iter("a"))
+
+
+def _main_content(root):
+    """<main>/<article> when the page marks it, else the densest block of paragraphs."""
+    for xpath in ("//main", "//*[@role='main']", "//article"):
+        found = root.xpath(xpath)
+        if found:
+            return max(found, key=lambda e: len(e.text_content()))
+
+    # readability style scoring: every paragraph adds its text to its parent and
+    # half of it to the grandparent, links count against it
+    scores = {}
+    for paragraph in root.iter("p", "pre", "li", "td"):
+        length = len(paragraph.text_content().strip())
+        if length < 25:
+            continue
+        score = length - _link_text_length(paragraph)
+        parent = paragraph.getparent()
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + score
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + score / 2
+    if scores:
+        return max(scores, key=scores.get)
+    body = root.find("body")
+    return body if body is not None else root
+
+
+def _element_text(element):
+    parts = []
+
+    def walk(el, preformatted):
+        if not isinstance(el.tag, str):
+            if el.tail:
+                parts.append(el.tail)
+            return
+        preformatted = preformatted or el.tag == "pre"
+        if el.tag in BLOCK_TAGS:
+            parts.append("\n")
+        elif el.tag == "br":
+            parts.append("\n")
+        if el.text:
+            parts.append(el.text if preformatted else re.sub(r"\s+", " ", el.text))
+        for child in el:
+            walk(child, preformatted)
+        if el.tag in BLOCK_TAGS:
+            parts.append("\n")
+        elif el.tag in CELL_TAGS:
+            parts.append(" | ")
+        if el.tail and el is not element:
+            parts.append(el.tail if preformatted else re.sub(r"\s+", " ", el.tail))
+
+    walk(element, False)
+    lines = [line.rstrip() for line in "".join(parts).split("\n")]
+    return "\n".join(line for line in lines if line.strip())
+
+
+def extract_html_text(html):
+    """the main text content of an html page, without navigation and boilerplate."""
+    root = lxml.html.document_fromstring(html)
+    _strip_boilerplate(root)
+    return _element_text(_main_content(root))
+
+
+class FastTextReader(BaseReader):
+    def load_data(self, file, extra_info=None):
+        try:
+            text = Path(file).read_text(encoding="utf-8")
+        except UnicodeDecodeError:
+            print(f"{file} is not utf-8, using UnstructuredReader")
+            return _unstructured_reader().load_data(file, extra_info=extra_info)
+        return [Document(text=text, metadata=extra_info or {})]
+
+
+class FastHTMLReader(BaseReader):
+    def load_data(self, file, extra_info=None):
+        try:
+            text = extract_html_text(Path(file).read_bytes())
+        except (lxml.etree.ParserError, ValueError) as e:
+            print(f"lxml failed to parse {file}: {e}, using UnstructuredReader")
+            text = ""
+        if len(text) < MIN_HTML_TEXT_CHARS:
+            print(f"{file} has little static text, using UnstructuredReader")
+            return _unstructured_reader().load_data(file, extra_info=extra_info)
+        return [Document(text=text, metadata=extra_info or {})]
@@ -0,0 +1,169 @@
+"""
+Small-to-big retrieval.
+
+Every parent chunk of the node parser is split again into small child chunks,
+and only the children are embedded and searched. Small chunks give sharper
+embeddings than the 1024 token parents. The parent texts are stored once in the
+parent store, each child carries its parent's id and its span in the parent in
+metadata that is neither embedded nor shown to the llm. At query time a hit is
+widened by `expansion_chars` on each side within its parent, and windows that
+overlap or touch in the same document are merged, so the prompt holds every
+relevant passage once.
+"""
+from typing import Any, Callable, List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeRelationship, NodeWithScore, QueryBundle, TextNode
+
+import utils.parent_store as parent_store
+
+PARENT_ID_KEY = "parent_id"
+# collections ingested before the parent store kept the parent text in each child
+PARENT_TEXT_KEY = "parent_text"
+# offset of the parent in its document, None when it couldn't be located
+PARENT_START_KEY = "parent_start"
+# [start, end] of the child in the parent text
+CHILD_SPAN_KEY = "child_span"
+HIDDEN_KEYS = [PARENT_ID_KEY, PARENT_TEXT_KEY, PARENT_START_KEY, CHILD_SPAN_KEY]
+
+
+def child_node(parent, start, end, parent_text=None):
+    """the child holding characters [start, end) of the parent's text."""
+    parent_text = parent.get_content() if parent_text is None else parent_text
+    metadata = dict(parent.metadata)
+    metadata.update(
+        {
+            PARENT_ID_KEY: parent.node_id,
+            PARENT_START_KEY: parent.start_char_idx,
+            CHILD_SPAN_KEY: [start, end],
+        }
+    )
+    child = TextNode(
+        text=parent_text[start:end],
+        metadata=metadata,
+        excluded_embed_metadata_keys=parent.excluded_embed_metadata_keys + HIDDEN_KEYS,
+        excluded_llm_metadata_keys=parent.excluded_llm_metadata_keys + HIDDEN_KEYS,
+    )
+    if parent.source_node is not None:
+        child.relationships[NodeRelationship.SOURCE] = parent.source_node
+    return child
+
+
+def split_into_children(parent_nodes, child_parser):
+    children = []
+    for parent in parent_nodes:
+        parent_text = parent.get_content()
+        cursor = 0
+        for chunk in child_parser.split_text(parent_text):
+            start = parent_text.find(chunk, cursor)
+            if start < 0:
+                start = max(parent_text.find(chunk), 0)
+            cursor = start + 1
+            children.append(child_node(parent, start, start + len(chunk), parent_text))
+    return children
+
+
+class ParentWindowPostprocessor(BaseNodePostprocessor):
+    """widens child hits to parent windows and merges the overlapping ones."""
+
+    expansion_chars: int = Field(
+        default=1024,
+        description="parent text kept on each side of a child hit, -1 for the whole parent",
+    )
+    _get_parent_texts: Callable = PrivateAttr()
+
+    def __init__(self, get_parent_texts: Optional[Callable] = None, **kwargs: Any) -> None:
+        # get_parent_texts(parent ids) -> {parent id: text}, the parent store's by default
+        super().__init__(**kwargs)
+        self._get_parent_texts = get_parent_texts or parent_store.get_texts
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ParentWindowPostprocessor"
+
+    def window(self, node, parent_text):
+        """(document key, start, end, text) of the parent window around a child."""
+        metadata = node.metadata
+        child_start, child_end = metadata[CHILD_SPAN_KEY]
+        if self.expansion_chars < 0:
+            start, end = 0, len(parent_text)
+        else:
+            start = max(child_start - self.expansion_chars, 0)
+            end = min(child_end + self.expansion_chars, len(parent_text))
+
+        parent_start = metadata.get(PARENT_START_KEY)
+        if parent_start is None:
+            # without a document offset only windows of the same parent can be merged
+            return metadata[PARENT_ID_KEY], start, end, parent_text[start:end]
+        return (
+            node.ref_doc_id or metadata[PARENT_ID_KEY],
+            parent_start + start,
+            parent_start + end,
+            parent_text[start:end],
+        )
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        parent_texts = self._get_parent_texts(
+            [
+                n.node.metadata[PARENT_ID_KEY]
+                for n in nodes
+                if PARENT_ID_KEY in n.node.metadata and PARENT_TEXT_KEY not in n.node.metadata
+            ]
+        )
+        merged = []
+        by_document = {}
+        for node in nodes:
+            metadata = node.node.metadata
+            parent_text = metadata.get(PARENT_TEXT_KEY) or parent_texts.get(
+                metadata.get(PARENT_ID_KEY)
+            )
+            if parent_text is None:
+                # collections ingested without children are passed through
+                merged.append(node)
+                continue
+            key, start, end, text = self.window(node.node, parent_text)
+            by_document.setdefault(key, []).append([start, end, text, node])
+
+        for windows in by_document.values():
+            windows.sort(key=lambda w: w[0])
+            current = windows[0]
+            for window in windows[1:]:
+                start, end, text, node = window
+                offset = start - current[0]
+                shared = current[2][offset:offset + len(text)]
+                # overlapping or adjacent, and the offsets agree on the shared text
+                if offset <= len(current[2]) and text.startswith(shared):
+                    current[2] += text[len(shared):]
+                    current[1] = max(current[1], end)
+                    if (node.score or 0) > (current[3].score or 0):
+                        current[3] = node
+                    continue
+                merged.append(self.to_node(current))
+                current = window
+            merged.append(self.to_node(current))
+
+        merged.sort(key=lambda n: n.score or 0, reverse=True)
+        return merged
+
+    def to_node(self, window):
+        _, _, text, best = window
+        child = best.node
+        metadata = {k: v for k, v in child.metadata.items() if k not in HIDDEN_KEYS}
+        node = TextNode(
+            id_=child.node_id,
+            text=text,
+            metadata=metadata,
+            excluded_embed_metadata_keys=[
+                k for k in child.excluded_embed_metadata_keys if k not in HIDDEN_KEYS
+            ],
+            excluded_llm_metadata_keys=[
+                k for k in child.excluded_llm_metadata_keys if k not in HIDDEN_KEYS
+            ],
+            relationships=child.relationships,
+        )
+        return NodeWithScore(node=node, score=best.score)
@@ -0,0 +1,241 @@
+"""
+Headless HTTP API over CMLLLM, next to or instead of the Streamlit UI.
+
+Standalone:
+    python -m utils.http_api --port 8100
+Inside the Streamlit process, sharing its loaded models and vector store, set
+HTTP_API_PORT before starting the app.
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import utils.cmlllm as cmlllm
+import utils.adaptive_top_k as adaptive_top_k
+import utils.catalog as catalog
+import utils.chat_sessions as chat_sessions
+import utils.fanout as fanout
+import utils.llm_router as llm_router
+import utils.memory_budget as memory_budget
+import utils.milvus_connection as milvus_connection
+import utils.milvus_residency as milvus_residency
+import utils.model_worker as model_worker
+import utils.token_chunker as token_chunker
+import utils.vectordb as vectordb
+from utils.common import model_worker_socket
+
+UPLOAD_DIR = catalog.UPLOAD_DIR
+
+llm_lock = threading.Lock()
+shared_llm = None
+server_thread = None
+
+
+class ChatRequest(BaseModel):
+    collection: str = "Default"
+    message: str
+    stream: bool = True
+    # more collections to search together with `collection`, answered without chat memory
+    also_search: List[str] = []
+    # requests with the same session id share a chat history, without one none is kept
+    session_id: Optional[str] = None
+
+
+def get_llm():
+    """the CMLLLM shared by every API request, created on first use."""
+    global shared_llm
+    with llm_lock:
+        if shared_llm is None:
+            shared_llm = cmlllm.CMLLLM()
+        return shared_llm
+
+
+def set_llm(llm):
+    global shared_llm
+    shared_llm = llm
+
+
+def check_collection_name(collection_name):
+    """400 for a name that could escape the upload and vector data directories."""
+    if not catalog.is_valid_collection_name(collection_name):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid collection name {collection_name!r}, use letters, digits and _",
+        )
+
+
+def check_file_name(file_name):
+    if os.path.basename(file_name) in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail=f"Invalid file name {file_name!r}")
+
+
+def sse_event(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+
+def create_app():
+    app = FastAPI(title="AI Chat with your documents")
+
+    @app.get("/health")
+    def health():
+        return {
+            "status": "ok",
+            "vector_db": vectordb.vector_db_status(),
+            "models": sorted(llm_router.llm_map),
+        }
+
+    @app.get("/metrics")
+    def metrics():
+        return {
+            "latency": llm_router.get_latency_stats(),
+            "memory": memory_budget.memory_report(),
+            "search": fanout.get_search_stats(),
+            "chunks_per_query": adaptive_top_k.get_usage_stats(),
+            "chunking": token_chunker.get_chunk_stats(),
+            "milvus_resident": (
+                milvus_residency.get_resident() if vectordb.is_milvus_backend() else []
+            ),
+            "milvus_connection": (
+                milvus_connection.get_stats() if vectordb.is_milvus_backend() else {}
+            ),
+            "model_worker": (
+                model_worker.get_worker_stats(model_worker_socket) if model_worker_socket else {}
+            ),
+        }
+
+    @app.get("/collections")
+    def list_collections():
+        return catalog.read_catalog()
+
+    @app.post("/collections/{collection_name}")
+    async def create_collection(collection_name: str):
+        check_collection_name(collection_name)
+        await run_in_threadpool(get_llm().set_collection_name, collection_name)
+        return {"collection": collection_name}
+
+    @app.delete("/collections/{collection_name}")
+    async def delete_collection(collection_name: str):
+        check_collection_name(collection_name)
+        if collection_name == "Default":
+            raise HTTPException(status_code=400, detail="the Default collection can't be deleted")
+        await run_in_threadpool(get_llm().delete_collection_name, collection_name)
+        shutil.rmtree(os.path.join(UPLOAD_DIR, collection_name), ignore_errors=True)
+        return {"deleted": collection_name}
+
+    @app.delete("/collections/{collection_name}/files/{file_name}")
+    async def delete_file(collection_name: str, file_name: str):
+        check_collection_name(collection_name)
+        check_file_name(file_name)
+        file_path = os.path.join(UPLOAD_DIR, collection_name, os.path.basename(file_name))
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        deleted = await run_in_threadpool(get_llm().delete_file, collection_name, file_name)
+        return {"deleted": deleted}
+
+    @app.post("/collections/{collection_name}/ingest")
+    async def ingest(
+        collection_name: str,
+        files: List[UploadFile] = File(default=[]),
+        questions: int = Form(default=1),
+    ):
+        check_collection_name(collection_name)
+        for upload in files:
+            check_file_name(upload.filename)
+        collection_dir = os.path.join(UPLOAD_DIR, collection_name)
+        os.makedirs(collection_dir, exist_ok=True)
+        for upload in files:
+            file_path = os.path.join(collection_dir, os.path.basename(upload.filename))
+            with open(file_path, "wb") as f:
+                shutil.copyfileobj(upload.file, f)
+            catalog.add_file(collection_name, file_path)
+
+        ingest_files = catalog.file_paths(collection_name)
+        if not ingest_files:
+            raise HTTPException(status_code=400, detail="No files")
+
+        llm = get_llm()
+        await run_in_threadpool(llm.set_collection_name, collection_name)
+        output = await run_in_threadpool(llm.ingest, ingest_files, questions, collection_name)
+        if output.startswith("Error:"):
+            raise HTTPException(status_code=500, detail=output)
+        return {
+            "collection": collection_name,
+            "files": [os.path.basename(f) for f in ingest_files],
+            "questions": [q for q in output.split("\n") if q],
+        }
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest):
+        collection_names = [request.collection] + request.also_search
+        for collection_name in collection_names:
+            check_collection_name(collection_name)
+            if catalog.get_collection(collection_name) is None:
+                raise HTTPException(
+                    status_code=404, detail=f"Collection {collection_name} not found"
+                )
+        llm = get_llm()
+        if request.collection not in cmlllm.chat_engine_map:
+            await run_in_threadpool(llm.set_collection_name, request.collection)
+        if not catalog.is_ready(request.collection):
+            raise HTTPException(
+                status_code=409,
+                detail="No documents are processed yet. Please process some documents..",
+            )
+        if request.also_search:
+            # infer_collections blocks on the llm, so it is advanced on a worker thread
+            tokens = iterate_in_threadpool(
+                llm.infer_collections(request.message, collection_names)
+            )
+        else:
+            # API clients never share a memory with the Streamlit sessions
+            memory = chat_sessions.get_memory(
+                request.collection, request.session_id, llm.memory_token_limit
+            )
+            tokens = llm.astream_answer(request.message, request.collection, memory)
+
+        if not request.stream:
+            answer = "".join([t async for t in tokens])
+            return {"collection": request.collection, "answer": answer}
+
+        async def event_stream():
+            async for token in tokens:
+                yield sse_event({"token": token})
+            yield sse_event({}, event="done")
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+def start_in_background(port, llm=None):
+    """serves the API from a daemon thread of the current process, once per process."""
+    global server_thread
+    if server_thread is not None and server_thread.is_alive():
+        return
+    if llm is not None:
+        set_llm(llm)
+    config = uvicorn.Config(create_app(), host="127.0.0.1", port=port, log_level="info")
+    server = uvicorn.Server(config)
+    server_thread = threading.Thread(target=server.run, name="http-api", daemon=True)
+    server_thread.start()
+    print(f"http api listening on port {port}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    uvicorn.run(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,262 @@
+"""
+Hardware aware runtime parameters for llama.cpp models.
+
+llama-cpp-python sizes its thread pool from the host cpu count, which inside a
+6 CPU application pod on a large node is far too many threads. This module
+derives defaults from the cgroup limits and can calibrate prompt eval and
+generation speed over candidate settings, persisting the best profile per model
+and host fingerprint so later starts pick it up automatically.
+
+Run a calibration for every supported model with:
+    python -m utils.llama_cpp_tuning
+"""
+import hashlib
+import itertools
+import json
+import os
+import platform
+import time
+
+PROFILES_FILE = os.path.join("models", "llama_cpp_profiles.json")
+GGML_TYPE_F16 = 1
+GGML_TYPE_Q8_0 = 8
+
+# a typical RAG request: retrieved chunks plus question in, a short answer out
+CALIBRATION_PROMPT_TOKENS = 512
+CALIBRATION_GEN_TOKENS = 32
+REQUEST_PROMPT_TOKENS = 2000
+REQUEST_GEN_TOKENS = 256
+KV_QUANT_MAX_SLOWDOWN = 1.05
+
+
+def effective_cpu_count():
+    """cpus this process may actually use, honouring cgroup quotas and affinity."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def memory_limit_bytes():
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value != "max" and int(value) < 1 << 60:
+                return int(value)
+        except (OSError, ValueError):
+            continue
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def cpu_model_name():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def host_fingerprint(model_path, n_gpu_layers, context_window):
+    gpu_name = ""
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            gpu_name = torch.cuda.get_device_name(0)
+    except ImportError:
+        pass
+    parts = [
+        os.path.basename(model_path),
+        str(os.path.getsize(model_path)),
+        cpu_model_name(),
+        str(effective_cpu_count()),
+        str(memory_limit_bytes()),
+        gpu_name,
+        str(n_gpu_layers),
+        str(context_window),
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def default_profile(model_path):
+    cpus = effective_cpu_count()
+    memory_limit = memory_limit_bytes()
+    model_size = os.path.getsize(model_path)
+    return {
+        "n_threads": cpus,
+        "n_threads_batch": cpus,
+        "n_batch": 512,
+        "use_mmap": True,
+        # pin the weights only when they fit with plenty of headroom
+        "use_mlock": bool(memory_limit and model_size * 2 < memory_limit),
+    }
+
+
+def load_profiles():
+    if not os.path.exists(PROFILES_FILE):
+        return {}
+    with open(PROFILES_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_profile(fingerprint, profile):
+    profiles = load_profiles()
+    profiles[fingerprint] = profile
+    os.makedirs(os.path.dirname(PROFILES_FILE), exist_ok=True)
+    with open(PROFILES_FILE, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+
+
+def candidate_settings():
+    cpus = effective_cpu_count()
+    threads = sorted({max(1, cpus // 2), max(1, cpus - 1), cpus})
+    batches = [128, 256, 512]
+    return [{"n_threads": t, "n_batch": b} for t, b in itertools.product(threads, batches)]
+
+
+def measure(model_path, n_gpu_layers, context_window, settings):
+    """returns prompt eval and generation tokens/s for one set of llama.cpp settings."""
+    from llama_cpp import Llama
+
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=context_window,
+        n_gpu_layers=n_gpu_layers,
+        n_threads=settings["n_threads"],
+        n_threads_batch=settings.get("n_threads_batch", settings["n_threads"]),
+        n_batch=settings["n_batch"],
+        type_k=settings.get("type_k"),
+        verbose=False,
+    )
+    try:
+        prompt = " ".join(["The quick brown fox jumps over the lazy dog."] * 64)
+        tokens = llm.tokenize(prompt.encode("utf-8"))[:CALIBRATION_PROMPT_TOKENS]
+        prompt = llm.detokenize(tokens).decode("utf-8", errors="ignore")
+
+        start = time.time()
+        first_token_at = None
+        generated = 0
+        for _ in llm.create_completion(
+            prompt, max_tokens=CALIBRATION_GEN_TOKENS, temperature=0.0, stream=True
+        ):
+            if first_token_at is None:
+                first_token_at = time.time()
+            generated += 1
+        end = time.time()
+    finally:
+        del llm
+
+    if first_token_at is None:
+        raise RuntimeError(f"llama.cpp generated no tokens with {settings}")
+    prompt_tps = len(tokens) / max(first_token_at - start, 1e-6)
+    gen_tps = max(generated - 1, 1) / max(end - first_token_at, 1e-6)
+    return prompt_tps, gen_tps
+
+
+def request_seconds(prompt_tps, gen_tps):
+    return REQUEST_PROMPT_TOKENS / prompt_tps + REQUEST_GEN_TOKENS / gen_tps
+
+
+def calibrate(model_path, n_gpu_layers, context_window):
+    print(f"calibrating llama.cpp settings for {model_path}")
+    best = None
+    for settings in candidate_settings():
+        settings["n_threads_batch"] = settings["n_threads"]
+        try:
+            prompt_tps, gen_tps = measure(model_path, n_gpu_layers, context_window, settings)
+        except Exception as e:
+            print(f"settings = {settings} failed: {e}")
+            continue
+        seconds = request_seconds(prompt_tps, gen_tps)
+        print(
+            f"settings = {settings}, prompt_tps = {prompt_tps:.1f}, "
+            f"gen_tps = {gen_tps:.1f}, request = {seconds:.2f}s"
+        )
+        if best is None or seconds < best[0]:
+            best = (seconds, settings, prompt_tps, gen_tps)
+    if best is None:
+        raise RuntimeError(f"no llama.cpp settings could be measured for {model_path}")
+
+    seconds, settings, prompt_tps, gen_tps = best
+    # a q8_0 key cache halves its memory; keep it unless it costs noticeable speed
+    quantized = dict(settings, type_k=GGML_TYPE_Q8_0)
+    try:
+        q_prompt_tps, q_gen_tps = measure(model_path, n_gpu_layers, context_window, quantized)
+        if request_seconds(q_prompt_tps, q_gen_tps) <= seconds * KV_QUANT_MAX_SLOWDOWN:
+            settings, prompt_tps, gen_tps = quantized, q_prompt_tps, q_gen_tps
+    except Exception as e:
+        print(f"q8_0 kv cache is not usable with {model_path}: {e}")
+
+    profile = dict(default_profile(model_path))
+    profile.update(settings)
+    profile["calibration"] = {
+        "prompt_tokens_per_s": round(prompt_tps, 2),
+        "gen_tokens_per_s": round(gen_tps, 2),
+        "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    print(f"best llama.cpp profile for {model_path}: {profile}")
+    return profile
+
+
+def get_model_kwargs(model_path, n_gpu_layers, context_window):
+    """
+    llama.cpp model kwargs for this model on this host: the persisted calibration
+    result when there is one, a fresh calibration when LLAMA_CPP_TUNE=1, else
+    defaults derived from the cgroup limits.
+    """
+    fingerprint = host_fingerprint(model_path, n_gpu_layers, context_window)
+    profile = load_profiles().get(fingerprint)
+    if profile is None and os.getenv("LLAMA_CPP_TUNE", "0") == "1":
+        try:
+            profile = calibrate(model_path, n_gpu_layers, context_window)
+            save_profile(fingerprint, profile)
+        except Exception as e:
+            print(f"llama.cpp calibration failed, using the default profile: {e}")
+    if profile is None:
+        profile = default_profile(model_path)
+    model_kwargs = {k: v for k, v in profile.items() if k != "calibration"}
+    model_kwargs["n_gpu_layers"] = n_gpu_layers
+    print(f"llama.cpp model kwargs for {os.path.basename(model_path)}: {model_kwargs}")
+    return model_kwargs
+
+
+if __name__ == "__main__":
+    from huggingface_hub import hf_hub_download
+    from utils.common import supported_llm_models
+
+    import torch
+
+    # same offload as CMLLLM uses on this node
+    n_gpu_layers = 20 if torch.cuda.is_available() else 0
+    for model_name, filename in supported_llm_models.items():
+        model_path = hf_hub_download(
+            repo_id=model_name,
+            filename=filename,
+            cache_dir="./models",
+            local_files_only=True,
+        )
+        profile = calibrate(model_path, n_gpu_layers, 3900)
+        save_profile(host_fingerprint(model_path, n_gpu_layers, 3900), profile)
@@ -0,0 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.common import llm_task_routing
+
+TASK_ANSWER = "answer"
+TASK_QUESTION_GENERATION = "question_generation"
+
+# model name -> loaded llm
+llm_map = {}
+default_model_name = None
+
+# (model name, task) -> accumulated latency counters
+latency_stats = {}
+stats_lock = threading.Lock()
+
+
+def phi3_messages_to_prompt(messages):
+    prompt = ""
+    for message in messages:
+        prompt += f"<|{message.role.value}|>\n{message.content}<|end|>\n"
+    return prompt + "<|assistant|>\n"
+
+
+def phi3_completion_to_prompt(completion):
+    return f"<|user|>\n{completion}<|end|>\n<|assistant|>\n"
+
+
+# model name -> (messages_to_prompt, completion_to_prompt) for models that don't
+# use the llama2/mistral [INST] prompt format
+prompt_formats = {
+    "microsoft/Phi-3-mini-4k-instruct-gguf": (
+        phi3_messages_to_prompt,
+        phi3_completion_to_prompt,
+    ),
+}
+
+
+def get_prompt_format(model_name, default):
+    return prompt_formats.get(model_name, default)
+
+
+def routed_models():
+    return sorted(set(llm_task_routing.values()))
+
+
+def register_llm(model_name, llm, default=False):
+    global default_model_name
+    llm_map[model_name] = llm
+    if default or default_model_name is None:
+        default_model_name = model_name
+
+
+def get_model_for_task(task):
+    model_name = llm_task_routing.get(task, default_model_name)
+    if model_name not in llm_map:
+        return default_model_name
+    return model_name
+
+
+def get_llm(task):
+    return llm_map[get_model_for_task(task)]
+
+
+def record_latency(model_name, task, seconds, tokens=0, first_token_s=None):
+    with stats_lock:
+        stats = latency_stats.setdefault(
+            (model_name, task),
+            {"calls": 0, "total_s": 0.0, "tokens": 0, "first_token_s": 0.0},
+        )
+        stats["calls"] += 1
+        stats["total_s"] += seconds
+        stats["tokens"] += tokens
+        if first_token_s is not None:
+            stats["first_token_s"] += first_token_s
+
+
+@contextmanager
+def track(task):
+    """times a non streaming llm call made for `task`."""
+    model_name = get_model_for_task(task)
+    start = time.time()
+    try:
+        yield model_name
+    finally:
+        record_latency(model_name, task, time.time() - start)
+
+
+def track_stream(task, token_gen):
+    """passes the tokens through while recording time to first token and tokens/s."""
+    model_name = get_model_for_task(task)
+    start = time.time()
+    first_token_s = None
+    tokens = 0
+    try:
+        for token in token_gen:
+            if first_token_s is None:
+                first_token_s = time.time() - start
+            tokens += 1
+            yield token
+    finally:
+        record_latency(model_name, task, time.time() - start, tokens, first_token_s)
+
+
+def get_latency_stats():
+    rows = []
+    with stats_lock:
+        for (model_name, task), stats in sorted(latency_stats.items()):
+            calls = stats["calls"]
+            rows.append(
+                {
+                    "model": model_name,
+                    "task": task,
+                    "calls": calls,
+                    "avg_s": round(stats["total_s"] / calls, 3),
+                    "avg_first_token_s": round(stats["first_token_s"] / calls, 3),
+                    "tokens_per_s": round(stats["tokens"] / stats["total_s"], 2)
+                    if stats["total_s"] > 0
+                    else 0.0,
+                }
+            )
+    return rows
@@ -0,0 +1,343 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+LOCAL_VECTOR_DATA_DIR = "local-vector-data"
+VECTORS_FILE = "vectors.f32"
+NODES_FILE = "nodes.jsonl"
+ANN_FILE = "ann.bin"
+FILE_NAME_KEY = "file_name"
+DEFAULT_ANN_THRESHOLD = 20000
+
+
+def _match_filters(metadata, filters: Optional[MetadataFilters]):
+    if filters is None:
+        return True
+    matches = [
+        metadata.get(f.key) == f.value for f in filters.legacy_filters()
+    ]
+    if filters.condition == FilterCondition.OR:
+        return any(matches)
+    return all(matches)
+
+
+def _top_k(sims, k):
+    """(indices, scores) of the k highest similarities, best first."""
+    k = min(k, len(sims))
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return top, sims[top].tolist()
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """
+    In-process vector store kept in memory mapped numpy files on local disk.
+
+    Small collections are searched with a brute force inner product top-k. Once a
+    collection grows past `ann_threshold` rows, and hnswlib is installed, an HNSW
+    graph is built lazily and used for unfiltered searches.
+    """
+
+    stores_text: bool = True
+    stores_node: bool = True
+
+    collection_name: str = "llamacollection"
+    dim: int = 1024
+    persist_dir: str = LOCAL_VECTOR_DATA_DIR
+    ann_threshold: int = DEFAULT_ANN_THRESHOLD
+
+    _lock: Any = PrivateAttr()
+    _vectors: Any = PrivateAttr()
+    _entries: List[dict] = PrivateAttr()
+    _ann: Any = PrivateAttr()
+
+    def __init__(
+        self,
+        collection_name: str = "llamacollection",
+        dim: int = 1024,
+        persist_dir: str = LOCAL_VECTOR_DATA_DIR,
+        ann_threshold: int = DEFAULT_ANN_THRESHOLD,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            collection_name=collection_name,
+            dim=dim,
+            persist_dir=persist_dir,
+            ann_threshold=ann_threshold,
+        )
+        self._lock = threading.RLock()
+        self._ann = None
+        os.makedirs(self.collection_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def collection_dir(self):
+        return os.path.join(self.persist_dir, self.collection_name)
+
+    def _path(self, name):
+        return os.path.join(self.collection_dir, name)
+
+    def _load(self):
+        self._entries = []
+        if os.path.exists(self._path(NODES_FILE)):
+            with open(self._path(NODES_FILE), "r", encoding="utf-8") as f:
+                self._entries = [json.loads(line) for line in f if line.strip()]
+        self._remap()
+
+    def _remap(self):
+        rows = len(self._entries)
+        if rows == 0:
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        else:
+            self._vectors = np.memmap(
+                self._path(VECTORS_FILE), dtype=np.float32, mode="r", shape=(rows, self.dim)
+            )
+        self._ann = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"embedding dim {vectors.shape[1]} does not match collection dim {self.dim}"
+            )
+        entries = []
+        for node in nodes:
+            entry = node_to_metadata_dict(node)
+            entry["id"] = node.node_id
+            entries.append(entry)
+
+        self.add_entries(entries, vectors)
+        return [node.node_id for node in nodes]
+
+    def add_entries(self, entries, vectors):
+        """appends already serialized node entries and their embedding rows."""
+        with self._lock:
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self._path(NODES_FILE), "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            if os.path.exists(self._path(ANN_FILE)):
+                os.remove(self._path(ANN_FILE))
+            self._entries.extend(entries)
+            self._remap()
+
+    def iter_entries(self, batch_size=1000):
+        """yields (entries, vectors) batches of everything stored in the collection."""
+        for start in range(0, len(self._entries), batch_size):
+            end = start + batch_size
+            yield self._entries[start:end], np.asarray(self._vectors[start:end])
+
+    def _rewrite(self, keep):
+        """rewrites the collection files keeping only the rows marked in `keep`."""
+        with self._lock:
+            vectors = np.array(self._vectors[keep])
+            entries = [e for e, k in zip(self._entries, keep) if k]
+            tmp_vectors = self._path(VECTORS_FILE + ".tmp")
+            tmp_nodes = self._path(NODES_FILE + ".tmp")
+            with open(tmp_vectors, "wb") as f:
+                f.write(vectors.tobytes())
+            with open(tmp_nodes, "w", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            self._vectors = None
+            os.replace(tmp_vectors, self._path(VECTORS_FILE))
+            os.replace(tmp_nodes, self._path(NODES_FILE))
+            if os.path.exists(self._path(ANN_FILE)):
+                os.remove(self._path(ANN_FILE))
+            self._entries = entries
+            self._remap()
+            return int(len(keep) - np.count_nonzero(keep))
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        doc_ids = ref_doc_id if isinstance(ref_doc_id, list) else [ref_doc_id]
+        # the mask has to match the rows _rewrite filters, so both happen under the lock
+        with self._lock:
+            keep = np.array([e.get("doc_id") not in doc_ids for e in self._entries], dtype=bool)
+            if not keep.all():
+                self._rewrite(keep)
+
+    def delete_nodes(self, node_ids: List[str] = None, filters=None, **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise ValueError("deleting by metadata filters is not supported")
+        node_ids = set(node_ids or [])
+        with self._lock:
+            keep = np.array([e["id"] not in node_ids for e in self._entries], dtype=bool)
+            if not keep.all():
+                self._rewrite(keep)
+
+    def upsert_nodes(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """adds the nodes, replacing the stored ones with the same node ids."""
+        self.delete_nodes([node.node_id for node in nodes])
+        return self.add(nodes)
+
+    def delete_file(self, file_name):
+        file_name = os.path.basename(file_name)
+        with self._lock:
+            keep = np.array(
+                [e.get(FILE_NAME_KEY) != file_name for e in self._entries], dtype=bool
+            )
+            if keep.all():
+                return False
+            print(f"deleting {file_name} from local collection {self.collection_name}")
+            self._rewrite(keep)
+            return True
+
+    def list_files(self):
+        return sorted({e.get(FILE_NAME_KEY) for e in self._entries if e.get(FILE_NAME_KEY)})
+
+    def drop(self):
+        with self._lock:
+            self._vectors = None
+            shutil.rmtree(self.collection_dir, ignore_errors=True)
+            self._entries = []
+            self._remap()
+
+    def memory_bytes(self):
+        # memory mapped rows are only resident once searched, count them as if they were
+        size = self._vectors.nbytes + sum(len(e.get("_node_content") or "") for e in self._entries)
+        if self._ann is not None:
+            size += self._ann.get_current_count() * self.dim * 4
+        return size
+
+    def release_ann(self):
+        """frees the in memory ann graph, it is reloaded from disk on the next search."""
+        self._ann = None
+
+    def _get_ann(self):
+        if hnswlib is None or len(self._entries) < self.ann_threshold:
+            return None
+        if self._ann is not None:
+            return self._ann
+        ann = hnswlib.Index(space="ip", dim=self.dim)
+        if os.path.exists(self._path(ANN_FILE)):
+            ann.load_index(self._path(ANN_FILE), max_elements=len(self._entries))
+        else:
+            print(f"building ann graph for {self.collection_name}, rows = {len(self._entries)}")
+            ann.init_index(max_elements=len(self._entries), ef_construction=200, M=16)
+            ann.add_items(np.asarray(self._vectors), np.arange(len(self._entries)))
+            ann.save_index(self._path(ANN_FILE))
+        ann.set_ef(64)
+        self._ann = ann
+        return ann
+
+    def _candidate_mask(self, query: VectorStoreQuery, file_names):
+        if not (file_names or query.filters or query.doc_ids or query.node_ids):
+            return None
+        doc_ids = set(query.doc_ids or [])
+        node_ids = set(query.node_ids or [])
+        file_names = set(file_names or [])
+        return np.array(
+            [
+                (not file_names or e.get(FILE_NAME_KEY) in file_names)
+                and (not doc_ids or e.get("doc_id") in doc_ids)
+                and (not node_ids or e["id"] in node_ids)
+                and _match_filters(e, query.filters)
+                for e in self._entries
+            ],
+            dtype=bool,
+        )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"local vector store does not support {query.mode} yet.")
+
+        file_names = [os.path.basename(f) for f in kwargs.pop("file_names", None) or []]
+        top_k = query.similarity_top_k
+        with self._lock:
+            if not self._entries:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            q = np.asarray(query.query_embedding, dtype=np.float32)
+            mask = self._candidate_mask(query, file_names)
+            ann = self._get_ann() if mask is None else None
+
+            if ann is not None:
+                labels, distances = ann.knn_query(q, k=min(top_k, len(self._entries)))
+                rows = labels[0].tolist()
+                # hnswlib reports inner product distance as 1 - ip
+                scores = (1.0 - distances[0]).tolist()
+            elif mask is None:
+                # the product reads the memory map in place, indexing it would copy every row
+                top, scores = _top_k(self._vectors @ q, top_k)
+                rows = top.tolist()
+            else:
+                candidates = np.flatnonzero(mask)
+                if len(candidates) == 0:
+                    return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+                top, scores = _top_k(self._vectors[candidates] @ q, top_k)
+                rows = candidates[top].tolist()
+
+            entries = [self._entries[r] for r in rows]
+
+        nodes = [metadata_dict_to_node(e) for e in entries]
+        return VectorStoreQueryResult(
+            nodes=nodes, similarities=scores, ids=[e["id"] for e in entries]
+        )
+
+    def query_batch(self, query_embeddings, similarity_top_k, file_names=None, chunk_size=256):
+        """brute force top-k for many query embeddings with one matrix product per chunk."""
+        file_names = {os.path.basename(f) for f in file_names or []}
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        results = []
+        with self._lock:
+            if file_names:
+                candidates = np.flatnonzero(
+                    [e.get(FILE_NAME_KEY) in file_names for e in self._entries]
+                )
+                vectors = self._vectors[candidates]
+            else:
+                # every row is searched, the memory map is used in place
+                candidates = np.arange(len(self._entries))
+                vectors = self._vectors
+            if len(candidates) == 0:
+                return [
+                    VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+                    for _ in range(len(queries))
+                ]
+            k = min(similarity_top_k, len(candidates))
+            for start in range(0, len(queries), chunk_size):
+                sims = queries[start : start + chunk_size] @ vectors.T
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                for row, row_top in zip(sims, top):
+                    row_top = row_top[np.argsort(-row[row_top])]
+                    entries = [self._entries[r] for r in candidates[row_top]]
+                    results.append(
+                        VectorStoreQueryResult(
+                            nodes=[metadata_dict_to_node(e) for e in entries],
+                            similarities=row[row_top].tolist(),
+                            ids=[e["id"] for e in entries],
+                        )
+                    )
+        return results
@@ -0,0 +1,168 @@
+"""
+Memory accounting for the app process and a budget the components shrink to fit.
+
+RSS can't be split exactly between native libraries, so each component registers
+an estimate of the bytes it holds (model weights and kv cache, embedder
+parameters, vector store, caches, in flight ingest batches). Whatever is left
+of the RSS is reported as "other".
+"""
+import ctypes
+import gc
+import os
+import threading
+from contextlib import contextmanager
+
+import psutil
+
+from utils.llama_cpp_tuning import memory_limit_bytes
+
+# fraction of the container limit the process aims to stay under
+DEFAULT_BUDGET_FRACTION = 0.85
+MB = 1024 * 1024
+
+# name -> callable returning the bytes the component currently holds
+component_sizes = {}
+# name -> callable that frees memory, called in registration order when over budget
+shrinkers = {}
+
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+
+def budget_bytes():
+    budget_mb = os.getenv("MEMORY_BUDGET_MB")
+    if budget_mb:
+        return int(budget_mb) * MB
+    limit = memory_limit_bytes()
+    return int(limit * DEFAULT_BUDGET_FRACTION) if limit else None
+
+
+def process_rss():
+    """rss of this process plus its children, which includes an embedded milvus server."""
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+def register_component(name, size_fn):
+    component_sizes[name] = size_fn
+
+
+def register_shrinker(name, shrink_fn):
+    shrinkers[name] = shrink_fn
+
+
+@contextmanager
+def track_in_flight(name, nbytes):
+    """accounts `nbytes` to `name` while a batch is being processed."""
+    with in_flight_lock:
+        in_flight[name] = in_flight.get(name, 0) + nbytes
+    try:
+        yield
+    finally:
+        with in_flight_lock:
+            in_flight[name] -= nbytes
+            if in_flight[name] <= 0:
+                in_flight.pop(name)
+
+
+def estimate_llama_cpp_bytes(llama):
+    """gguf weights plus an f16 kv cache sized from the model metadata and n_ctx."""
+    size = os.path.getsize(llama.model_path)
+    metadata = llama.metadata or {}
+    arch = metadata.get("general.architecture", "llama")
+    try:
+        n_layers = int(metadata[f"{arch}.block_count"])
+        n_embd = int(metadata[f"{arch}.embedding_length"])
+        n_head = int(metadata[f"{arch}.attention.head_count"])
+        n_head_kv = int(metadata.get(f"{arch}.attention.head_count_kv", n_head))
+        size += 2 * n_layers * llama.n_ctx() * (n_embd * n_head_kv // n_head) * 2
+    except (KeyError, ValueError):
+        pass
+    return size
+
+
+def estimate_torch_module_bytes(module):
+    return sum(p.numel() * p.element_size() for p in module.parameters()) + sum(
+        b.numel() * b.element_size() for b in module.buffers()
+    )
+
+
+def child_process_rss(name_fragment):
+    rss = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            if name_fragment in " ".join(child.cmdline()):
+                rss += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+def memory_report():
+    rows = []
+    attributed = 0
+    for name, size_fn in component_sizes.items():
+        try:
+            size = int(size_fn())
+        except Exception as e:
+            print(f"failed to size {name}: {e}")
+            continue
+        attributed += size
+        rows.append({"component": name, "mb": round(size / MB, 1)})
+    with in_flight_lock:
+        for name, size in in_flight.items():
+            attributed += size
+            rows.append({"component": f"in flight: {name}", "mb": round(size / MB, 1)})
+
+    rss = process_rss()
+    budget = budget_bytes()
+    rows.append({"component": "other", "mb": round(max(rss - attributed, 0) / MB, 1)})
+    rows.append({"component": "total rss", "mb": round(rss / MB, 1)})
+    if budget:
+        rows.append({"component": "budget", "mb": round(budget / MB, 1)})
+    return rows
+
+
+def headroom_bytes():
+    budget = budget_bytes()
+    if budget is None:
+        return None
+    return budget - process_rss()
+
+
+def release_free_memory():
+    gc.collect()
+    try:
+        # give freed heap pages back to the os, glibc keeps them after large ingests
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def enforce_budget():
+    """runs the shrinkers until the process is back under budget."""
+    budget = budget_bytes()
+    if budget is None or process_rss() <= budget:
+        return
+    release_free_memory()
+    for name, shrink_fn in shrinkers.items():
+        if process_rss() <= budget:
+            return
+        print(f"memory over budget, shrinking {name}")
+        shrink_fn()
+        release_free_memory()
+
+
+def fit_batch_size(default_size, item_bytes, min_size=16):
+    """largest batch up to `default_size` whose items fit in half the current headroom."""
+    headroom = headroom_bytes()
+    if headroom is None:
+        return default_size
+    fitting = int(max(headroom, 0) / 2 / max(item_bytes, 1))
+    return max(min_size, min(default_size, fitting))
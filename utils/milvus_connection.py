@@ -0,0 +1,156 @@
+"""
+The milvus connections of the process, shared by every vector store.
+
+A single MilvusClient per uri serves every collection and the `default` alias
+serves the orm calls (Collection, utility). The health of the server is probed
+at most once per MILVUS_HEALTH_TTL_S, and requests that fail while milvus is
+briefly unavailable (a restart, a full grpc queue) are retried with exponential
+backoff through `call_with_retry`.
+
+MILVUS_URI can point at a Milvus Lite file such as ./milvus.db to run without a
+server, and `set_client` swaps in a stand-in client.
+"""
+import random
+import socket
+import threading
+import time
+from contextlib import closing
+from urllib.parse import urlparse
+
+import grpc
+from pymilvus import MilvusClient, connections, utility
+from pymilvus.exceptions import MilvusException, MilvusUnavailableException
+
+from utils.common import (
+    milvus_health_ttl_s,
+    milvus_retry_attempts,
+    milvus_retry_backoff_s,
+    milvus_uri,
+)
+
+DEFAULT_ALIAS = "default"
+PROBE_TIMEOUT_S = 1.0
+TRANSIENT_GRPC_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+TRANSIENT_MESSAGES = (
+    "unavailable", "connection", "connect failed", "fail connecting", "deadline", "timeout"
+)
+
+# uri -> MilvusClient
+clients = {}
+connection_lock = threading.Lock()
+
+health_state = {"up": False, "version": None, "checked_at": 0.0}
+health_lock = threading.Lock()
+
+stats = {"connects": 0, "health_probes": 0, "retries": 0, "failures": 0}
+
+
+def is_server_uri(uri):
+    return urlparse(uri).scheme in ("http", "https", "tcp", "grpc")
+
+
+def connect_default(uri=milvus_uri):
+    """connects the `default` alias used by Collection and utility, once."""
+    with connection_lock:
+        if not connections.has_connection(DEFAULT_ALIAS):
+            connections.connect(alias=DEFAULT_ALIAS, uri=uri)
+            stats["connects"] += 1
+    return DEFAULT_ALIAS
+
+
+def get_client(uri=milvus_uri):
+    """the MilvusClient every vector store of the process shares."""
+    with connection_lock:
+        client = clients.get(uri)
+        if client is None:
+            client = clients[uri] = MilvusClient(uri=uri)
+            stats["connects"] += 1
+        return client
+
+
+def set_client(client, uri=milvus_uri):
+    """installs a client, e.g. a fake in tests, in place of a real connection."""
+    with connection_lock:
+        clients[uri] = client
+
+
+def close_all():
+    with connection_lock:
+        for client in clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                print(f"failed to close milvus client: {e}")
+        clients.clear()
+        if connections.has_connection(DEFAULT_ALIAS):
+            connections.disconnect(DEFAULT_ALIAS)
+    invalidate_health()
+
+
+def _port_open(uri):
+    parsed = urlparse(uri)
+    port = parsed.port or (443 if parsed.scheme == "https" else 19530)
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        sock.settimeout(PROBE_TIMEOUT_S)
+        return sock.connect_ex((parsed.hostname or "localhost", port)) == 0
+
+
+def _probe(uri):
+    # a closed port fails fast, connecting a client to it would block for seconds
+    if is_server_uri(uri) and not _port_open(uri):
+        return False, None
+    try:
+        connect_default(uri)
+        return True, utility.get_server_version(using=DEFAULT_ALIAS)
+    except Exception as e:
+        print(f"milvus health probe failed: {e}")
+        return False, None
+
+
+def health(refresh=False, uri=milvus_uri):
+    """{"up", "version", "checked_at"}, probed again once the cached state is stale."""
+    with health_lock:
+        if refresh or time.time() - health_state["checked_at"] > milvus_health_ttl_s:
+            up, version = _probe(uri)
+            health_state.update(up=up, version=version, checked_at=time.time())
+            stats["health_probes"] += 1
+        return dict(health_state)
+
+
+def invalidate_health():
+    with health_lock:
+        health_state["checked_at"] = 0.0
+
+
+def is_transient(e):
+    if isinstance(e, (MilvusUnavailableException, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(e, grpc.RpcError):
+        return e.code() in TRANSIENT_GRPC_CODES
+    if isinstance(e, MilvusException):
+        message = str(e).lower()
+        return any(m in message for m in TRANSIENT_MESSAGES)
+    return False
+
+
+def call_with_retry(fn, *args, **kwargs):
+    """
+    calls fn, retrying transient errors with exponential backoff and jitter.
+    Anything else, or the last transient error, is raised to the caller.
+    """
+    for attempt in range(milvus_retry_attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == milvus_retry_attempts or not is_transient(e):
+                stats["failures"] += 1
+                raise
+            invalidate_health()
+            delay = milvus_retry_backoff_s * 2**attempt * random.uniform(0.5, 1.0)
+            stats["retries"] += 1
+            print(f"milvus unavailable ({e}), retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def get_stats():
+    return {**stats, "clients": len(clients), "up": health_state["up"]}
@@ -0,0 +1,253 @@
+"""
+Keeps a bounded, least recently used set of milvus collections loaded.
+
+Milvus only searches collections that are loaded in its memory, and a loaded
+collection stays loaded until it is released. Every search goes through
+`searching`, which loads the collection, or only the partitions of the files the
+search is restricted to, when needed and marks it most recently used; past the count or size bound the least recently used collections that
+aren't being searched are released. When a folder is selected, the folders
+users usually go to next from it are loaded in the background.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from pymilvus import Collection, utility
+from pymilvus.client.types import LoadState
+
+import utils.milvus_connection as milvus_connection
+from utils.common import milvus_max_resident_collections, milvus_resident_mb
+
+MB = 1024 * 1024
+# per entity beyond the vector: the node json with its text, ids and index overhead
+ENTITY_OVERHEAD_BYTES = 4096
+PRELOAD_COUNT = 2
+
+# collection name -> estimated resident bytes, least recently used first
+resident = OrderedDict()
+# collection name -> names of its loaded partitions, when only those are loaded
+loaded_partitions = {}
+# collection name -> searches running on it, those are never released
+in_use = {}
+# collection name -> event set when its load finishes
+loading = {}
+# collection name -> {next collection name: times selected right after it}
+transitions = {}
+last_selected = None
+events = deque(maxlen=200)
+residency_lock = threading.RLock()
+
+preload_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="milvus-preload")
+
+
+def record_event(event, collection_name, seconds=0.0, nbytes=0):
+    events.append(
+        {
+            "time": time.strftime("%H:%M:%S"),
+            "event": event,
+            "collection": collection_name,
+            "seconds": round(seconds, 3),
+            "mb": round(nbytes / MB, 1),
+        }
+    )
+    print(f"milvus residency: {event} {collection_name} in {seconds:.2f}s, {nbytes / MB:.1f} MB")
+
+
+def estimate_bytes(collection, partition_names=None):
+    dim = 0
+    for field in collection.schema.fields:
+        if "dim" in field.params:
+            dim = int(field.params["dim"])
+    if partition_names is None:
+        entities = collection.num_entities
+    else:
+        entities = sum(collection.partition(p).num_entities for p in partition_names)
+    return entities * (dim * 4 + ENTITY_OVERHEAD_BYTES)
+
+
+def _release(collection_name):
+    nbytes = resident.pop(collection_name)
+    loaded_partitions.pop(collection_name, None)
+    start = time.time()
+    try:
+        Collection(collection_name).release()
+    except Exception as e:
+        print(f"failed to release {collection_name}: {e}")
+    record_event("release", collection_name, time.time() - start, nbytes)
+
+
+def _evict():
+    """releases least recently used collections until the bounds hold again."""
+    budget = milvus_resident_mb * MB
+    for collection_name in list(resident):
+        if len(resident) <= milvus_max_resident_collections and sum(resident.values()) <= budget:
+            return
+        if in_use.get(collection_name) or collection_name == next(reversed(resident)):
+            continue
+        _release(collection_name)
+
+
+def _pin(collection_name):
+    in_use[collection_name] = in_use.get(collection_name, 0) + 1
+
+
+def _is_loaded(collection_name, partition_names):
+    if collection_name not in resident:
+        return False
+    partitions = loaded_partitions.get(collection_name)
+    return partitions is None or (
+        partition_names is not None and set(partition_names) <= partitions
+    )
+
+
+def ensure_loaded(collection_name, pin=False, partition_names=None):
+    """
+    loads the collection, or only the given partitions of it, unless they are
+    resident. With `pin` it is also marked as searched, atomically with the
+    load, so it can't be released in between.
+    """
+    with residency_lock:
+        if _is_loaded(collection_name, partition_names):
+            resident.move_to_end(collection_name)
+            if pin:
+                _pin(collection_name)
+            return
+        loading_done = loading.get(collection_name)
+        owner = loading_done is None
+        if owner:
+            loading_done = loading[collection_name] = threading.Event()
+            partitions = (
+                loaded_partitions.get(collection_name, set())
+                if collection_name in resident
+                else set()
+            )
+
+    if not owner:
+        # another thread is loading it, a load takes seconds and must not run twice
+        loading_done.wait()
+        return ensure_loaded(collection_name, pin, partition_names)
+
+    nbytes = None
+    try:
+        if utility.has_collection(collection_name):
+            collection = Collection(collection_name)
+            start = time.time()
+            if partition_names is None:
+                partitions = None
+                if utility.load_state(collection_name) == LoadState.Loaded:
+                    event = "adopt"
+                else:
+                    milvus_connection.call_with_retry(collection.load)
+                    event = "load"
+            else:
+                # the rest of the collection stays on disk until a search needs it
+                missing = sorted(set(partition_names) - partitions)
+                milvus_connection.call_with_retry(collection.load, partition_names=missing)
+                partitions = partitions | set(missing)
+                event = f"load {len(missing)} partitions of"
+            nbytes = estimate_bytes(collection, partitions)
+            record_event(event, collection_name, time.time() - start, nbytes)
+    finally:
+        with residency_lock:
+            if nbytes is not None:
+                resident[collection_name] = nbytes
+                resident.move_to_end(collection_name)
+                if partitions is None:
+                    loaded_partitions.pop(collection_name, None)
+                else:
+                    loaded_partitions[collection_name] = partitions
+                _evict()
+            if pin:
+                _pin(collection_name)
+            loading.pop(collection_name).set()
+
+
+@contextmanager
+def searching(collection_name, partition_names=None):
+    """keeps the collection, or the searched partitions of it, loaded while it is searched."""
+    ensure_loaded(collection_name, pin=True, partition_names=partition_names)
+    try:
+        yield
+    finally:
+        with residency_lock:
+            in_use[collection_name] -= 1
+            if in_use[collection_name] <= 0:
+                in_use.pop(collection_name)
+
+
+def likely_next(collection_name, count=PRELOAD_COUNT):
+    followers = transitions.get(collection_name, {})
+    return sorted(followers, key=followers.get, reverse=True)[:count]
+
+
+def preload(collection_names):
+    for collection_name in collection_names:
+        if collection_name not in resident:
+            preload_pool.submit(_preload, collection_name)
+
+
+def _preload(collection_name):
+    try:
+        ensure_loaded(collection_name)
+    except Exception as e:
+        print(f"failed to preload {collection_name}: {e}")
+
+
+def select(collection_name):
+    """a folder was selected: load it and preload the folders usually selected after it."""
+    global last_selected
+    with residency_lock:
+        if last_selected and last_selected != collection_name:
+            followers = transitions.setdefault(last_selected, {})
+            followers[collection_name] = followers.get(collection_name, 0) + 1
+        last_selected = collection_name
+    ensure_loaded(collection_name)
+    preload(likely_next(collection_name))
+
+
+def forget(collection_name):
+    """the collection was dropped, milvus released it with the drop."""
+    with residency_lock:
+        resident.pop(collection_name, None)
+        loaded_partitions.pop(collection_name, None)
+        transitions.pop(collection_name, None)
+        for followers in transitions.values():
+            followers.pop(collection_name, None)
+
+
+def forget_partition(collection_name, partition_name):
+    """the partition was released to be dropped."""
+    with residency_lock:
+        partitions = loaded_partitions.get(collection_name)
+        if partitions is not None:
+            partitions.discard(partition_name)
+
+
+def shrink():
+    """releases every collection but the most recently used one, when memory is short."""
+    with residency_lock:
+        for collection_name in list(resident)[:-1]:
+            if in_use.get(collection_name):
+                continue
+            _release(collection_name)
+
+
+def get_resident():
+    with residency_lock:
+        return [
+            {
+                "collection": name,
+                "mb": round(nbytes / MB, 1),
+                "partitions": (
+                    len(loaded_partitions[name]) if name in loaded_partitions else "all"
+                ),
+                "searching": in_use.get(name, 0),
+            }
+            for name, nbytes in reversed(resident.items())
+        ]
+
+
+def get_events():
+    return list(reversed(events))
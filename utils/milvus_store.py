@@ -0,0 +1,330 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.utils import iter_batch
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+from llama_index.vector_stores.milvus import MilvusVectorStore
+from llama_index.vector_stores.milvus.base import MILVUS_ID_FIELD, _to_milvus_filter
+from pymilvus import Collection
+
+import utils.milvus_connection as milvus_connection
+import utils.milvus_residency as milvus_residency
+
+FILE_NAME_KEY = "file_name"
+DEFAULT_PARTITION = "_default"
+SIMILARITY_METRICS = {"ip": "IP", "l2": "L2", "euclidean": "L2", "cosine": "COSINE"}
+
+
+def partition_name_for_file(file_name):
+    """
+    maps a source file name to a valid milvus partition name.
+    milvus only allows letters, digits and underscores, so a short hash
+    keeps names with the same sanitized form apart.
+    """
+    base_name = os.path.basename(file_name)
+    digest = hashlib.md5(base_name.encode("utf-8")).hexdigest()[:8]
+    readable = re.sub(r"[^0-9a-zA-Z_]", "_", base_name)[:64]
+    return f"file_{readable}_{digest}"
+
+
+class PartitionedMilvusVectorStore(MilvusVectorStore):
+    """Milvus vector store that keeps the nodes of each source file in its own partition."""
+
+    def __init__(
+        self,
+        uri: str = milvus_connection.milvus_uri,
+        collection_name: str = "llamacollection",
+        dim: Optional[int] = None,
+        similarity_metric: str = "IP",
+        overwrite: bool = False,
+        **kwargs: Any,
+    ) -> None:
+        # MilvusVectorStore.__init__ would open a connection of its own, the store
+        # only talks to milvus through the client shared by the process instead,
+        # which tests can replace with milvus_connection.set_client
+        BasePydanticVectorStore.__init__(
+            self,
+            uri=uri,
+            collection_name=collection_name,
+            dim=dim,
+            similarity_metric=SIMILARITY_METRICS.get(similarity_metric.lower(), "L2"),
+            overwrite=overwrite,
+            output_fields=kwargs.pop("output_fields", None) or [],
+            index_config=kwargs.pop("index_config", None) or {},
+            search_config=kwargs.pop("search_config", None) or {},
+            **kwargs,
+        )
+        self._milvusclient = milvus_connection.get_client(uri)
+        # the orm Collection is only needed to flush and export, it is built on first use
+        self._collection = None
+
+        retry = milvus_connection.call_with_retry
+        collection_names = retry(self._milvusclient.list_collections)
+        if overwrite and collection_name in collection_names:
+            retry(self._milvusclient.drop_collection, collection_name)
+            collection_names.remove(collection_name)
+        if collection_name not in collection_names:
+            if dim is None:
+                raise ValueError("Dim argument required for collection creation.")
+            retry(
+                self._milvusclient.create_collection,
+                collection_name=collection_name,
+                dimension=dim,
+                primary_field_name=MILVUS_ID_FIELD,
+                vector_field_name=self.embedding_field,
+                id_type="string",
+                metric_type=self.similarity_metric,
+                max_length=65_535,
+                consistency_level=self.consistency_level,
+            )
+
+    def _orm_collection(self):
+        if self._collection is None:
+            milvus_connection.connect_default(self.uri)
+            self._collection = Collection(
+                self.collection_name, using=milvus_connection.DEFAULT_ALIAS
+            )
+        return self._collection
+
+    def _create_index_if_required(self, force: bool = False) -> None:
+        # the collection is created with its index, it is only rebuilt on request
+        if force:
+            self._orm_collection()
+            super()._create_index_if_required(force=True)
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """Insert the nodes, grouped by source file, into per file partitions."""
+        self.add_entries(
+            self._node_entries(nodes), force_flush=add_kwargs.get("force_flush", False)
+        )
+        return [node.node_id for node in nodes]
+
+    def _node_entries(self, nodes):
+        entries = []
+        for node in nodes:
+            entry = node_to_metadata_dict(node)
+            entry[MILVUS_ID_FIELD] = node.node_id
+            entry[self.embedding_field] = node.embedding
+            entries.append(entry)
+        return entries
+
+    def add_entries(self, entries, vectors=None, force_flush=False):
+        """
+        bulk inserts already serialized node entries.
+        when `vectors` is given the embeddings are taken from it row by row.
+        """
+        self._write_entries(self._insert, entries, vectors, force_flush)
+
+    def upsert_nodes(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """inserts the nodes, replacing the stored ones with the same node ids."""
+        self.upsert_entries(
+            self._node_entries(nodes), force_flush=add_kwargs.get("force_flush", False)
+        )
+        return [node.node_id for node in nodes]
+
+    def upsert_entries(self, entries, vectors=None, force_flush=False):
+        self._write_entries(self._upsert, entries, vectors, force_flush)
+
+    def _insert(self, batch, partition_name):
+        # an insert that failed on the way back may have been applied, so it is
+        # retried as an upsert of the same node ids, which can't duplicate them
+        attempted = []
+
+        def write():
+            write_batch = self._milvusclient.upsert if attempted else self._milvusclient.insert
+            attempted.append(True)
+            return write_batch(self.collection_name, batch, partition_name=partition_name)
+
+        return milvus_connection.call_with_retry(write)
+
+    def _upsert(self, batch, partition_name):
+        return milvus_connection.call_with_retry(
+            self._milvusclient.upsert, self.collection_name, batch, partition_name=partition_name
+        )
+
+    def _write_entries(self, write, entries, vectors, force_flush):
+        batches: Dict[str, List[dict]] = {}
+        for i, entry in enumerate(entries):
+            if vectors is not None:
+                entry[self.embedding_field] = vectors[i].tolist()
+            file_name = entry.get(FILE_NAME_KEY)
+            partition_name = (
+                partition_name_for_file(file_name) if file_name else DEFAULT_PARTITION
+            )
+            batches.setdefault(partition_name, []).append(entry)
+
+        retry = milvus_connection.call_with_retry
+        for partition_name, partition_entries in batches.items():
+            if not retry(self._milvusclient.has_partition, self.collection_name, partition_name):
+                print(f"creating partition {partition_name} in {self.collection_name}")
+                retry(self._milvusclient.create_partition, self.collection_name, partition_name)
+            for write_batch in iter_batch(partition_entries, self.batch_size):
+                write(write_batch, partition_name)
+
+        if force_flush:
+            retry(self._orm_collection().flush)
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """deletes the nodes of the document with this ref doc id."""
+        milvus_connection.call_with_retry(
+            self._milvusclient.delete,
+            self.collection_name,
+            filter=f"{self.doc_id_field} in [{json.dumps(ref_doc_id)}]",
+        )
+
+    def delete_nodes(self, node_ids: List[str] = None, filters=None, **delete_kwargs: Any) -> None:
+        """deletes the nodes with these node ids from every partition."""
+        if filters is not None:
+            raise ValueError("deleting by metadata filters is not supported")
+        for id_batch in iter_batch(list(node_ids or []), self.batch_size):
+            milvus_connection.call_with_retry(
+                self._milvusclient.delete, self.collection_name, ids=id_batch
+            )
+
+    def iter_entries(self, batch_size=1000):
+        """yields (entries, vectors) batches of everything stored in the collection."""
+        iterator = self._orm_collection().query_iterator(
+            batch_size=batch_size,
+            expr=f'{MILVUS_ID_FIELD} != ""',
+            output_fields=["*", self.embedding_field],
+        )
+        while True:
+            rows = iterator.next()
+            if not rows:
+                iterator.close()
+                return
+            vectors = [row.pop(self.embedding_field) for row in rows]
+            yield rows, vectors
+
+    def list_file_partitions(self):
+        return [
+            name
+            for name in self._milvusclient.list_partitions(self.collection_name)
+            if name != DEFAULT_PARTITION
+        ]
+
+    def delete_file(self, file_name):
+        """
+        drops the partition that holds every node of the given file.
+        this is a metadata operation in milvus, no per entity delete is needed.
+        """
+        partition_name = partition_name_for_file(file_name)
+        if not self._milvusclient.has_partition(self.collection_name, partition_name):
+            return False
+        print(f"dropping partition {partition_name} from {self.collection_name}")
+        self._milvusclient.release_partitions(self.collection_name, [partition_name])
+        milvus_residency.forget_partition(self.collection_name, partition_name)
+        self._milvusclient.drop_partition(self.collection_name, partition_name)
+        return True
+
+    def memory_bytes(self):
+        # entities live in the milvus server process, this store only holds a client
+        return 0
+
+    def release_ann(self):
+        pass
+
+    def _search_partitions(self, file_names):
+        return [
+            partition_name_for_file(os.path.basename(f))
+            for f in file_names
+            if self._milvusclient.has_partition(self.collection_name, partition_name_for_file(f))
+        ]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """Query the collection, or with `file_names` only the partitions of these files."""
+        file_names = kwargs.pop("file_names", None)
+        if not file_names:
+            with milvus_residency.searching(self.collection_name):
+                return milvus_connection.call_with_retry(super().query, query, **kwargs)
+
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Milvus does not support {query.mode} yet.")
+
+        partition_names = self._search_partitions(file_names)
+        if not partition_names:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        # only the selected partitions have to be resident to be searched
+        with milvus_residency.searching(self.collection_name, partition_names):
+            return self._query_partitions(query, partition_names)
+
+    def _query_partitions(self, query, partition_names):
+        expr = []
+        if query.filters is not None:
+            expr.extend(_to_milvus_filter(query.filters))
+        if query.doc_ids:
+            expr_list = ['"' + entry + '"' for entry in query.doc_ids]
+            expr.append(f"{self.doc_id_field} in [{','.join(expr_list)}]")
+        if query.node_ids:
+            expr_list = ['"' + entry + '"' for entry in query.node_ids]
+            expr.append(f"{MILVUS_ID_FIELD} in [{','.join(expr_list)}]")
+
+        output_fields = query.output_fields or self.output_fields or ["*"]
+        condition = query.filters.condition.value if query.filters else "and"
+        string_expr = f" {condition} ".join(expr)
+
+        res = milvus_connection.call_with_retry(
+            self._milvusclient.search,
+            collection_name=self.collection_name,
+            data=[query.query_embedding],
+            filter=string_expr,
+            limit=query.similarity_top_k,
+            output_fields=output_fields,
+            search_params=self.search_config,
+            partition_names=partition_names,
+        )
+        return self._hits_to_result(res[0])
+
+    def _hits_to_result(self, hits):
+        nodes = []
+        similarities = []
+        ids = []
+        for hit in hits:
+            if not self.text_key:
+                node = metadata_dict_to_node(
+                    {
+                        "_node_content": hit["entity"].get("_node_content", None),
+                        "_node_type": hit["entity"].get("_node_type", None),
+                    }
+                )
+            else:
+                metadata = {key: hit["entity"].get(key) for key in self.output_fields}
+                node = TextNode(text=hit["entity"].get(self.text_key), metadata=metadata)
+            nodes.append(node)
+            similarities.append(hit["distance"])
+            ids.append(hit["id"])
+
+        return VectorStoreQueryResult(nodes=nodes, similarities=similarities, ids=ids)
+
+    def query_batch(self, query_embeddings, similarity_top_k, file_names=None):
+        """searches many query embeddings in a single milvus request."""
+        partition_names = self._search_partitions(file_names) if file_names else None
+        if file_names and not partition_names:
+            return [
+                VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+                for _ in query_embeddings
+            ]
+        with milvus_residency.searching(self.collection_name, partition_names):
+            res = milvus_connection.call_with_retry(
+                self._milvusclient.search,
+                collection_name=self.collection_name,
+                data=[list(q) for q in query_embeddings],
+                limit=similarity_top_k,
+                output_fields=self.output_fields or ["*"],
+                search_params=self.search_config,
+                partition_names=partition_names,
+            )
+        return [self._hits_to_result(hits) for hits in res]
@@ -0,0 +1,443 @@
+"""
+Out of process model worker: one process holds the llms and the embedder, and any
+number of app processes on the pod use them over a Unix socket.
+
+    python -m utils.model_worker --socket /tmp/cml-model-worker.sock
+
+and start the app processes with MODEL_WORKER_SOCKET set to the same path. CMLLLM
+then puts `WorkerLLM` and `WorkerEmbedding` clients in `Settings.llm` and
+`Settings.embed_model` instead of loading the weights itself.
+
+Every request is its own connection and newline delimited JSON messages:
+{"op": ...} in, then {"delta": ...} messages while streaming and a last message
+with "done", or one with "error". Embedding requests that arrive within
+`embed_wait_ms` of each other are encoded in one batch. llama.cpp has a single
+context per model, so generations for a model run one at a time in arrival order.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Sequence
+
+import torch
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+import utils.llm_router as llm_router
+from utils.common import (
+    model_worker_connect_timeout_s,
+    model_worker_embed_max_batch,
+    model_worker_embed_wait_ms,
+)
+
+DEFAULT_SOCKET_PATH = "/tmp/cml-model-worker.sock"
+
+
+def write_message(f, message):
+    f.write((json.dumps(message) + "\n").encode("utf-8"))
+    f.flush()
+
+
+def request(socket_path, message):
+    """sends one request and yields the reply messages, the last one has "done"."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rwb") as f:
+            write_message(f, message)
+            for line in f:
+                reply = json.loads(line)
+                if "error" in reply:
+                    raise RuntimeError(f"model worker: {reply['error']}")
+                yield reply
+                if reply.get("done"):
+                    return
+    raise RuntimeError("model worker closed the connection before answering")
+
+
+def call(socket_path, message):
+    reply = None
+    for reply in request(socket_path, message):
+        pass
+    return reply
+
+
+def wait_for_worker(socket_path, timeout=model_worker_connect_timeout_s):
+    """the worker takes a while to load the weights, so the app waits for it."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return call(socket_path, {"op": "info"})
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.time() > deadline:
+                raise RuntimeError(f"no model worker is listening on {socket_path}")
+            print(f"waiting for the model worker on {socket_path}")
+            time.sleep(2)
+
+
+def serialize_messages(messages):
+    return [{"role": m.role.value, "content": m.content or ""} for m in messages]
+
+
+class WorkerLLM(CustomLLM):
+    """an llm served by the model worker."""
+
+    socket_path: str = Field(description="unix socket of the model worker")
+    model_name: str = Field(description="model the worker serves")
+    context_window: int = Field(default=3900)
+    num_output: int = Field(default=256)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "WorkerLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.num_output,
+            model_name=self.model_name,
+        )
+
+    def _stream(self, message):
+        message = dict(message, model=self.model_name, stream=True)
+        for reply in request(self.socket_path, message):
+            if reply.get("done"):
+                return
+            yield reply["delta"]
+
+    def _generate(self, message):
+        message = dict(message, model=self.model_name, stream=False)
+        return call(self.socket_path, message)["text"]
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self._generate({"op": "complete", "prompt": prompt, "formatted": formatted})
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for delta in self._stream({"op": "complete", "prompt": prompt, "formatted": formatted}):
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        text = self._generate({"op": "chat", "messages": serialize_messages(messages)})
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        def gen() -> ChatResponseGen:
+            text = ""
+            for delta in self._stream({"op": "chat", "messages": serialize_messages(messages)}):
+                text += delta
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=text),
+                    delta=delta,
+                )
+
+        return gen()
+
+
+class WorkerEmbedding(BaseEmbedding):
+    """the embedder of the model worker."""
+
+    socket_path: str = Field(description="unix socket of the model worker")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "WorkerEmbedding"
+
+    def _request_embeddings(self, texts, kind):
+        return call(self.socket_path, {"op": "embed", "texts": list(texts), "kind": kind})[
+            "embeddings"
+        ]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._request_embeddings([query], "query")[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._request_embeddings([text], "text")[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._request_embeddings(texts, "text")
+
+    def get_query_embedding_batch(self, queries):
+        return self._request_embeddings(queries, "query")
+
+
+def connect(socket_path, model_name):
+    """
+    registers a WorkerLLM for every model the worker serves with utils.llm_router.
+    Returns (llm for model_name, embed model, embed model name).
+    """
+    info = wait_for_worker(socket_path)
+    if model_name not in info["models"]:
+        print(f"the model worker doesn't serve {model_name}, using {info['default_model']}")
+        model_name = info["default_model"]
+    for name, metadata in info["models"].items():
+        llm_router.register_llm(
+            name,
+            WorkerLLM(socket_path=socket_path, model_name=name, **metadata),
+            default=name == model_name,
+        )
+    embed_model = WorkerEmbedding(
+        socket_path=socket_path,
+        model_name=info["embed_model"],
+        embed_batch_size=info["embed_max_batch"],
+    )
+    return llm_router.llm_map[model_name], embed_model, info["embed_model"]
+
+
+def get_worker_stats(socket_path):
+    try:
+        return call(socket_path, {"op": "stats"})["stats"]
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# worker process state
+worker_stats = {
+    "requests": 0,
+    "active": 0,
+    "generations": 0,
+    "embed_requests": 0,
+    "embed_batches": 0,
+    "embed_texts": 0,
+}
+stats_lock = threading.Lock()
+# model name -> lock held while that model generates
+generate_locks = {}
+batcher = None
+
+
+def count(key, n=1):
+    with stats_lock:
+        worker_stats[key] += n
+
+
+def embed_texts(embed_model, texts, kind):
+    from utils.batch_qa import embed_queries
+
+    if kind == "query":
+        return [list(e) for e in embed_queries(embed_model, texts)]
+    return embed_model.get_text_embedding_batch(texts)
+
+
+class EmbedBatcher:
+    """encodes the embedding requests that arrive close together in one batch."""
+
+    def __init__(self, embed_model, max_batch, wait_ms):
+        self.embed_model = embed_model
+        self.max_batch = max_batch
+        self.wait_s = wait_ms / 1000
+        self.pending = queue.Queue()
+        threading.Thread(target=self.run, name="embed-batcher", daemon=True).start()
+
+    def submit(self, texts, kind):
+        future = Future()
+        self.pending.put((texts, kind, future))
+        return future
+
+    def collect(self):
+        batch = [self.pending.get()]
+        texts = len(batch[0][0])
+        deadline = time.time() + self.wait_s
+        while texts < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            texts += len(item[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            for kind in ("query", "text"):
+                group = [item for item in batch if item[1] == kind]
+                if not group:
+                    continue
+                texts = [text for item in group for text in item[0]]
+                try:
+                    embeddings = embed_texts(self.embed_model, texts, kind)
+                except Exception as e:
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                count("embed_batches")
+                count("embed_texts", len(texts))
+                offset = 0
+                for item_texts, _, future in group:
+                    future.set_result(embeddings[offset:offset + len(item_texts)])
+                    offset += len(item_texts)
+
+
+def generate(message, send):
+    model_name = message.get("model") or llm_router.default_model_name
+    llm = llm_router.llm_map[model_name]
+    with generate_locks[model_name]:
+        count("generations")
+        if message["op"] == "chat":
+            messages = [
+                ChatMessage(role=MessageRole(m["role"]), content=m["content"])
+                for m in message["messages"]
+            ]
+            if not message.get("stream"):
+                send({"done": True, "text": llm.chat(messages).message.content})
+                return
+            text = ""
+            for response in llm.stream_chat(messages):
+                text += response.delta or ""
+                send({"delta": response.delta or ""})
+        else:
+            formatted = message.get("formatted", False)
+            if not message.get("stream"):
+                send({"done": True, "text": llm.complete(message["prompt"], formatted=formatted).text})
+                return
+            text = ""
+            for response in llm.stream_complete(message["prompt"], formatted=formatted):
+                text += response.delta or ""
+                send({"delta": response.delta or ""})
+        send({"done": True, "text": text})
+
+
+def handle(message, send):
+    op = message.get("op")
+    if op == "info":
+        send(
+            {
+                "done": True,
+                "default_model": llm_router.default_model_name,
+                "models": {
+                    name: {
+                        "context_window": llm.metadata.context_window,
+                        "num_output": llm.metadata.num_output,
+                    }
+                    for name, llm in llm_router.llm_map.items()
+                },
+                "embed_model": batcher.embed_model.model_name,
+                "embed_max_batch": batcher.max_batch,
+            }
+        )
+    elif op == "embed":
+        count("embed_requests")
+        send({"done": True, "embeddings": batcher.submit(message["texts"], message["kind"]).result()})
+    elif op in ("chat", "complete"):
+        generate(message, send)
+    elif op == "stats":
+        with stats_lock:
+            send({"done": True, "stats": dict(worker_stats)})
+    else:
+        send({"error": f"unknown op {op}"})
+
+
+class WorkerRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        count("requests")
+        count("active")
+        try:
+            line = self.rfile.readline()
+            if not line:
+                return
+            handle(json.loads(line), lambda reply: write_message(self.wfile, reply))
+        except (BrokenPipeError, ConnectionResetError):
+            # the app process went away, a streaming generation stops here
+            print("model worker: client disconnected")
+        except Exception as e:
+            print(f"model worker request failed: {e}")
+            try:
+                write_message(self.wfile, {"error": str(e)})
+            except OSError:
+                pass
+        finally:
+            count("active", -1)
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, embed_model, embed_max_batch, embed_wait_ms):
+    global batcher
+    if os.path.exists(socket_path):
+        try:
+            call(socket_path, {"op": "stats"})
+            raise SystemExit(f"a model worker is already listening on {socket_path}")
+        except (ConnectionRefusedError, RuntimeError):
+            # left behind by a worker that didn't exit cleanly
+            os.unlink(socket_path)
+
+    for name in llm_router.llm_map:
+        generate_locks[name] = threading.Lock()
+    embed_model.embed_batch_size = max(embed_model.embed_batch_size, embed_max_batch)
+    batcher = EmbedBatcher(embed_model, embed_max_batch, embed_wait_ms)
+
+    server = WorkerServer(socket_path, WorkerRequestHandler)
+    os.chmod(socket_path, 0o600)
+    print(f"model worker serving {list(llm_router.llm_map)} on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def main():
+    import utils.models as models
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=os.getenv("MODEL_WORKER_SOCKET") or DEFAULT_SOCKET_PATH)
+    parser.add_argument("--model", default="TheBloke/Mistral-7B-Instruct-v0.2-GGUF")
+    parser.add_argument("--embed-model", default="thenlper/gte-large")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--max-new-tokens", type=int, default=1024)
+    parser.add_argument("--context-window", type=int, default=3900)
+    parser.add_argument("--gpu-layers", type=int, default=20)
+    parser.add_argument("--embed-max-batch", type=int, default=model_worker_embed_max_batch)
+    parser.add_argument("--embed-wait-ms", type=float, default=model_worker_embed_wait_ms)
+    args = parser.parse_args()
+
+    _, embed_model = models.load_models(
+        args.model,
+        args.embed_model,
+        temperature=args.temperature,
+        max_new_tokens=args.max_new_tokens,
+        context_window=args.context_window,
+        n_gpu_layers=args.gpu_layers if torch.cuda.is_available() else 0,
+    )
+    serve(args.socket, embed_model, args.embed_max_batch, args.embed_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Loads the llama.cpp llms and the embedder, in the app process or in the model
+worker (see utils.model_worker).
+"""
+import os
+
+from dotenv import load_dotenv
+from huggingface_hub import hf_hub_download, snapshot_download
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.llms.llama_cpp import LlamaCPP
+from llama_index.llms.llama_cpp.llama_utils import (
+    messages_to_prompt,
+    completion_to_prompt,
+)
+
+import utils.llama_cpp_tuning as llama_cpp_tuning
+import utils.llm_router as llm_router
+from utils.common import supported_llm_models
+from utils.speculative import build_draft_model
+
+load_dotenv()
+
+hf_token = os.getenv("HF_TOKEN")
+
+MODELS_PATH = "./models"
+EMBED_PATH = "./embed_models"
+
+
+def get_model_path(model_name):
+    filename = supported_llm_models[model_name]
+    model_path = hf_hub_download(
+        repo_id=model_name,
+        filename=filename,
+        resume_download=True,
+        cache_dir=MODELS_PATH,
+        local_files_only=True,
+        token=hf_token,
+    )
+    return model_path
+
+
+def get_embed_model_path(embed_model):
+    embed_model_path = snapshot_download(
+        repo_id=embed_model,
+        resume_download=True,
+        cache_dir=EMBED_PATH,
+        local_files_only=True,
+        token=hf_token,
+    )
+    return embed_model_path
+
+
+def load_llm(
+    model_name,
+    temperature,
+    max_new_tokens,
+    context_window,
+    n_gpu_layers,
+    speculative=False,
+):
+    model_path = get_model_path(model_name)
+    print(f"model_path = {model_path}")
+
+    model_kwargs = llama_cpp_tuning.get_model_kwargs(
+        model_path, n_gpu_layers, context_window
+    )
+    if speculative:
+        # opt-in through SPECULATIVE_DECODING, see utils.common
+        draft_model = build_draft_model(
+            n_ctx=context_window,
+            n_gpu_layers=n_gpu_layers,
+            n_threads=model_kwargs["n_threads"],
+        )
+        if draft_model is not None:
+            print(f"speculative decoding with {type(draft_model).__name__}")
+            model_kwargs["draft_model"] = draft_model
+
+    model_messages_to_prompt, model_completion_to_prompt = (
+        llm_router.get_prompt_format(
+            model_name, (messages_to_prompt, completion_to_prompt)
+        )
+    )
+    return LlamaCPP(
+        model_path=model_path,
+        temperature=temperature,
+        max_new_tokens=max_new_tokens,
+        context_window=context_window,
+        generate_kwargs={"temperature": temperature},
+        model_kwargs=model_kwargs,
+        messages_to_prompt=model_messages_to_prompt,
+        completion_to_prompt=model_completion_to_prompt,
+        verbose=True,
+    )
+
+
+def load_embed_model(embed_model_name):
+    return HuggingFaceEmbedding(model_name=embed_model_name, cache_folder=EMBED_PATH)
+
+
+def load_models(model_name, embed_model_name, **llm_kwargs):
+    """
+    loads the answer llm, the llms routed to auxiliary tasks and the embedder,
+    and registers the llms with utils.llm_router. Returns (llm, embed_model).
+    """
+    llm = load_llm(model_name, speculative=True, **llm_kwargs)
+    llm_router.register_llm(model_name, llm, default=True)
+
+    # smaller models take the auxiliary tasks, see utils.common.llm_task_routing
+    for routed_model in llm_router.routed_models():
+        if routed_model in llm_router.llm_map:
+            continue
+        try:
+            llm_router.register_llm(routed_model, load_llm(routed_model, **llm_kwargs))
+        except Exception as e:
+            print(f"failed to load {routed_model}, its tasks use {model_name}: {e}")
+
+    return llm, load_embed_model(embed_model_name)
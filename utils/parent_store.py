@@ -0,0 +1,112 @@
+"""
+Text of the parent chunks of small-to-big retrieval, in SQLite.
+
+Only the children are embedded and stored in the vector store; each child keeps
+the id of its parent and its span in it. The parent texts are stored here once
+per collection and parent id, and fetched by id when hits are widened to their
+parent windows.
+"""
+import sqlite3
+import threading
+
+PARENT_STORE_PATH = "parent-chunks.sqlite"
+# ids per SELECT, under SQLite's limit on query parameters
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parents (
+    collection TEXT NOT NULL,
+    parent_id TEXT NOT NULL,
+    file_name TEXT,
+    text TEXT NOT NULL,
+    PRIMARY KEY (collection, parent_id)
+);
+CREATE INDEX IF NOT EXISTS parents_by_id ON parents (parent_id);
+"""
+
+connection = None
+store_lock = threading.RLock()
+
+
+def _connect():
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(PARENT_STORE_PATH, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+    return connection
+
+
+def _execute(sql, params=()):
+    with store_lock:
+        db = _connect()
+        with db:
+            return db.execute(sql, params).fetchall()
+
+
+def add_parents(collection, parents):
+    """stores the text of these parent nodes, replacing parents with the same ids."""
+    load_parents(
+        collection,
+        [p.node_id for p in parents],
+        [p.metadata.get("file_name") for p in parents],
+        [p.text for p in parents],
+    )
+
+
+def get_texts(parent_ids):
+    """parent id -> text for the stored ones of these ids."""
+    parent_ids = list(dict.fromkeys(parent_ids))
+    texts = {}
+    for start in range(0, len(parent_ids), LOOKUP_BATCH_SIZE):
+        batch = parent_ids[start:start + LOOKUP_BATCH_SIZE]
+        rows = _execute(
+            f"SELECT parent_id, text FROM parents WHERE parent_id IN ({','.join('?' * len(batch))})",
+            batch,
+        )
+        texts.update(rows)
+    return texts
+
+
+def read_parents(collection):
+    """(parent ids, file names, texts) columns of the collection's parents."""
+    rows = _execute(
+        "SELECT parent_id, file_name, text FROM parents WHERE collection = ?", (collection,)
+    )
+    return [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]
+
+
+def load_parents(collection, parent_ids, file_names, texts):
+    """bulk stores parents from columns, e.g. of an exported snapshot."""
+    with store_lock:
+        db = _connect()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO parents (collection, parent_id, file_name, text) "
+                "VALUES (?, ?, ?, ?)",
+                [(collection, *row) for row in zip(parent_ids, file_names, texts)],
+            )
+
+
+def delete_file(collection, file_name):
+    _execute(
+        "DELETE FROM parents WHERE collection = ? AND file_name = ?", (collection, file_name)
+    )
+
+
+def drop_collection(collection):
+    _execute("DELETE FROM parents WHERE collection = ?", (collection,))
+
+
+def rename_collection(old_name, new_name):
+    with store_lock:
+        db = _connect()
+        with db:
+            db.execute("DELETE FROM parents WHERE collection = ?", (new_name,))
+            db.execute(
+                "UPDATE parents SET collection = ? WHERE collection = ?", (new_name, old_name)
+            )
+
+
+def reset():
+    _execute("DELETE FROM parents")
@@ -0,0 +1,144 @@
+"""
+Page streaming PDF reader with OCR for the pages that need it.
+
+Pages are read a batch at a time, so a large PDF never has to be held in memory
+whole. A page whose text layer is missing or unreadable (a scan, or text drawn
+with fonts that have no unicode mapping) is rendered and sent on its own to a pool
+of nougat OCR worker processes; every other page keeps its extracted text and
+costs no OCR at all.
+"""
+import importlib.util
+import multiprocessing
+import os
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+from llama_index.core.schema import Document
+from pypdf import PdfReader
+
+from utils.common import pdf_ocr_workers, pdf_page_batch_size
+
+# fewer characters than this means the page has no usable text layer
+MIN_PAGE_TEXT_CHARS = 40
+# share of unmapped glyphs (replacement, private use and control characters) above
+# which the extracted text is garbage from fonts without a unicode mapping
+MAX_UNMAPPED_RATIO = 0.1
+# nougat is trained on pages rasterized at 96 dpi
+OCR_DPI = 96
+
+ocr_pool = None
+ocr_model = None
+
+
+def ocr_available():
+    return pdf_ocr_workers > 0 and importlib.util.find_spec("nougat") is not None
+
+
+def page_has_images(page):
+    try:
+        return len(page.images) > 0
+    except Exception:
+        # images pypdf can't decode still need OCR
+        return True
+
+
+def page_needs_ocr(page, text):
+    stripped = text.strip()
+    if len(stripped) >= MIN_PAGE_TEXT_CHARS:
+        unmapped = sum(
+            1
+            for c in stripped
+            if c == "\ufffd" or (not c.isspace() and unicodedata.category(c) in ("Co", "Cn", "Cc"))
+        )
+        if unmapped / len(stripped) <= MAX_UNMAPPED_RATIO and "(cid:" not in stripped:
+            return False
+    # a blank or near blank page with nothing drawn on it has nothing to recognize
+    return page_has_images(page)
+
+
+def _init_ocr_worker():
+    global ocr_model
+    import torch
+    from nougat import NougatModel
+    from nougat.utils.checkpoint import get_checkpoint
+
+    model = NougatModel.from_pretrained(get_checkpoint())
+    if torch.cuda.is_available():
+        model = model.to(torch.bfloat16).to("cuda")
+    ocr_model = model.eval()
+
+
+def _ocr_page(file, page_index):
+    import pypdfium2
+    from nougat.postprocessing import markdown_compatible
+
+    pdf = pypdfium2.PdfDocument(file)
+    try:
+        image = pdf[page_index].render(scale=OCR_DPI / 72).to_pil()
+    finally:
+        pdf.close()
+    sample = ocr_model.encoder.prepare_input(image, random_padding=False)
+    output = ocr_model.inference(image_tensors=sample.unsqueeze(0))
+    return markdown_compatible(output["predictions"][0])
+
+
+def get_ocr_pool():
+    global ocr_pool
+    if ocr_pool is None:
+        # spawned, so the workers can use cuda whatever the parent did with it
+        ocr_pool = ProcessPoolExecutor(
+            max_workers=pdf_ocr_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_ocr_worker,
+        )
+    return ocr_pool
+
+
+def shutdown_ocr_pool():
+    global ocr_pool
+    if ocr_pool is not None:
+        ocr_pool.shutdown(wait=False, cancel_futures=True)
+        ocr_pool = None
+
+
+def iter_page_batches(file, extra_info=None, batch_size=None):
+    """
+    yields lists of one Document per page, with the same metadata as PDFReader,
+    `batch_size` pages at a time.
+    """
+    batch_size = batch_size or pdf_page_batch_size
+    use_ocr = ocr_available()
+    if not use_ocr:
+        print("nougat is not installed or PDF_OCR_WORKERS is 0, scanned pages are not OCRed")
+
+    num_pages = len(PdfReader(file).pages)
+    ocr_pages = 0
+    for batch_start in range(0, num_pages, batch_size):
+        # a fresh reader per batch keeps pypdf's object cache from growing with the file
+        reader = PdfReader(file)
+        labels = reader.page_labels
+        texts = {}
+        ocr_futures = {}
+        for i in range(batch_start, min(batch_start + batch_size, num_pages)):
+            page = reader.pages[i]
+            text = page.extract_text() or ""
+            if use_ocr and page_needs_ocr(page, text):
+                ocr_futures[i] = get_ocr_pool().submit(_ocr_page, str(file), i)
+            texts[i] = text
+
+        for i, future in ocr_futures.items():
+            try:
+                texts[i] = future.result()
+                ocr_pages += 1
+            except Exception as e:
+                print(f"OCR of page {i + 1} of {file} failed: {e}")
+
+        documents = []
+        for i, text in texts.items():
+            metadata = {"page_label": labels[i], "file_name": os.path.basename(file)}
+            metadata.update(extra_info or {})
+            documents.append(Document(text=text, metadata=metadata))
+        del reader
+        yield documents
+
+    print(f"read {num_pages} pages of {file}, {ocr_pages} of them with OCR")
@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SNAPSHOTS_DIR = "snapshots"
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+VECTORS_RAW_FILE = "vectors.f32.tmp"
+NODES_FILE = "nodes.parquet"
+PARENTS_FILE = "parents.parquet"
+IMPORT_BATCH_SIZE = 1000
+
+
+def list_snapshots(directory=SNAPSHOTS_DIR):
+    if not os.path.exists(directory):
+        return []
+    return sorted(
+        d
+        for d in os.listdir(directory)
+        if os.path.exists(os.path.join(directory, d, MANIFEST_FILE))
+    )
+
+
+def read_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export_collection(vector_store, snapshot_dir, manifest, parents=None):
+    """
+    writes every node of the vector store into `snapshot_dir`:
+    - vectors.npy: float32 (num_nodes, dim) array, loadable with mmap_mode="r"
+    - nodes.parquet: id, file_name, text and the serialized node entry per row
+    - parents.parquet: parent_id, file_name and text of the parent chunks, from the
+      (parent ids, file names, texts) columns in `parents`
+    - manifest.json: embed model, chunking parameters and counts from `manifest`
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    raw_path = os.path.join(snapshot_dir, VECTORS_RAW_FILE)
+
+    ids, file_names, texts, entry_jsons = [], [], [], []
+    with open(raw_path, "wb") as raw:
+        for entries, vectors in vector_store.iter_entries():
+            raw.write(np.asarray(vectors, dtype=np.float32).tobytes())
+            for entry in entries:
+                node_content = json.loads(entry.get("_node_content") or "{}")
+                ids.append(entry["id"])
+                file_names.append(entry.get("file_name"))
+                texts.append(node_content.get("text", ""))
+                entry_jsons.append(json.dumps(entry))
+
+    num_nodes = len(ids)
+    dim = manifest["dim"]
+    # prepend a .npy header to the raw rows so readers can memory map the file
+    with open(os.path.join(snapshot_dir, VECTORS_FILE), "wb") as f:
+        np.lib.format.write_array_header_1_0(
+            f, {"descr": "<f4", "fortran_order": False, "shape": (num_nodes, dim)}
+        )
+        with open(raw_path, "rb") as raw:
+            shutil.copyfileobj(raw, f)
+    os.remove(raw_path)
+
+    table = pa.table(
+        {
+            "id": ids,
+            "file_name": file_names,
+            "text": texts,
+            "entry": entry_jsons,
+        }
+    )
+    pq.write_table(table, os.path.join(snapshot_dir, NODES_FILE), compression="zstd")
+
+    parent_ids, parent_file_names, parent_texts = parents or ([], [], [])
+    parents_table = pa.table(
+        {
+            "parent_id": pa.array(parent_ids, pa.string()),
+            "file_name": pa.array(parent_file_names, pa.string()),
+            "text": pa.array(parent_texts, pa.string()),
+        }
+    )
+    pq.write_table(parents_table, os.path.join(snapshot_dir, PARENTS_FILE), compression="zstd")
+
+    manifest = dict(manifest)
+    manifest.update(
+        {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "num_nodes": num_nodes,
+            "num_parents": len(parent_ids),
+            "files": sorted({f for f in file_names if f}),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    )
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"exported {num_nodes} nodes to {snapshot_dir}")
+    return manifest
+
+
+def open_snapshot(snapshot_dir):
+    """
+    reads and checks a snapshot without touching any collection.
+    Returns (manifest, serialized entries, memory mapped vectors).
+    """
+    manifest = read_manifest(snapshot_dir)
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(
+            f"unsupported snapshot format {manifest.get('format_version')} in {snapshot_dir}"
+        )
+
+    vectors = np.load(os.path.join(snapshot_dir, VECTORS_FILE), mmap_mode="r")
+    entries = pq.read_table(
+        os.path.join(snapshot_dir, NODES_FILE), columns=["entry"]
+    ).column("entry").to_pylist()
+    if len(entries) != vectors.shape[0]:
+        raise ValueError(
+            f"snapshot {snapshot_dir} is corrupt: {len(entries)} nodes, {vectors.shape[0]} vectors"
+        )
+    return manifest, entries, vectors
+
+
+def load_entries(vector_store, entries, vectors):
+    """bulk loads checked snapshot rows into the vector store, embeddings as stored."""
+    for start in range(0, len(entries), IMPORT_BATCH_SIZE):
+        end = start + IMPORT_BATCH_SIZE
+        batch = [json.loads(e) for e in entries[start:end]]
+        vector_store.add_entries(batch, np.asarray(vectors[start:end]))
+
+
+def read_parents(snapshot_dir):
+    """(parent ids, file names, texts) columns, empty for snapshots without parents."""
+    path = os.path.join(snapshot_dir, PARENTS_FILE)
+    if not os.path.exists(path):
+        return [], [], []
+    table = pq.read_table(path)
+    return tuple(table.column(c).to_pylist() for c in ("parent_id", "file_name", "text"))
+
+
+def import_collection(snapshot_dir, vector_store):
+    """bulk loads a snapshot into the vector store, the embeddings are used as stored."""
+    manifest, entries, vectors = open_snapshot(snapshot_dir)
+    load_entries(vector_store, entries, vectors)
+    print(f"imported {len(entries)} nodes from {snapshot_dir}")
+    return manifest
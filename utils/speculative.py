@@ -0,0 +1,53 @@
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+from utils.common import speculative_decoding, speculative_draft_model_path
+
+# RAG answers copy long spans of the retrieved context, so a 3 token n-gram
+# finds the right continuation more often than the library default of 2
+PROMPT_LOOKUP_NGRAM_SIZE = 3
+NUM_PRED_TOKENS = 10
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Drafts tokens greedily with a small gguf that shares the main model's vocabulary."""
+
+    def __init__(self, model_path, num_pred_tokens=NUM_PRED_TOKENS, **model_kwargs):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, verbose=False, **model_kwargs)
+
+    def __call__(
+        self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any
+    ) -> npt.NDArray[np.intc]:
+        draft = []
+        # generate() reuses the evaluated prefix, so only new tokens are evaluated
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0):
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+def build_draft_model(
+    mode=speculative_decoding,
+    draft_model_path=speculative_draft_model_path,
+    **model_kwargs,
+):
+    """returns the llama.cpp draft model for the speculative decoding mode, or None."""
+    if mode == "off":
+        return None
+    if mode == "prompt_lookup":
+        return LlamaPromptLookupDecoding(
+            max_ngram_size=PROMPT_LOOKUP_NGRAM_SIZE, num_pred_tokens=NUM_PRED_TOKENS
+        )
+    if mode == "draft_model":
+        if not draft_model_path:
+            raise ValueError("SPECULATIVE_DRAFT_MODEL_PATH is required for draft_model")
+        return GGUFDraftModel(draft_model_path, **model_kwargs)
+    raise ValueError(f"unknown speculative decoding mode {mode}")
@@ -0,0 +1,370 @@
+"""
+Token exact chunking for ingest.
+
+Each document is tokenized once, in a batch, with the fast tokenizer of the embed
+model, and chunks are cut at token offsets: at the last sentence end that fits,
+else a line break, else a word start. With small-to-big retrieval the children
+are cut from the token range of their parent, so nothing is tokenized twice. The
+chunks that get embedded never pass the embedder's max length, counting its
+special tokens and the metadata embedded with the text, so nothing is truncated
+at embed time.
+
+Long documents are split at paragraphs into segments that a pool of CHUNK_WORKERS
+processes chunks in parallel.
+"""
+import bisect
+import multiprocessing
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from llama_index.core.schema import MetadataMode, NodeRelationship, TextNode
+from transformers import AutoTokenizer
+
+import utils.hierarchical as hierarchical
+from utils.common import chunk_workers
+
+# a sentence ends at punctuation, closing quotes or brackets and whitespace, or at a blank line
+SENTENCE_END = re.compile(r"[.!?。！？][\"'”’)\]]*\s+|\n\s*\n")
+LINE_END = re.compile(r"\n")
+# documents are split into segments of about this many characters for the workers
+SEGMENT_CHARS = 100_000
+# fewer characters than this are chunked in process, a pool round trip costs more
+PARALLEL_MIN_CHARS = 200_000
+# some tokenizers report a huge model_max_length when the model has no limit
+FALLBACK_MAX_TOKENS = 512
+
+tokenizers = {}
+chunk_pool = None
+pool_lock = threading.Lock()
+stats_lock = threading.Lock()
+stats = {"documents": 0, "chunks": 0, "seconds": 0.0}
+
+
+def get_tokenizer(tokenizer_path):
+    tokenizer = tokenizers.get(tokenizer_path)
+    if tokenizer is None:
+        tokenizer = tokenizers[tokenizer_path] = AutoTokenizer.from_pretrained(
+            tokenizer_path, use_fast=True
+        )
+        if not tokenizer.is_fast:
+            raise ValueError(f"{tokenizer_path} has no fast tokenizer, token offsets need one")
+    return tokenizer
+
+
+def max_tokens(tokenizer):
+    if tokenizer.model_max_length > 100_000:
+        return FALLBACK_MAX_TOKENS
+    return tokenizer.model_max_length
+
+
+def _cut_positions(text, starts, pattern):
+    chars = [m.end() for m in pattern.finditer(text)]
+    return np.unique(np.searchsorted(starts, chars)).tolist()
+
+
+def _last_cut(cuts, low, high):
+    """the largest cut in (low, high], or None."""
+    i = bisect.bisect_right(cuts, high) - 1
+    if i >= 0 and cuts[i] > low:
+        return cuts[i]
+    return None
+
+
+def _first_cut(cuts, low, high):
+    """the smallest cut in [low, high), or None."""
+    i = bisect.bisect_left(cuts, low)
+    if i < len(cuts) and cuts[i] < high:
+        return cuts[i]
+    return None
+
+
+def _split_range(start, stop, size, overlap, cut_levels, fit=None):
+    """
+    token ranges of at most `size` tokens covering [start, stop). `fit` may shrink
+    each range, the next one then starts from the shrunk end so no text is lost.
+    """
+    ranges = []
+    while start < stop:
+        limit = min(start + size, stop)
+        end = limit
+        if limit < stop:
+            # past half the size, prefer the strongest boundary
+            for cuts in cut_levels:
+                cut = _last_cut(cuts, start + size // 2, limit)
+                if cut is not None:
+                    end = cut
+                    break
+        if fit is not None:
+            start, end = fit((start, end))
+        ranges.append((start, end))
+        if end >= stop:
+            break
+        next_start = end
+        if overlap > 0:
+            for cuts in cut_levels:
+                cut = _first_cut(cuts, max(end - overlap, start + 1), end)
+                if cut is not None:
+                    next_start = cut
+                    break
+        start = next_start
+    return ranges
+
+
+def _fit(tokenizer, text, starts, ends, token_range, budget, word_starts):
+    """
+    a chunk that starts inside a word tokenizes differently on its own, shrinks
+    it until its own tokenization fits the budget.
+    """
+    start, end = token_range
+    if start == 0 or word_starts.get(start):
+        return token_range
+    while end > start + 1:
+        chunk_text = text[starts[start] : ends[end - 1]]
+        count = len(tokenizer(chunk_text, add_special_tokens=False)["input_ids"])
+        if count <= budget:
+            break
+        end -= max(count - budget, 1)
+        end = max(end, start + 1)
+    return start, end
+
+
+def chunk_segments(tokenizer_path, segments, sizes):
+    """
+    chunks texts, each with its (size, overlap, child_size, child_overlap) token
+    sizes, child_size None for no children. Returns per text a list of
+    (start, end, [(child_start, child_end), ...]) character spans.
+    """
+    tokenizer = get_tokenizer(tokenizer_path)
+    encodings = tokenizer(
+        segments, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+    )
+    results = []
+    for text, offsets, (size, overlap, child_size, child_overlap) in zip(
+        segments, encodings["offset_mapping"], sizes
+    ):
+        if not offsets:
+            results.append([])
+            continue
+        offsets = np.asarray(offsets)
+        starts, ends = offsets[:, 0], offsets[:, 1]
+        word_start_array = np.nonzero(starts[1:] > ends[:-1])[0] + 1
+        word_starts = dict.fromkeys(word_start_array.tolist(), True)
+        cut_levels = [
+            _cut_positions(text, starts, SENTENCE_END),
+            _cut_positions(text, starts, LINE_END),
+            word_start_array.tolist(),
+        ]
+
+        def fit_to(budget):
+            return lambda token_range: _fit(
+                tokenizer, text, starts, ends, token_range, budget, word_starts
+            )
+
+        spans = []
+        # parents are only embedded, and so fitted, when there are no children
+        parent_fit = fit_to(size) if child_size is None else None
+        for parent in _split_range(0, len(offsets), size, overlap, cut_levels, parent_fit):
+            children = []
+            if child_size is not None:
+                children = _split_range(
+                    *parent, child_size, child_overlap, cut_levels, fit_to(child_size)
+                )
+            spans.append(
+                (
+                    int(starts[parent[0]]),
+                    int(ends[parent[1] - 1]),
+                    [(int(starts[s]), int(ends[e - 1])) for s, e in children],
+                )
+            )
+        results.append(spans)
+    return results
+
+
+def _segments(text):
+    """(offset, segment) pieces of the text, cut at paragraphs near SEGMENT_CHARS."""
+    pieces = []
+    start = 0
+    while len(text) - start > SEGMENT_CHARS:
+        cut = text.rfind("\n\n", start + SEGMENT_CHARS // 2, start + SEGMENT_CHARS)
+        if cut < 0:
+            cut = text.rfind("\n", start + SEGMENT_CHARS // 2, start + SEGMENT_CHARS)
+        if cut < 0:
+            cut = text.rfind(" ", start + SEGMENT_CHARS // 2, start + SEGMENT_CHARS)
+        cut = start + SEGMENT_CHARS if cut < 0 else cut + 1
+        pieces.append((start, text[start:cut]))
+        start = cut
+    pieces.append((start, text[start:]))
+    return pieces
+
+
+def _init_chunk_worker(tokenizer_path):
+    get_tokenizer(tokenizer_path)
+
+
+def get_chunk_pool(tokenizer_path):
+    global chunk_pool
+    with pool_lock:
+        if chunk_pool is None:
+            # spawned, forking a process that already ran a rust tokenizer can deadlock
+            chunk_pool = ProcessPoolExecutor(
+                max_workers=chunk_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_chunk_worker,
+                initargs=(tokenizer_path,),
+            )
+        return chunk_pool
+
+
+def shutdown_chunk_pool():
+    global chunk_pool
+    with pool_lock:
+        if chunk_pool is not None:
+            chunk_pool.shutdown(wait=False, cancel_futures=True)
+            chunk_pool = None
+
+
+def get_chunk_stats():
+    with stats_lock:
+        seconds = stats["seconds"]
+        return {
+            **stats,
+            "seconds": round(seconds, 3),
+            "chunks_per_s": round(stats["chunks"] / seconds, 1) if seconds else None,
+        }
+
+
+class TokenChunker:
+    """
+    cuts documents into parent chunks of `chunk_size` tokens and, with
+    `child_chunk_size`, into children of at most that many tokens.
+    """
+
+    def __init__(
+        self,
+        tokenizer_path,
+        chunk_size=1024,
+        chunk_overlap=128,
+        child_chunk_size=None,
+        child_chunk_overlap=0,
+    ):
+        self.tokenizer_path = tokenizer_path
+        self.tokenizer = get_tokenizer(tokenizer_path)
+        self.max_tokens = max_tokens(self.tokenizer)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.child_chunk_size = child_chunk_size
+        self.child_chunk_overlap = child_chunk_overlap
+        self.special_tokens = len(self.tokenizer("")["input_ids"])
+
+    def embed_budget(self, document):
+        """tokens left for the text of an embedded chunk of this document."""
+        metadata_node = TextNode(
+            text="",
+            metadata=document.metadata,
+            excluded_embed_metadata_keys=document.excluded_embed_metadata_keys
+            + hierarchical.HIDDEN_KEYS,
+        )
+        metadata_text = metadata_node.get_content(metadata_mode=MetadataMode.EMBED)
+        metadata_tokens = len(self.tokenizer(metadata_text, add_special_tokens=False)["input_ids"])
+        # a chunk's first token can merge with the separator, keep a token of slack
+        budget = self.max_tokens - self.special_tokens - metadata_tokens - 1
+        if budget < 16:
+            raise ValueError(
+                f"the metadata of {document.metadata.get('file_name')} takes "
+                f"{metadata_tokens} of the embedder's {self.max_tokens} tokens"
+            )
+        return budget
+
+    def sizes(self, document):
+        budget = self.embed_budget(document)
+        if self.child_chunk_size is None:
+            size = min(self.chunk_size, budget)
+            return size, min(self.chunk_overlap, size // 2), None, 0
+        child_size = min(self.child_chunk_size, budget)
+        return (
+            self.chunk_size,
+            self.chunk_overlap,
+            child_size,
+            min(self.child_chunk_overlap, child_size // 2),
+        )
+
+    def _chunk_spans(self, documents):
+        segments, sizes, owners = [], [], []
+        for doc_index, document in enumerate(documents):
+            document_sizes = self.sizes(document)
+            for offset, segment in _segments(document.text):
+                segments.append(segment)
+                sizes.append(document_sizes)
+                owners.append((doc_index, offset))
+
+        total_chars = sum(len(s) for s in segments)
+        if chunk_workers <= 0 or total_chars < PARALLEL_MIN_CHARS or len(segments) < 2:
+            results = chunk_segments(self.tokenizer_path, segments, sizes)
+        else:
+            pool = get_chunk_pool(self.tokenizer_path)
+            per_task = max(len(segments) // (chunk_workers * 2), 1)
+            futures = [
+                pool.submit(
+                    chunk_segments,
+                    self.tokenizer_path,
+                    segments[i : i + per_task],
+                    sizes[i : i + per_task],
+                )
+                for i in range(0, len(segments), per_task)
+            ]
+            results = [spans for future in futures for spans in future.result()]
+
+        document_spans = [[] for _ in documents]
+        for (doc_index, offset), spans in zip(owners, results):
+            document_spans[doc_index].extend(
+                (offset + start, offset + end, [(offset + s, offset + e) for s, e in children])
+                for start, end, children in spans
+            )
+        return document_spans
+
+    def get_nodes(self, documents):
+        """returns (parent nodes, nodes to embed), the same list without children."""
+        start_time = time.time()
+        parents, embedded = [], []
+        for document, spans in zip(documents, self._chunk_spans(documents)):
+            # hashes the whole document text, once per document
+            source = document.as_related_node_info()
+            document_parents = []
+            for start, end, children in spans:
+                parent = TextNode(
+                    text=document.text[start:end],
+                    metadata=dict(document.metadata),
+                    excluded_embed_metadata_keys=list(document.excluded_embed_metadata_keys),
+                    excluded_llm_metadata_keys=list(document.excluded_llm_metadata_keys),
+                    start_char_idx=start,
+                    end_char_idx=end,
+                )
+                parent.relationships[NodeRelationship.SOURCE] = source
+                if document_parents:
+                    previous = document_parents[-1]
+                    parent.relationships[NodeRelationship.PREVIOUS] = previous.as_related_node_info()
+                    previous.relationships[NodeRelationship.NEXT] = parent.as_related_node_info()
+                document_parents.append(parent)
+                if self.child_chunk_size is None:
+                    embedded.append(parent)
+                else:
+                    embedded.extend(
+                        hierarchical.child_node(parent, s - start, e - start)
+                        for s, e in children
+                    )
+            parents.extend(document_parents)
+
+        seconds = time.time() - start_time
+        with stats_lock:
+            stats["documents"] += len(documents)
+            stats["chunks"] += len(embedded)
+            stats["seconds"] += seconds
+        print(
+            f"chunked {len(documents)} documents into {len(parents)} chunks, "
+            f"{len(embedded)} embedded, in {seconds:.2f}s "
+            f"({len(embedded) / max(seconds, 1e-6):.0f} chunks/s)"
+        )
+        return parents, embedded
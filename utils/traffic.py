@@ -0,0 +1,144 @@
+"""
+Opt-in capture of the queries and ingests the app serves, so production traffic
+can be replayed locally with benchmarks/replay_traffic.py.
+
+Set TRAFFIC_CAPTURE_PATH to a JSONL file and every `infer2` and `ingest` call
+appends one trace to it: collection, start time, phase latencies, token counts
+and, for queries, the retrieved node ids. Query texts and file names are stored
+as sha256 hashes unless TRAFFIC_CAPTURE_TEXT=1.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+from utils.common import traffic_capture_path, traffic_capture_text
+
+capture_lock = threading.Lock()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def write_trace(record):
+    line = json.dumps(record) + "\n"
+    with capture_lock:
+        with open(traffic_capture_path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class Trace:
+    """one request; fields and phase latencies are collected until `finish`."""
+
+    def __init__(self, kind, collection_name):
+        self.start = time.perf_counter()
+        self.record = {
+            "kind": kind,
+            "trace_id": uuid.uuid4().hex,
+            "ts": time.time(),
+            "collection": collection_name,
+        }
+        self.phases = {}
+        self.tokenizer = get_tokenizer()
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def mark(self, phase):
+        """seconds from the start of the request until `phase` was reached."""
+        self.phases.setdefault(phase, round(time.perf_counter() - self.start, 4))
+
+    @contextmanager
+    def timed(self, phase):
+        """adds the time spent in the block to `phase`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = round(self.phases.get(phase, 0.0) + time.perf_counter() - start, 4)
+
+    def set_query(self, query_text):
+        self.record["query_hash"] = text_hash(query_text)
+        self.record["query_chars"] = len(query_text)
+        if traffic_capture_text:
+            self.record["query"] = query_text
+        self.record["prompt_tokens"] = len(self.tokenizer(query_text))
+        self.record["completion_tokens"] = 0
+
+    def set_nodes(self, nodes):
+        self.record["node_ids"] = [n.node.node_id for n in nodes]
+        self.record["scores"] = [round(n.score or 0.0, 4) for n in nodes]
+        self.record["prompt_tokens"] += sum(
+            len(self.tokenizer(n.node.get_content(metadata_mode=MetadataMode.LLM)))
+            for n in nodes
+        )
+
+    def token(self):
+        self.mark("first_token_s")
+        self.record["completion_tokens"] += 1
+
+    def add_file(self, path, chunk_count, vector_count):
+        entry = {
+            "file_hash": text_hash(os.path.basename(path)),
+            "ext": os.path.splitext(path)[1].lower(),
+            "size": os.path.getsize(path) if os.path.exists(path) else None,
+            "chunks": chunk_count,
+            "vectors": vector_count,
+        }
+        if traffic_capture_text:
+            entry["path"] = path
+        self.record.setdefault("files", []).append(entry)
+
+    def finish(self, error=None):
+        self.phases["total_s"] = round(time.perf_counter() - self.start, 4)
+        self.record["phases"] = self.phases
+        self.record["error"] = error
+        try:
+            write_trace(self.record)
+        except OSError as e:
+            print(f"failed to write traffic trace: {e}")
+
+
+class NullTrace:
+    """stands in for Trace when capture is off."""
+
+    def set(self, **fields):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    @contextmanager
+    def timed(self, phase):
+        yield
+
+    def set_query(self, query_text):
+        pass
+
+    def set_nodes(self, nodes):
+        pass
+
+    def token(self):
+        pass
+
+    def add_file(self, path, chunk_count, vector_count):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+
+null_trace = NullTrace()
+
+
+def start_trace(kind, collection_name):
+    if not traffic_capture_path:
+        return null_trace
+    return Trace(kind, collection_name)
@@ -1,6 +1,5 @@
 from milvus import default_server
 from pymilvus import (
-    connections,
     FieldSchema,
     CollectionSchema,
     DataType,
@@ -11,35 +10,39 @@ import socket
 from contextlib import closing
 import subprocess
 
+import utils.milvus_connection as milvus_connection
+
 
 def start_milvus():
-    if check_socket("localhost", default_server.listen_port):
-        return utility.get_server_version()
+    state = milvus_connection.health(refresh=True)
+    if state["up"]:
+        return state["version"]
 
     # Start Milvus Vector DB
     default_server.set_base_dir("milvus-data")
     default_server.start()
 
     try:
-        connections.connect(
-            alias="default", host="localhost", port=default_server.listen_port
-        )
+        milvus_connection.connect_default()
     except Exception as e:
         default_server.stop()
         raise e
 
-    return utility.get_server_version()
+    return milvus_connection.health(refresh=True)["version"]
 
 
 def stop_milvus():
     # Stop Milvus Vector DB
     default_server.stop()
+    # the pooled connections stay open and reconnect once milvus is back
+    milvus_connection.invalidate_health()
     return "Milvus stopped"
 
 
 def get_milvus_status():
-    if check_socket("localhost", default_server.listen_port):
-        return f"milvus is running. version = {utility.get_server_version()}"
+    state = milvus_connection.health()
+    if state["up"]:
+        return f"milvus is running. version = {state['version']}"
 
     return f"milvus is stopped"
 
@@ -94,3 +97,15 @@ def create_milvus_collection(collection_name, dim):
     }
     collection.create_index(field_name="embedding", index_params=index_params)
     return collection
+
+
+def drop_milvus_collection(collection_name):
+    if not utility.has_collection(collection_name):
+        return f"collection {collection_name} does not exist"
+    utility.drop_collection(collection_name)
+    return f"collection {collection_name} dropped"
+
+
+def rename_milvus_collection(old_name, new_name):
+    utility.rename_collection(old_name, new_name)
+    return f"collection {old_name} renamed to {new_name}"
@@ -1,21 +1,48 @@
 import os
+import shutil
 import utils.vector_db_utils as vector_db
+import utils.catalog as catalog
+from utils.common import vector_db_backend, supported_vector_db_backends
+from utils.local_vector_store import LocalVectorStore, LOCAL_VECTOR_DATA_DIR
+from utils.milvus_store import PartitionedMilvusVectorStore
+import utils.milvus_residency as milvus_residency
+import utils.parent_store as parent_store
+
+if vector_db_backend not in supported_vector_db_backends:
+    raise ValueError(
+        f"unsupported vector db backend {vector_db_backend}, use one of {supported_vector_db_backends}"
+    )
+
+
+def is_milvus_backend():
+    return vector_db_backend == "milvus"
 
 
 def start_vector_db():
-    return vector_db.start_milvus()
+    if is_milvus_backend():
+        return vector_db.start_milvus()
+    os.makedirs(LOCAL_VECTOR_DATA_DIR, exist_ok=True)
+    return f"local vector store at {LOCAL_VECTOR_DATA_DIR}"
 
 
 def vector_db_status():
-    return vector_db.get_milvus_status()
+    if is_milvus_backend():
+        return vector_db.get_milvus_status()
+    return f"local vector store is running. data dir = {LOCAL_VECTOR_DATA_DIR}"
 
 
 def reset_vector_db():
-    return vector_db.reset_data()
+    parent_store.reset()
+    if is_milvus_backend():
+        return vector_db.reset_data()
+    shutil.rmtree(LOCAL_VECTOR_DATA_DIR, ignore_errors=True)
+    return start_vector_db()
 
 
 def stop_vector_db():
-    return vector_db.stop_milvus()
+    if is_milvus_backend():
+        return vector_db.stop_milvus()
+    return "local vector store stopped"
 
 
 def create_or_get_vector_db_collection(collection_name="default_collection", dim=1024):
@@ -23,3 +50,39 @@ def create_or_get_vector_db_collection(collection_name="default_collection", dim
     dim = dim
     vector_db.create_milvus_collection(collection_name=collection_name, dim=dim)
     return f"collection {collection_name} created with dim {dim}"
+
+
+def get_vector_store(collection_name, dim=1024):
+    catalog.check_collection_name(collection_name)
+    if is_milvus_backend():
+        vector_store = PartitionedMilvusVectorStore(dim=dim, collection_name=collection_name)
+        # the store loads the collection when it is created, count it as resident
+        milvus_residency.ensure_loaded(collection_name)
+        return vector_store
+    return LocalVectorStore(collection_name=collection_name, dim=dim)
+
+
+def delete_vector_db_collection(collection_name):
+    catalog.check_collection_name(collection_name)
+    parent_store.drop_collection(collection_name)
+    if is_milvus_backend():
+        milvus_residency.forget(collection_name)
+        return vector_db.drop_milvus_collection(collection_name)
+    shutil.rmtree(os.path.join(LOCAL_VECTOR_DATA_DIR, collection_name), ignore_errors=True)
+    return f"collection {collection_name} dropped"
+
+
+def rename_vector_db_collection(old_name, new_name):
+    """renames a collection to a name that is not in use."""
+    catalog.check_collection_name(old_name)
+    catalog.check_collection_name(new_name)
+    parent_store.rename_collection(old_name, new_name)
+    if is_milvus_backend():
+        milvus_residency.forget(old_name)
+        milvus_residency.forget(new_name)
+        return vector_db.rename_milvus_collection(old_name, new_name)
+    os.replace(
+        os.path.join(LOCAL_VECTOR_DATA_DIR, old_name),
+        os.path.join(LOCAL_VECTOR_DATA_DIR, new_name),
+    )
+    return f"collection {old_name} renamed to {new_name}"